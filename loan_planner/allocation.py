@@ -0,0 +1,239 @@
+'''
+allocation
+'''
+import collections
+import heapq
+import math
+
+import loan_config
+
+def allocate_dollars(heuristic, loans, dollars, daysSinceLastPayment, isEligible, giveDollars):
+    '''
+    Give the given number of dollars, one at a time, to the eligible loan
+    chosen by the given heuristic. Return a dictionary mapping each loan to the
+    number of dollars it was given.
+
+    The loans which are eligible are decided by the given predicate, and the
+    given function is called as giveDollars(loan, dollars) to give a whole
+    number of dollars to a loan, with the same result as giving one dollar at a
+    time. A loan which is not given any dollars must not change eligibility.
+    '''
+    priorityKey = getattr(heuristic, 'priorityKey', None)
+
+    if priorityKey:
+        allocator = PriorityAllocator(priorityKey, loans, daysSinceLastPayment, isEligible, giveDollars)
+        return allocator.allocate(dollars)
+
+    allocatedDollars = collections.defaultdict(int)
+
+    for dollar in xrange(dollars):
+        eligibleLoans = filter(isEligible, loans)
+
+        if not eligibleLoans:
+            break
+
+        loan = heuristic(eligibleLoans, daysSinceLastPayment)
+
+        giveDollars(loan, 1)
+        allocatedDollars[loan] += 1
+
+    return allocatedDollars
+
+def allocate_upfront_payment(heuristic, loans, upfrontPayment, freedLoans=()):
+    '''
+    Use the given heuristic to give the given upfront payment to the given
+    loans. The monthly payment of each loan which is then paid off is given to
+    the loans which are still unpaid, except for the given loans whose monthly
+    payments have already been given to other loans.
+    '''
+    freedLoans = set(freedLoans)
+
+    unpaid = lambda x: x.balance > 0
+    paid = lambda x: (x.balance <= 0) and (x not in freedLoans)
+
+    allocate_dollars(heuristic, loans, int(upfrontPayment), loan_config.LoanConfig.DAYS_PER_MONTH, unpaid,
+        loan_config.Loan.make_upfront_payment)
+
+    # Reallocate the monthly payments of any loans paid off upfront
+    freedPayment = sum(int(loan.monthlyPayment) for loan in filter(paid, loans))
+
+    allocate_dollars(heuristic, loans, freedPayment, loan_config.LoanConfig.DAYS_PER_MONTH, unpaid,
+        loan_config.Loan.increase_monthly_payment)
+
+def allocate_monthly_increase(heuristic, loans, monthlyIncrease):
+    '''
+    Use the given heuristic to give the given monthly payment increase to the
+    given loans which are still unpaid.
+    '''
+    unpaid = lambda x: x.balance > 0
+
+    allocate_dollars(heuristic, loans, int(monthlyIncrease), loan_config.LoanConfig.DAYS_PER_MONTH, unpaid,
+        loan_config.Loan.increase_monthly_payment)
+
+class PriorityAllocator(object):
+    '''
+    Class to give dollars to loans using a heuristic's priority key, with the
+    same result as calling the heuristic once per dollar. Each dollar goes to
+    the eligible loan with the lowest key at that time, and a loan's key never
+    decreases as it is given dollars, so runs of dollars given to the same loan
+    can be found by searching over their length.
+    '''
+    def __init__(self, priorityKey, loans, daysSinceLastPayment, isEligible, giveDollars):
+        self.priorityKey = priorityKey
+        self.loans = loans
+        self.daysSinceLastPayment = daysSinceLastPayment
+        self.isEligible = isEligible
+        self.giveDollars = giveDollars
+
+        self.allocatedDollars = collections.defaultdict(int)
+
+    def allocate(self, dollars):
+        '''
+        Give the given number of dollars to the loans. The eligible loans are
+        kept in a heap ordered by their keys. The loan at the top of the heap is
+        given dollars until either it is no longer eligible or its key rises
+        above the key of the next loan in the heap, and is then pushed back onto
+        the heap with its new key. If the runs become short enough that the
+        dollars would be handed out nearly one at a time, the rest are found by
+        selection instead. Return a dictionary mapping each loan to the number
+        of dollars it was given.
+        '''
+        heap = [self.get_priority(index, 0) for index in xrange(len(self.loans))]
+        heap = [x for x in heap if x[0] == 0]
+        heapq.heapify(heap)
+
+        [runs, given] = [0, 0]
+
+        while (dollars > 0) and heap:
+            if (runs > len(heap)) and self._should_select(len(heap), dollars, given / float(runs)):
+                self._allocate_by_selection([x[2] for x in heap], dollars)
+                break
+
+            index = heapq.heappop(heap)[2]
+            nextBest = heap[0] if heap else (1, )
+
+            run = count_while(lambda x: self.get_priority(index, x) < nextBest, 1, dollars)
+            self._give_dollars(index, run)
+
+            priority = self.get_priority(index, 0)
+
+            if priority[0] == 0:
+                heapq.heappush(heap, priority)
+
+            runs += 1
+            given += run
+            dollars -= run
+
+        return self.allocatedDollars
+
+    def get_priority(self, index, given):
+        '''
+        Return the priority of the given loan after being given the given
+        number of dollars. Loans which are no longer eligible come after all
+        eligible loans, and ties are broken by position in the loan list.
+        '''
+        loan = self.loans[index].clone()
+        self.giveDollars(loan, given)
+
+        if not self.isEligible(loan):
+            return (1, index, given)
+
+        return (0, self.priorityKey(loan, self.daysSinceLastPayment), index, given)
+
+    def _should_select(self, loans, dollars, averageRun):
+        '''
+        Decide if it would be quicker to find the remaining dollars by selection
+        than to keep handing out runs of dollars of about the given length.
+        '''
+        runCost = (dollars / averageRun) * (math.log(averageRun + 1, 2) + math.log(loans + 1, 2))
+        selectionCost = loans * math.log(loans * dollars + 1, 4.0 / 3.0) * math.log(dollars + 1, 2)
+
+        return (selectionCost < runCost)
+
+    def _allocate_by_selection(self, indices, dollars):
+        '''
+        Give the given number of dollars to the given loans by selection. The
+        dollars given are the lowest of the priorities each loan would have
+        after being given each number of dollars, and each loan's priorities
+        only increase. So they are found like a selection over sorted lists, by
+        repeatedly counting the priorities below the weighted median of each
+        list's middle priority.
+        '''
+        lower = dict((index, 0) for index in indices)
+        upper = dict((index, dollars) for index in indices)
+
+        while dollars > 0:
+            indices = [index for index in indices if lower[index] < upper[index]]
+
+            if sum(upper[index] - lower[index] for index in indices) <= dollars:
+                lower = upper
+                break
+
+            middles = [(self.get_priority(index, (lower[index] + upper[index]) // 2), \
+                upper[index] - lower[index]) for index in indices]
+            middles.sort()
+
+            weight = sum(x[1] for x in middles) / 2.0
+
+            for [pivot, size] in middles:
+                weight -= size
+
+                if weight <= 0:
+                    break
+
+            below = dict((index, count_while(lambda x: self.get_priority(index, x) < pivot,
+                lower[index], upper[index])) for index in indices)
+
+            count = sum(below[index] - lower[index] for index in indices)
+
+            if count >= dollars:
+                upper.update(below)
+            else:
+                lower.update(below)
+                lower[pivot[-2]] += 1
+                dollars -= count + 1
+
+        # Loans which became ineligible only keep the dollars given before then
+        for [index, given] in lower.iteritems():
+            if given and (self.get_priority(index, given - 1)[0] != 0):
+                given = count_while(lambda x: self.get_priority(index, x)[0] == 0, 0, given)
+
+            self._give_dollars(index, given)
+
+    def _give_dollars(self, index, given):
+        '''
+        Give the given number of dollars to the given loan.
+        '''
+        if given > 0:
+            self.giveDollars(self.loans[index], given)
+            self.allocatedDollars[self.loans[index]] += given
+
+def count_while(predicate, start, stop):
+    '''
+    Given a predicate which holds for numbers from the start up to some point
+    and not after it, return the first number in [start, stop) for which the
+    predicate does not hold, or stop if it holds for all of them. The search
+    doubles its step from the start before bisecting, so that it is quick when
+    the predicate stops holding soon after the start.
+    '''
+    step = 1
+
+    while start < stop:
+        probe = min(start + step - 1, stop - 1)
+
+        if not predicate(probe):
+            stop = probe
+            break
+
+        start = probe + 1
+        step *= 2
+
+    while start < stop:
+        middle = (start + stop) // 2
+
+        if predicate(middle):
+            start = middle + 1
+        else:
+            stop = middle
+
+    return start
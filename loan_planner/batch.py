@@ -0,0 +1,216 @@
+'''
+Plan a batch of loan portfolios across worker processes, streaming one JSON
+result per portfolio as each plan is found.
+
+Portfolios are read either from a directory of INI files, or from a JSONL
+stream with one portfolio per line. A JSON portfolio holds the same options as
+an INI file, with loans given as a list:
+
+{"Id": "1", "Options": {"UpfrontPayment": 1234}, "Loans": [{"Name": "Loan 1",
+ "Balance": 10000, "InterestRate": 4.0, "MonthlyPayment": 50, "PaymentDay": 18}]}
+
+Example
+-------
+python batch.py -i portfolios/
+python batch.py -i portfolios.jsonl -o results.jsonl -j 8
+'''
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import threading
+
+import checkpoint
+import heuristic_stats
+import loan_planner
+import payment_device
+import result_cache
+
+# Number of portfolios which may be read ahead of the results, per worker
+PENDING_PER_JOB = 4
+
+# Optional key used to identify a JSON portfolio in its result
+ID = 'Id'
+
+# Result cache of each cache directory used by this process
+_resultCaches = dict()
+
+# Statistics of which heuristics found the best plans in this process
+_heuristicStats = None
+
+def get_result_cache(cacheDir):
+    '''
+    Return this process's result cache for the given cache directory, so that
+    the in-memory tier is shared by all portfolios planned by the process.
+    '''
+    if cacheDir not in _resultCaches:
+        _resultCaches[cacheDir] = result_cache.ResultCache(cacheDir)
+
+    return _resultCaches[cacheDir]
+
+def get_heuristic_stats():
+    '''
+    Return this process's heuristic statistics, so that every portfolio planned
+    by the process simulates the heuristics which have most often found the
+    best plans first.
+    '''
+    global _heuristicStats
+
+    if _heuristicStats is None:
+        _heuristicStats = heuristic_stats.HeuristicStats()
+
+    return _heuristicStats
+
+def read_portfolios(inputPath):
+    '''
+    Generate a source and portfolio for each portfolio in the given input. A
+    directory is read as a set of INI files, which are left to be parsed from
+    their source path. Any other path, or "-" for standard input, is read as a
+    JSONL stream of portfolios, which are left as unparsed lines.
+    '''
+    if os.path.isdir(inputPath):
+        for path in sorted(glob.glob(os.path.join(inputPath, '*.ini'))):
+            yield [path, None]
+
+        return
+
+    stream = sys.stdin if (inputPath == '-') else open(inputPath)
+
+    try:
+        for [lineNumber, line] in enumerate(stream, 1):
+            if line.strip():
+                yield ['%s:%d' % (inputPath, lineNumber), line]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def plan_portfolio(source, line, engine=payment_device.DEFAULT_ENGINE, cacheDir=None, memoize=False):
+    '''
+    Find the best payment plan for a single portfolio, given either as a JSON
+    line or as the path to an INI file. Return the result as a dict. A
+    portfolio which cannot be planned results in an error rather than ending
+    the batch. Simulation results are cached in the given directory, or only
+    in memory if memoize is given without a directory.
+    '''
+    result = {'config' : source}
+
+    try:
+        portfolio = json.loads(line) if line else None
+        cache = get_result_cache(cacheDir) if (cacheDir or memoize) else None
+
+        loanPlanner = loan_planner.LoanPlanner(source, engine, portfolio=portfolio, cache=cache,
+            checkpoints=checkpoint.CheckpointStore(), heuristicStats=get_heuristic_stats())
+        loanPlanner.find_best_plan()
+
+        result = loanPlanner.to_dict()
+
+        if portfolio and (ID in portfolio):
+            result[ID] = portfolio[ID]
+    except Exception as ex:
+        result['success'] = False
+        result['error'] = '%s: %s' % (type(ex).__name__, ex)
+
+    return result
+
+def _plan_portfolio(args):
+    '''
+    Find the best payment plan for a single portfolio in a worker process.
+    '''
+    return plan_portfolio(*args)
+
+def imap_bounded(function, tasks, jobs=None):
+    '''
+    Apply the given function to each of the given tasks in a pool of worker
+    processes. Generate each result as soon as it is found, in the order the
+    tasks finish. Only a bounded number of tasks are read ahead of the results,
+    so that neither the tasks nor the results are held in memory.
+    '''
+    jobs = jobs or multiprocessing.cpu_count()
+
+    # The pool pulls tasks from a background thread, which blocks here until a
+    # result has been taken for a previous task
+    pending = threading.Semaphore(jobs * PENDING_PER_JOB)
+    stopped = threading.Event()
+
+    def get_tasks():
+        for task in tasks:
+            pending.acquire()
+
+            if stopped.is_set():
+                return
+
+            yield task
+
+    pool = multiprocessing.Pool(jobs)
+
+    try:
+        for result in pool.imap_unordered(function, get_tasks()):
+            pending.release()
+            yield result
+    except:
+        # Wake the task thread so that it sees the tasks have stopped
+        stopped.set()
+        pending.release()
+
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+def plan_portfolios(portfolios, engine=payment_device.DEFAULT_ENGINE, jobs=None, cacheDir=None):
+    '''
+    Find the best payment plan for each of the given portfolios in a pool of
+    worker processes. Generate each result as soon as it is found, in the
+    order the plans finish.
+    '''
+    tasks = ([source, line, engine, cacheDir] for [source, line] in portfolios)
+    return imap_bounded(_plan_portfolio, tasks, jobs)
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+
+    parser.add_argument(
+        '-i', '--input', dest='input', required=True,
+        help='Directory of INI files, or JSONL file of portfolios ("-" for stdin)')
+
+    parser.add_argument(
+        '-o', '--output', dest='output', default='-',
+        help='Path to JSONL results file ("-" for stdout)')
+
+    parser.add_argument(
+        '-e', '--engine', dest='engine', choices=loan_planner.ENGINE_NAMES,
+        default=payment_device.DEFAULT_ENGINE, help='Payment simulation engine')
+
+    parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=multiprocessing.cpu_count(),
+        help='Number of processes to plan portfolios with')
+
+    parser.add_argument(
+        '--cache-dir', dest='cache_dir', default=None,
+        help='Directory in which to cache simulation results between runs')
+
+    args = parser.parse_args()
+
+    output = sys.stdout if (args.output == '-') else open(args.output, 'w')
+    success = True
+
+    try:
+        for result in plan_portfolios(read_portfolios(args.input), args.engine, args.jobs, args.cache_dir):
+            output.write(json.dumps(result, sort_keys=True) + '\n')
+            output.flush()
+
+            success = success and result['success']
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    return success
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,8 @@
+'''
+Run the benchmark suite.
+'''
+import sys
+
+import suite
+
+sys.exit(0 if suite.main() else 1)
@@ -0,0 +1,53 @@
+'''
+generator
+'''
+import random
+
+import loan_config
+
+# Range of balances of generated loans
+MIN_BALANCE = 1000.0
+MAX_BALANCE = 50000.0
+
+def generate_portfolio(seed, loanCount, minInterestRate=1.0, maxInterestRate=9.0, paymentDays=range(1, 32),
+        amortization=2.0, upfrontFraction=0.0, increaseFraction=0.0):
+    '''
+    Generate a synthetic portfolio of loans, as a dict which may be given to
+    LoanConfig. Balances, interest rates and payment days are chosen at random
+    using the given seed. Each monthly payment is the interest accrued in an
+    average month multiplied by the given amortization factor, so a factor
+    close to 1 results in loans which are barely paid down. The upfront payment
+    and monthly increase are given as fractions of the total balance and total
+    monthly payment.
+    '''
+    rand = random.Random(seed)
+    loans = list()
+
+    for index in xrange(loanCount):
+        balance = round(rand.uniform(MIN_BALANCE, MAX_BALANCE), 2)
+        interestRate = round(rand.uniform(minInterestRate, maxInterestRate), 2)
+
+        monthlyInterest = balance * (interestRate / 100.0) * (loan_config.LoanConfig.DAYS_PER_MONTH / 365.0)
+        monthlyPayment = round(max(monthlyInterest * amortization, 1.0), 2)
+
+        loans.append({
+            loan_config.LoanConfig.NAME : 'Loan %d' % (index + 1),
+            loan_config.LoanConfig.BALANCE : balance,
+            loan_config.LoanConfig.INTEREST_RATE : interestRate,
+            loan_config.LoanConfig.MONTHLY_PAYMENT : monthlyPayment,
+            loan_config.LoanConfig.PAYMENT_DAY : rand.choice(paymentDays)
+        })
+
+    totalBalance = sum(x[loan_config.LoanConfig.BALANCE] for x in loans)
+    totalMonthlyPayment = sum(x[loan_config.LoanConfig.MONTHLY_PAYMENT] for x in loans)
+
+    options = {
+        loan_config.LoanConfig.UPFRONT_PAYMENT : int(totalBalance * upfrontFraction),
+        loan_config.LoanConfig.MONTHLY_INCREASE : int(totalMonthlyPayment * increaseFraction),
+        loan_config.LoanConfig.DATE_OF_BIRTH : '01/01/1990'
+    }
+
+    return {
+        loan_config.LoanConfig.OPTIONS : options,
+        loan_config.LoanConfig.LOANS : loans
+    }
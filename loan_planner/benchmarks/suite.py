@@ -0,0 +1,236 @@
+'''
+Time the loan planner on seeded synthetic portfolios, and report the timings
+as JSON so that runs may be compared. For each case, the whole search for the
+best plan is timed, along with each heuristic's simulation before and after
+the user-specified payment changes, broken down by simulation phase. If more
+than one job is given, the best plan is also found in a process pool, and the
+suite fails if it differs from the best plan found serially.
+
+Run from the loan_planner directory.
+
+Example
+-------
+python -m benchmarks
+python -m benchmarks -e event -c medium -c near_zero_amortization -r 3 -o before.json
+python -m benchmarks -c small -c medium -j 4
+'''
+import argparse
+import json
+import platform
+import random
+import sys
+import timeit
+
+import heuristics
+import loan_planner
+import payment_device
+
+import generator
+
+# Benchmark cases, with the options used to generate each case's portfolio
+CASES = [
+    ['small', dict(loanCount=4, upfrontFraction=0.05, increaseFraction=0.1)],
+    ['medium', dict(loanCount=20, upfrontFraction=0.05, increaseFraction=0.1)],
+    ['large', dict(loanCount=100, upfrontFraction=0.05, increaseFraction=0.1)],
+    ['large_upfront', dict(loanCount=20, upfrontFraction=0.9, increaseFraction=0.1)],
+    ['near_zero_amortization', dict(loanCount=10, minInterestRate=4.0, amortization=1.05, increaseFraction=0.01)],
+]
+
+# Methods of a payment device timed as each phase of a simulation
+PHASES = [
+    ['schedule', '_schedule_payments'],
+    ['payments', '_make_payments_until_loan_paid'],
+    ['reallocation', '_handle_paid_loans'],
+    ['stats', '_collect_payment_stats'],
+]
+
+DEFAULT_SEED = 1
+
+def get_timed_device_class(paymentDeviceClass):
+    '''
+    Return a subclass of the given payment device class which records the
+    time spent in each phase of a simulation.
+    '''
+    def time_phase(phase, method):
+        def timed(self, *args):
+            start = timeit.default_timer()
+            ret = method(self, *args)
+            self.phaseTimes[phase] += timeit.default_timer() - start
+
+            return ret
+
+        return timed
+
+    attributes = dict((x, time_phase(phase, getattr(paymentDeviceClass, x))) for [phase, x] in PHASES)
+    return type('Timed' + paymentDeviceClass.__name__, (paymentDeviceClass, ), attributes)
+
+def time_best_plan(name, portfolio, engine, seed, jobs=1):
+    '''
+    Time the search for the best payment plan of the given portfolio, using the
+    given number of processes.
+    '''
+    random.seed(seed)
+
+    loanPlanner = loan_planner.LoanPlanner(name, engine, jobs=jobs, portfolio=portfolio)
+
+    start = timeit.default_timer()
+    loanPlanner.find_best_plan()
+    seconds = timeit.default_timer() - start
+
+    bestPlan = loanPlanner.bestChangedPlan or loanPlanner.bestInitialPlan
+
+    return {
+        'seconds' : seconds,
+        'success' : bool(bestPlan),
+        'amountPaid' : bestPlan.paymentStats.amountPaid if bestPlan else None
+    }
+
+def time_simulation(timedDeviceClass, dateOfBirth, loans, heuristic, seed):
+    '''
+    Time the payment of the given loans using the given heuristic, without
+    pruning against any other plan.
+    '''
+    random.seed(seed)
+
+    paymentDevice = timedDeviceClass(dateOfBirth, loans, heuristic)
+    paymentDevice.phaseTimes = dict((phase, 0.0) for [phase, _] in PHASES)
+
+    start = timeit.default_timer()
+    success = paymentDevice.pay_loans()
+    seconds = timeit.default_timer() - start
+
+    return {
+        'seconds' : seconds,
+        'success' : success,
+        'amountPaid' : paymentDevice.paymentStats.amountPaid,
+        'phases' : paymentDevice.phaseTimes
+    }
+
+def time_allocation(loanPlanner, heuristic, seed):
+    '''
+    Time the allocation of the user-specified payment changes using the given
+    heuristic. Return the time and the changed loans.
+    '''
+    random.seed(seed)
+
+    start = timeit.default_timer()
+    loans = loanPlanner.get_changed_loans(heuristic)
+    seconds = timeit.default_timer() - start
+
+    return [seconds, loans]
+
+def fastest(results):
+    '''
+    Return the fastest of the given timing results.
+    '''
+    return min(results, key=lambda x: x['seconds'])
+
+def run_case(name, options, engine, seed, repeat, jobs=1):
+    '''
+    Generate the portfolio of a single benchmark case, and time the planner on
+    it. Each timing is the fastest of the given number of repeats. If more than
+    one job is given, also time the planner in a process pool, and check that
+    every repeat finds the same best plan as the serial search.
+    '''
+    portfolio = generator.generate_portfolio(seed, **options)
+    timedDeviceClass = get_timed_device_class(loan_planner.get_engine(engine))
+
+    loanPlanner = loan_planner.LoanPlanner(name, engine, portfolio=portfolio)
+    loanConfig = loanPlanner.loanConfig
+
+    result = {
+        'name' : name,
+        'seed' : seed,
+        'loans' : len(loanConfig.loans),
+        'upfrontPayment' : loanConfig.upfrontPayment,
+        'monthlyIncrease' : loanConfig.monthlyIncrease,
+        'findBestPlan' : fastest([time_best_plan(name, portfolio, engine, seed) for _ in xrange(repeat)]),
+        'heuristics' : dict()
+    }
+
+    if jobs > 1:
+        parallel = [time_best_plan(name, portfolio, engine, seed, jobs) for _ in xrange(repeat)]
+        amountPaid = result['findBestPlan']['amountPaid']
+
+        result['findBestPlanParallel'] = fastest(parallel)
+        result['findBestPlanParallel']['matchesSerial'] = all((x['amountPaid'] == amountPaid) for x in parallel)
+
+    for heuristic in heuristics.ALL_HEURISTICS:
+        initialLoans = loanConfig.loans
+        timings = {
+            'initial' : fastest([time_simulation(timedDeviceClass, loanConfig.dateOfBirth, initialLoans, heuristic, seed) \
+                for _ in xrange(repeat)])
+        }
+
+        if loanConfig.any_changes():
+            allocations = [time_allocation(loanPlanner, heuristic, seed) for _ in xrange(repeat)]
+            changedLoans = allocations[0][1]
+
+            timings['changed'] = fastest([time_simulation(timedDeviceClass, loanConfig.dateOfBirth, changedLoans, heuristic, seed) \
+                for _ in xrange(repeat)])
+            timings['changed']['allocation'] = min(x[0] for x in allocations)
+
+        result['heuristics'][heuristic.__name__] = timings
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+
+    parser.add_argument(
+        '-c', '--case', dest='cases', action='append', choices=[x[0] for x in CASES],
+        help='Benchmark case to run, may be given more than once (default: all cases)')
+
+    parser.add_argument(
+        '-e', '--engine', dest='engine', choices=loan_planner.ENGINE_NAMES,
+        default=payment_device.DEFAULT_ENGINE, help='Payment simulation engine')
+
+    parser.add_argument(
+        '-s', '--seed', dest='seed', type=int, default=DEFAULT_SEED,
+        help='Seed used to generate portfolios and for random heuristics')
+
+    parser.add_argument(
+        '-r', '--repeat', dest='repeat', type=int, default=1,
+        help='Number of times to repeat each timing, keeping the fastest')
+
+    parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=1,
+        help='Number of processes to also find the best plan with, checking it matches the serial plan')
+
+    parser.add_argument(
+        '-o', '--output', dest='output', default='-',
+        help='Path to JSON results file ("-" for stdout)')
+
+    args = parser.parse_args()
+
+    results = {
+        'engine' : args.engine,
+        'seed' : args.seed,
+        'repeat' : args.repeat,
+        'jobs' : args.jobs,
+        'python' : platform.python_version(),
+        'cases' : list()
+    }
+
+    for [name, options] in CASES:
+        if not args.cases or (name in args.cases):
+            results['cases'].append(run_case(name, options, args.engine, args.seed, args.repeat, args.jobs))
+
+    output = sys.stdout if (args.output == '-') else open(args.output, 'w')
+
+    try:
+        json.dump(results, output, indent=2, separators=(',', ': '), sort_keys=True)
+        output.write('\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    mismatches = [x['name'] for x in results['cases'] if not x.get('findBestPlanParallel', {}).get('matchesSerial', True)]
+
+    if mismatches:
+        print >> sys.stderr, 'Parallel plans differ from serial plans: %s' % (', '.join(mismatches))
+        return False
+
+    return True
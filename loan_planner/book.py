@@ -0,0 +1,419 @@
+'''
+Project the payoff of a book of borrowers, each with their own loans and date
+of birth, and report aggregate statistics of the best plan of every borrower.
+
+Borrowers are read in the same formats as the batch planner, and are split
+into shards which are planned across worker processes. Each shard is reduced
+to fixed-size aggregates, and shards are merged as they finish, so memory does
+not grow with the size of the book. The aggregates are the interest paid in
+each month, a histogram of payoff months, and totals of the amounts paid.
+
+Example
+-------
+python book.py -i borrowers.jsonl -j 8
+python book.py -i borrowers.jsonl -o book.json --shard-size 500
+'''
+import argparse
+import array
+import datetime
+import json
+import multiprocessing
+import random
+import sys
+
+import batch
+import checkpoint
+import loan_planner
+import payment_device
+
+# Default number of borrowers planned together by a worker process
+DEFAULT_SHARD_SIZE = 250
+
+# Number of months tracked by the aggregates, after which any interest and
+# payoffs are counted in a final bucket
+HORIZON_MONTHS = 50 * 12
+
+# Percentiles of the payoff month reported
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# Number of errors whose source and message are kept as examples
+MAX_ERROR_SAMPLES = 10
+
+# Checkpoints and interest curve sink of the plans simulated by a worker
+# process, reused for every borrower planned by the process
+_checkpoints = None
+_sink = None
+
+def get_month(date):
+    '''
+    Return the given date's month, counted in months since the start of year
+    zero.
+    '''
+    return (date.year * 12) + date.month - 1
+
+def get_month_label(month):
+    '''
+    Return the given month, counted in months since the start of year zero, as
+    its year and month.
+    '''
+    [year, monthOfYear] = divmod(month, 12)
+    return '%04d-%02d' % (year, monthOfYear + 1)
+
+class InterestCurveSink(object):
+    '''
+    Class to sum the interest of each payment of a payment device by month, in
+    place of a schedule sink. Months are counted from a start month, and any
+    past the horizon are counted in the final month. A single sink is reused
+    for every borrower planned by a process, so its buffer is only allocated
+    once, and only the months a plan paid interest in are cleared.
+    '''
+    def __init__(self):
+        self.interestCurve = array.array('d', [0.0]) * (HORIZON_MONTHS + 1)
+        self.startMonth = 0
+
+        self.loanIndices = dict()
+        [self.firstIndex, self.lastIndex] = [HORIZON_MONTHS + 1, -1]
+
+    def reset(self, startMonth):
+        '''
+        Clear the interest summed for the last plan, and count months from the
+        given start month.
+        '''
+        for index in xrange(self.firstIndex, self.lastIndex + 1):
+            self.interestCurve[index] = 0.0
+
+        self.startMonth = startMonth
+        [self.firstIndex, self.lastIndex] = [HORIZON_MONTHS + 1, -1]
+
+    def open(self, loans):
+        '''
+        Index the given loans, which are only needed to accept payment records.
+        '''
+        self.loanIndices = dict((x.name, i) for [i, x] in enumerate(loans))
+
+    def is_open(self):
+        '''
+        Return true, as payment records may always be summed by the sink.
+        '''
+        return True
+
+    def get_loan_index(self, loan):
+        '''
+        Return the index of the given loan in the loans last opened.
+        '''
+        return self.loanIndices[loan.name]
+
+    def write(self, date, loan, interest, principal, balance):
+        '''
+        Add the interest of a single payment record to the month of its date.
+        The loan, principal and balance are ignored.
+        '''
+        index = min(max(get_month(date) - self.startMonth, 0), HORIZON_MONTHS)
+        self.interestCurve[index] += interest
+
+        self.firstIndex = min(self.firstIndex, index)
+        self.lastIndex = max(self.lastIndex, index)
+
+    def write_many(self, dates, loanIndices, interest, principal, balance):
+        '''
+        Add the interest of many payment records, given as a sequence of each
+        column, to the month of each record's date. Dates are given as
+        ordinals, and the other columns are ignored.
+        '''
+        for [date, amount] in zip(dates, interest):
+            self.write(datetime.date.fromordinal(date), None, amount, None, None)
+
+    def close(self):
+        '''
+        Do nothing, as the interest curve is kept until the sink is reset.
+        '''
+        pass
+
+    def discard(self):
+        '''
+        Do nothing, as the sink has no file to remove.
+        '''
+        pass
+
+    def get_months(self):
+        '''
+        Generate each month a plan paid interest in, and the interest paid.
+        '''
+        for index in xrange(self.firstIndex, self.lastIndex + 1):
+            yield [index, self.interestCurve[index]]
+
+class BookStats(object):
+    '''
+    Class to aggregate the best plans of many borrowers into statistics of a
+    fixed size. Months are counted from the given start month, and any past
+    the horizon are counted in the final month.
+    '''
+    def __init__(self, startMonth):
+        self.startMonth = startMonth
+
+        self.borrowers = 0
+        self.planned = 0
+        self.unpayable = 0
+        self.failed = 0
+
+        # Number of errors raised while planning, by type, and examples of them
+        self.errors = dict()
+        self.errorSamples = list()
+
+        self.balance = 0.0
+        self.amountPaid = 0.0
+        self.interest = 0.0
+
+        self.interestCurve = array.array('d', [0.0]) * (HORIZON_MONTHS + 1)
+        self.payoffMonths = array.array('l', [0]) * (HORIZON_MONTHS + 1)
+
+    def add_plan(self, paymentDevice, sink):
+        '''
+        Add the best plan of a single borrower, simulated with the given sink.
+        Upfront payments are counted in the balance and the amount paid.
+        '''
+        loans = paymentDevice.originalLoans
+
+        upfrontPayment = sum(x.upfrontPayment for x in loans)
+        finishMonth = get_month(paymentDevice.paymentStats.finishDate)
+
+        self.planned += 1
+        self.balance += sum(x.balance for x in loans) + upfrontPayment
+        self.amountPaid += paymentDevice.paymentStats.amountPaid + upfrontPayment
+
+        for [index, interest] in sink.get_months():
+            self.interestCurve[index] += interest
+            self.interest += interest
+
+        self.payoffMonths[min(max(finishMonth - self.startMonth, 0), HORIZON_MONTHS)] += 1
+
+    def add_error(self, source, error):
+        '''
+        Count an error raised while planning the given borrower, keeping it
+        as an example if too few have been kept yet.
+        '''
+        name = type(error).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+        if len(self.errorSamples) < MAX_ERROR_SAMPLES:
+            self.errorSamples.append({'config' : source, 'error' : '%s: %s' % (name, error)})
+
+    def merge(self, other):
+        '''
+        Add the statistics of another book to this one.
+        '''
+        for name in ['borrowers', 'planned', 'unpayable', 'failed', 'balance', 'amountPaid', 'interest']:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+        for [name, count] in other.errors.iteritems():
+            self.errors[name] = self.errors.get(name, 0) + count
+
+        self.errorSamples.extend(other.errorSamples[:MAX_ERROR_SAMPLES - len(self.errorSamples)])
+
+        for index in xrange(HORIZON_MONTHS + 1):
+            self.interestCurve[index] += other.interestCurve[index]
+            self.payoffMonths[index] += other.payoffMonths[index]
+
+    def get_payoff_percentile(self, percentile):
+        '''
+        Return the month by which the given percentage of planned borrowers
+        have paid off their loans, counted from the start month, or None if no
+        borrower was planned.
+        '''
+        if not self.planned:
+            return None
+
+        target = max(self.planned * percentile / 100.0, 1)
+        count = 0
+
+        for [month, payoffs] in enumerate(self.payoffMonths):
+            count += payoffs
+
+            if count >= target:
+                return month
+
+        return HORIZON_MONTHS
+
+    def to_dict(self):
+        '''
+        Return the statistics as a dict, for example to be serialized to JSON.
+        The interest curve runs until the last month any interest was paid in,
+        and payoffs are counted by year.
+        '''
+        lastMonth = max([i for [i, x] in enumerate(self.interestCurve) if x] or [0])
+        payoffYears = dict()
+
+        for [month, payoffs] in enumerate(self.payoffMonths):
+            if payoffs:
+                year = str((self.startMonth + month) // 12)
+                payoffYears[year] = payoffYears.get(year, 0) + payoffs
+
+        [percentiles, interestCurve] = [dict(), list()]
+
+        for percentile in PERCENTILES:
+            if self.planned:
+                month = self.startMonth + self.get_payoff_percentile(percentile)
+                percentiles['p%d' % (percentile)] = get_month_label(month)
+
+        for index in xrange(lastMonth + 1):
+            interestCurve.append([get_month_label(self.startMonth + index), self.interestCurve[index]])
+
+        return {
+            'borrowers' : self.borrowers,
+            'planned' : self.planned,
+            'unpayable' : self.unpayable,
+            'failed' : self.failed,
+            'errors' : self.errors,
+            'errorSamples' : self.errorSamples,
+            'balance' : self.balance,
+            'amountPaid' : self.amountPaid,
+            'interest' : self.interest,
+            'interestCurve' : interestCurve,
+            'payoffYears' : payoffYears,
+            'payoffPercentiles' : percentiles,
+        }
+
+def project_borrower(source, line, engine, bookStats):
+    '''
+    Find the best payment plan of a single borrower, given either as a JSON
+    line or as the path to an INI file, and add it to the given statistics.
+    The best plan is simulated once more to find the interest it pays in each
+    month, so that no other plan's schedule is recorded. A borrower who cannot
+    be planned is counted rather than ending the projection, along with the
+    error raised while planning them, if any.
+
+    The random heuristic is seeded from the borrower, so that projections do
+    not depend on how borrowers are split into shards.
+    '''
+    global _checkpoints
+    global _sink
+
+    if _checkpoints is None:
+        _checkpoints = checkpoint.CheckpointStore()
+        _sink = InterestCurveSink()
+
+    bookStats.borrowers += 1
+    [loanPlanner, bestPlan] = [None, None]
+
+    random.seed(line or source)
+
+    try:
+        portfolio = json.loads(line) if line else None
+
+        loanPlanner = loan_planner.LoanPlanner(source, engine, portfolio=portfolio, checkpoints=_checkpoints,
+            heuristicStats=batch.get_heuristic_stats())
+        loanPlanner.find_best_plan()
+
+        bestPlan = loanPlanner.bestChangedPlan or loanPlanner.bestInitialPlan
+    except Exception as ex:
+        bookStats.add_error(source, ex)
+    finally:
+        _checkpoints.clear()
+
+    if not bestPlan:
+        if loanPlanner and loanPlanner.unpayableLoans:
+            bookStats.unpayable += 1
+        else:
+            bookStats.failed += 1
+
+        return
+
+    _sink.reset(bookStats.startMonth)
+
+    # A plan of the random heuristic may make other choices when simulated
+    # again, so statistics are taken from the plan simulated with the sink
+    paymentDevice = loanPlanner.paymentDeviceClass(loanPlanner.loanConfig.dateOfBirth, bestPlan.originalLoans,
+        bestPlan.allocationDecider, scheduleSink=_sink)
+
+    if paymentDevice.pay_loans():
+        bookStats.add_plan(paymentDevice, _sink)
+    else:
+        bookStats.failed += 1
+
+def _project_shard(args):
+    '''
+    Find the best payment plan of each borrower in a shard in a worker process.
+    Return the statistics of the shard.
+    '''
+    [borrowers, engine, startMonth] = args
+    bookStats = BookStats(startMonth)
+
+    for [source, line] in borrowers:
+        project_borrower(source, line, engine, bookStats)
+
+    return bookStats
+
+def read_shards(portfolios, shardSize=DEFAULT_SHARD_SIZE):
+    '''
+    Generate lists of up to the given number of the given portfolios.
+    '''
+    shard = list()
+
+    for portfolio in portfolios:
+        shard.append(portfolio)
+
+        if len(shard) == shardSize:
+            yield shard
+            shard = list()
+
+    if shard:
+        yield shard
+
+def project_book(portfolios, engine=payment_device.DEFAULT_ENGINE, jobs=None, shardSize=DEFAULT_SHARD_SIZE,
+        startMonth=None):
+    '''
+    Find the best payment plan of each of the given borrowers in a pool of
+    worker processes, and return the merged statistics of their plans. Months
+    are counted from the given start month, or from the current month.
+    '''
+    if startMonth is None:
+        startMonth = get_month(datetime.date.today())
+
+    tasks = ([x, engine, startMonth] for x in read_shards(portfolios, shardSize))
+    bookStats = BookStats(startMonth)
+
+    for shardStats in batch.imap_bounded(_project_shard, tasks, jobs):
+        bookStats.merge(shardStats)
+
+    return bookStats
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+
+    parser.add_argument(
+        '-i', '--input', dest='input', required=True,
+        help='Directory of INI files, or JSONL file of borrowers ("-" for stdin)')
+
+    parser.add_argument(
+        '-o', '--output', dest='output', default='-',
+        help='Path to JSON statistics file ("-" for stdout)')
+
+    parser.add_argument(
+        '-e', '--engine', dest='engine', choices=loan_planner.ENGINE_NAMES,
+        default=payment_device.DEFAULT_ENGINE, help='Payment simulation engine')
+
+    parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=multiprocessing.cpu_count(),
+        help='Number of processes to plan borrowers with')
+
+    parser.add_argument(
+        '--shard-size', dest='shard_size', type=int, default=DEFAULT_SHARD_SIZE,
+        help='Number of borrowers planned together by a process')
+
+    args = parser.parse_args()
+
+    bookStats = project_book(batch.read_portfolios(args.input), args.engine, args.jobs, args.shard_size)
+    output = sys.stdout if (args.output == '-') else open(args.output, 'w')
+
+    try:
+        output.write(json.dumps(bookStats.to_dict(), sort_keys=True) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    return (bookStats.planned == bookStats.borrowers)
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,83 @@
+'''
+checkpoint
+'''
+import collections
+
+# Default bound on the number of checkpoints kept
+DEFAULT_MAX_ENTRIES = 4096
+
+class Checkpoint(object):
+    '''
+    Class to store the state of a payment device just after one or more loans
+    were paid off, before their payments are reallocated.
+    '''
+    def __init__(self, paymentDevice, paidLoans, checkedAmountPaid):
+        self.date = paymentDevice.currentDate.date()
+        self.amountPaid = paymentDevice.paymentStats.amountPaid
+        self.loans = [x.clone() for x in paymentDevice.loans]
+        self.paidLoans = [x.clone() for x in paidLoans]
+
+        # The amount paid when the simulation last checked whether to prune
+        # the plan, which is the highest amount it was checked at
+        self.checkedAmountPaid = checkedAmountPaid
+
+class CheckpointStore(object):
+    '''
+    Class to store checkpoints of payment devices, keyed by the state each
+    device was in before making the payments which led to the checkpoint. The
+    payments made until a loan is paid off only depend on that state, so any
+    device which reaches the same state resumes from the checkpoint rather
+    than making the same payments again. Heuristics share their plans up to
+    the first payoff at which they reallocate differently, and plans for
+    changed options share any state left unaffected by the changes. Only the
+    most recently used checkpoints are kept.
+    '''
+    def __init__(self, maxEntries=DEFAULT_MAX_ENTRIES):
+        self.checkpoints = collections.OrderedDict()
+        self.maxEntries = maxEntries
+
+    def get_key(self, paymentDevice):
+        '''
+        Return the key of the given payment device's current state. The time
+        of day a simulation started at does not affect its payments, so only
+        the current date is used.
+        '''
+        loans = tuple((x.name, x.balance, x.interestRate, x.monthlyPayment, x.paymentDay) for x in paymentDevice.loans)
+
+        return (
+            type(paymentDevice).__name__,
+            paymentDevice.currentDate.date(),
+            paymentDevice.paymentStats.amountPaid,
+            loans
+        )
+
+    def get(self, key):
+        '''
+        Return the checkpoint reached from the state with the given key, or None
+        if there is no such checkpoint.
+        '''
+        checkpoint = self.checkpoints.pop(key, None)
+
+        if checkpoint:
+            self.checkpoints[key] = checkpoint
+
+        return checkpoint
+
+    def put(self, key, paymentDevice, paidLoans, checkedAmountPaid):
+        '''
+        Store a checkpoint of the given payment device, reached from the state
+        with the given key, evicting the least recently used checkpoints once
+        the store is full.
+        '''
+        self.checkpoints.pop(key, None)
+        self.checkpoints[key] = Checkpoint(paymentDevice, paidLoans, checkedAmountPaid)
+
+        while len(self.checkpoints) > self.maxEntries:
+            self.checkpoints.popitem(last=False)
+
+    def clear(self):
+        '''
+        Remove all checkpoints, for example once the plans which could share
+        them have all been simulated.
+        '''
+        self.checkpoints.clear()
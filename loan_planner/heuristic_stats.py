@@ -0,0 +1,144 @@
+'''
+heuristic_stats
+'''
+import math
+import os
+
+import heuristics
+import loan_config
+
+# Version of the persisted statistics, which are discarded if it changes
+STATS_VERSION = 1
+
+# Stages of planning, for which wins are counted apart
+INITIAL = 'initial'
+CHANGED = 'changed'
+
+# Caps on the buckets of each portfolio feature
+MAX_LOANS = 8
+MAX_RATE_SPREAD = 10
+MAX_PAYMENT_RATIO = 8
+
+class HeuristicStats(object):
+    '''
+    Class to order heuristics by their expected quality, so that the best plan
+    is likely found first and every later plan is pruned as early as possible.
+
+    Portfolios are bucketed by cheap features: the number of loans, the spread
+    of their interest rates, and the lowest ratio of a loan's monthly payment
+    to the interest it accrues each month. Heuristics are ordered by how often
+    their plans were the best for portfolios in the same bucket, smoothed
+    towards an even chance. Heuristics which are equally likely to win are
+    ordered by the first loan they would give dollars to, preferring a loan
+    with a higher interest rate, and then with a higher interest-to-payment
+    ratio. Win statistics may be persisted between runs in a JSON file.
+    '''
+    def __init__(self, statsPath=None):
+        self.statsPath = statsPath
+        self.buckets = dict()
+
+        if statsPath:
+            self._load_stats()
+
+    def get_bucket(self, loans, stage):
+        '''
+        Return the key of the bucket of the given loans for the given stage.
+        '''
+        loans = [x for x in loans if x.balance > 0]
+
+        if not loans:
+            return '%s/0/0/0' % (stage)
+
+        interestRates = [x.interestRate for x in loans]
+        rateSpread = int(round((max(interestRates) - min(interestRates)) * 100.0))
+
+        paymentRatio = MAX_PAYMENT_RATIO
+
+        for loan in loans:
+            interest = loan.get_interest_accrued(loan_config.LoanConfig.DAYS_PER_MONTH)
+
+            if interest > 0:
+                ratio = int(math.floor(math.log(max(loan.monthlyPayment / interest, 1.0), 2)))
+                paymentRatio = min(paymentRatio, ratio)
+
+        return '%s/%d/%d/%d' % (stage, min(len(loans), MAX_LOANS), min(rateSpread, MAX_RATE_SPREAD), paymentRatio)
+
+    def rank(self, loans, stage, candidates=None):
+        '''
+        Return the given heuristics, or all heuristics if none are given, in the
+        order they should be simulated for the given loans at the given stage.
+        '''
+        candidates = heuristics.ALL_HEURISTICS if (candidates is None) else candidates
+
+        bucket = self.buckets.get(self.get_bucket(loans, stage), dict())
+        [runs, wins] = [bucket.get('runs', 0), bucket.get('wins', dict())]
+
+        unpaid = [x for x in loans if x.balance > 0]
+        days = loan_config.LoanConfig.DAYS_PER_MONTH
+
+        def get_rank_key(heuristic):
+            winRate = (wins.get(heuristic.__name__, 0) + 1.0) / (runs + 2.0)
+
+            if unpaid and heuristics.is_deterministic(heuristic):
+                loan = heuristic(unpaid, days)
+                return (-winRate, -loan.interestRate, -loan.get_interest_to_payment_ratio(days), heuristic.__name__)
+
+            return (-winRate, 0, 0, heuristic.__name__)
+
+        return sorted(candidates, key=get_rank_key)
+
+    def record(self, loans, stage, paymentDevices):
+        '''
+        Record a planning run of the given loans at the given stage, in which
+        the given dict of heuristics to completed payment devices were found.
+        Every heuristic whose plan paid the least is counted as a winner.
+        '''
+        if not paymentDevices:
+            return
+
+        bestAmountPaid = min(x.paymentStats.amountPaid for x in paymentDevices.itervalues())
+        winners = [h for [h, x] in paymentDevices.iteritems() if x.paymentStats.amountPaid <= bestAmountPaid]
+
+        bucket = self.buckets.setdefault(self.get_bucket(loans, stage), {'runs' : 0, 'wins' : dict()})
+        bucket['runs'] += 1
+
+        for heuristic in winners:
+            bucket['wins'][heuristic.__name__] = bucket['wins'].get(heuristic.__name__, 0) + 1
+
+    def save(self):
+        '''
+        Save the win statistics to the stats file, if any. The statistics are
+        written to a temporary file which is then moved into place, so that
+        partial statistics are never loaded. Failure to save is ignored.
+        '''
+        if not self.statsPath:
+            return
+
+        import json
+
+        tempPath = '%s.%d.tmp' % (self.statsPath, os.getpid())
+
+        try:
+            with open(tempPath, 'wb') as statsFile:
+                json.dump({'version' : STATS_VERSION, 'buckets' : self.buckets}, statsFile, sort_keys=True)
+
+            os.rename(tempPath, self.statsPath)
+        except (IOError, OSError):
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+
+    def _load_stats(self):
+        '''
+        Load the win statistics from the stats file. Missing, unreadable, or
+        outdated statistics are ignored.
+        '''
+        import json
+
+        try:
+            with open(self.statsPath, 'rb') as statsFile:
+                stats = json.load(statsFile)
+        except (IOError, OSError, ValueError):
+            return
+
+        if isinstance(stats, dict) and (stats.get('version') == STATS_VERSION):
+            self.buckets = stats.get('buckets', dict())
@@ -1,21 +1,75 @@
-import inspect
 import random
 import sys
 
-# All heuristic functions must end with the string "_heuristic" and have the
-# the following prototype:
+# All heuristic functions must end with the string "_heuristic", be registered
+# with the register decorator, and have the following prototype:
 #
 #   loan = my_heuristic(loans, daysSinceLastPayment)
 #
 # They should use some metric on the given loans and time difference to decide
 # which loan should have its monthly payment increased.
+#
+# A heuristic may also declare a priority key with the priority_key decorator:
+#
+#   key = my_key(loan, daysSinceLastPayment)
+#
+# The heuristic must then return the first of the given loans with the lowest
+# key, and a loan's key must never decrease as its balance is paid down or its
+# monthly payment is increased. This lets many dollars be allocated to a loan
+# at once, rather than calling the heuristic once per dollar.
+#
+# A heuristic which may choose differently given the same loans must be marked
+# with the nondeterministic decorator, so that its results are never cached.
+
+# All registered heuristic functions, in order of their names
+ALL_HEURISTICS = list()
+
+def register(heuristic):
+    '''
+    Decorator to register a heuristic function, so that it is used to plan
+    payments. Heuristics are registered explicitly rather than found by
+    inspecting this module, which would slow down every import of it.
+    '''
+    ALL_HEURISTICS.append(heuristic)
+    ALL_HEURISTICS.sort(key=lambda x: x.__name__)
+
+    return heuristic
+
+def priority_key(key):
+    '''
+    Decorator to declare the priority key of a heuristic function.
+    '''
+    def decorate(heuristic):
+        heuristic.priorityKey = key
+        return heuristic
 
+    return decorate
+
+def nondeterministic(heuristic):
+    '''
+    Decorator to declare that a heuristic function may choose differently when
+    given the same loans.
+    '''
+    heuristic.isDeterministic = False
+    return heuristic
+
+def is_deterministic(heuristic):
+    '''
+    Return true if the given heuristic always chooses the same loan when given
+    the same loans.
+    '''
+    return getattr(heuristic, 'isDeterministic', True)
+
+@register
+@priority_key(lambda loan, daysSinceLastPayment: 0)
 def first_loan_heuristic(loans, daysSinceLastPayment):
     '''
     Return the first loan in the list.
     '''
     return loans[0]
 
+@register
+@nondeterministic
 def random_heuristic(loans, daysSinceLastPayment):
     '''
     Return a random loan.
@@ -23,6 +77,8 @@ def random_heuristic(loans, daysSinceLastPayment):
     index = random.randint(1, len(loans))
     return loans[index - 1]
 
+@register
+@priority_key(lambda loan, daysSinceLastPayment: -loan.balance)
 def max_balance_heuristic(loans, daysSinceLastPayment):
     '''
     Return the loan with the highest balance.
@@ -37,6 +93,8 @@ def max_balance_heuristic(loans, daysSinceLastPayment):
 
     return maxBalanceLoan
 
+@register
+@priority_key(lambda loan, daysSinceLastPayment: (-loan.interestRate, -loan.balance))
 def max_interest_rate_heuristic(loans, daysSinceLastPayment):
     '''
     Return the loan with the highest interest rate.
@@ -57,6 +115,8 @@ def max_interest_rate_heuristic(loans, daysSinceLastPayment):
 
     return maxInterestLoan
 
+@register
+@priority_key(lambda loan, daysSinceLastPayment: -loan.get_interest_accrued(365.0))
 def max_interest_accrual_heuristic(loans, daysSinceLastPayment):
     '''
     Return the loan which accrues the most interest in a year.
@@ -73,6 +133,8 @@ def max_interest_accrual_heuristic(loans, daysSinceLastPayment):
 
     return maxInterestLoan
 
+@register
+@priority_key(lambda loan, daysSinceLastPayment: -loan.get_interest_to_payment_ratio(daysSinceLastPayment))
 def max_ipr_heuristic(loans, daysSinceLastPayment):
     '''
     Return the loan with the highest interest-to-monthly-payment ratio.
@@ -89,6 +151,9 @@ def max_ipr_heuristic(loans, daysSinceLastPayment):
 
     return maxIPRLoan
 
+@register
+@priority_key(lambda loan, daysSinceLastPayment: \
+    (loan.monthlyPayment - loan.get_interest_accrued(daysSinceLastPayment)) / loan.monthlyPayment)
 def min_percent_payment_applied_heuristic(loans, daysSinceLastPayment):
     '''
     Return the loan with the lowest percentage of its monthly payment applied
@@ -106,12 +171,3 @@ def min_percent_payment_applied_heuristic(loans, daysSinceLastPayment):
             minPctLoan = loan
 
     return minPctLoan
-
-def is_heuristic_function(obj):
-    '''
-    Return true if the given object represents a heuristic function.
-    '''
-    return (inspect.isfunction(obj) and obj.__name__.endswith('_heuristic'))
-
-ALL_HEURISTICS = inspect.getmembers(sys.modules[__name__], is_heuristic_function)
-ALL_HEURISTICS = [heuristic[1] for heuristic in ALL_HEURISTICS]
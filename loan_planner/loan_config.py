@@ -1,23 +1,80 @@
 '''
 loan_config
 '''
-import ConfigParser
+import cPickle
 import datetime
+import math
+import os
+import zlib
+
+def add_dollars(amount, dollars):
+    '''
+    Add a whole number of dollars to the given amount, with the same result as
+    adding one dollar at a time. Each single dollar is added exactly, except
+    when the amount grows past a power of two, where the sum is rounded.
+    '''
+    while (dollars > 0) and (amount < 1):
+        amount += 1
+        dollars -= 1
+
+    while dollars > 0:
+        [_, exponent] = math.frexp(amount)
+        steps = int(math.ceil((2.0 ** exponent) - amount))
+
+        if steps > dollars:
+            return amount + dollars
+
+        amount += steps - 1
+        amount += 1
+        dollars -= steps
+
+    return amount
 
 class Loan(object):
     '''
     Class to store data pertaining to a loan.
     '''
-    def __init__(self, name, balance, interestRate, monthlyPayment, paymentDay):
+    __slots__ = ('name', 'balance', 'interestRate', 'monthlyPayment', 'paymentDay', 'monthlyIncrease', 'upfrontPayment',
+        'rateVolatility')
+
+    def __init__(self, name, balance, interestRate, monthlyPayment, paymentDay, rateVolatility=0):
         self.name = name
         self.balance = balance
         self.interestRate = interestRate / 100.0
         self.monthlyPayment = monthlyPayment
         self.paymentDay = paymentDay
 
+        # Yearly standard deviation of a variable interest rate, which is only
+        # used by Monte Carlo simulations. Fixed rates have no volatility.
+        self.rateVolatility = rateVolatility / 100.0
+
         self.monthlyIncrease = 0
         self.upfrontPayment = 0
 
+    def clone(self):
+        '''
+        Return a copy of this loan.
+        '''
+        loan = Loan.__new__(Loan)
+
+        for attribute in Loan.__slots__:
+            setattr(loan, attribute, getattr(self, attribute))
+
+        return loan
+
+    def __getstate__(self):
+        '''
+        Return the state of the loan to be pickled.
+        '''
+        return tuple(getattr(self, attribute) for attribute in Loan.__slots__)
+
+    def __setstate__(self, state):
+        '''
+        Restore the state of the loan from an unpickled state.
+        '''
+        for [attribute, value] in zip(Loan.__slots__, state):
+            setattr(self, attribute, value)
+
     def get_payment_amount(self):
         '''
         Return the monthly payment amount, or the loan balance if the balance
@@ -39,6 +96,21 @@ class Loan(object):
         interestAccrued = self.get_interest_accrued(daysAccrued)
         return (interestAccrued / self.monthlyPayment)
 
+    def make_upfront_payment(self, amount):
+        '''
+        Pay the given whole number of dollars towards the loan balance before
+        the first monthly payment.
+        '''
+        self.upfrontPayment += amount
+        self.balance -= amount
+
+    def increase_monthly_payment(self, amount):
+        '''
+        Increase the monthly payment by the given whole number of dollars.
+        '''
+        self.monthlyIncrease += amount
+        self.monthlyPayment = add_dollars(self.monthlyPayment, amount)
+
 class LoanConfig(object):
     '''
     Configuration options for the loan planner.
@@ -55,6 +127,7 @@ class LoanConfig(object):
     INTEREST_RATE = 'InterestRate'
     MONTHLY_PAYMENT = 'MonthlyPayment'
     PAYMENT_DAY = 'PaymentDay'
+    RATE_VOLATILITY = 'RateVolatility'
 
     # Average number of days per month according to Gregorian calendar
     DAYS_PER_MONTH = 30.436875
@@ -67,10 +140,18 @@ class LoanConfig(object):
         BALANCE : '0',
         INTEREST_RATE : '0',
         MONTHLY_PAYMENT : '0',
-        PAYMENT_DAY : '1'
+        PAYMENT_DAY : '1',
+        RATE_VOLATILITY : '0'
     }
 
-    def __init__(self, loanConfigFilePath):
+    # Keys of a portfolio given as a dict rather than an INI file
+    LOANS = 'Loans'
+    NAME = 'Name'
+
+    # Version of the format of parsed config snapshots
+    SNAPSHOT_VERSION = 1
+
+    def __init__(self, loanConfigFilePath, portfolio=None, snapshotDir=None):
         self.loanConfigFilePath = loanConfigFilePath
 
         self.upfrontPayment = float()
@@ -80,7 +161,13 @@ class LoanConfig(object):
         self.totalMonthlyPayment = float()
         self.loans = [ ]
 
-        self._parse_config_file()
+        if portfolio is not None:
+            self._parse_portfolio(portfolio)
+        elif not (snapshotDir and self._load_snapshot(snapshotDir)):
+            self._parse_config_file()
+
+            if snapshotDir and self.parsed():
+                self._save_snapshot(snapshotDir)
 
     def __str__(self):
         totalBalance = sum(loan.balance for loan in self.loans)
@@ -126,9 +213,119 @@ class LoanConfig(object):
         '''
         Parse the INI file with all configuration and loan data.
         '''
+        # Only imported when parsing, as loading a snapshot does not need it
+        import ConfigParser
+
         parser = ConfigParser.SafeConfigParser(LoanConfig.DEFAULTS)
         parser.read(self.loanConfigFilePath)
 
+        self._parse_config(parser)
+
+    def _parse_portfolio(self, portfolio):
+        '''
+        Parse a dict with the same options as the config file, for example as
+        loaded from JSON. Options are given under an "Options" key, and loans
+        are given as a list under a "Loans" key, each with a "Name" key.
+        '''
+        import ConfigParser
+
+        parser = ConfigParser.SafeConfigParser(LoanConfig.DEFAULTS)
+
+        if LoanConfig.OPTIONS in portfolio:
+            parser.add_section(LoanConfig.OPTIONS)
+
+            for [option, value] in portfolio[LoanConfig.OPTIONS].iteritems():
+                parser.set(LoanConfig.OPTIONS, option, str(value))
+
+        for loan in portfolio.get(LoanConfig.LOANS, []):
+            loanName = loan[LoanConfig.NAME]
+            parser.add_section(loanName)
+
+            for [option, value] in loan.iteritems():
+                if option != LoanConfig.NAME:
+                    parser.set(loanName, option, str(value))
+
+        self._parse_config(parser)
+
+    def _get_snapshot_key(self):
+        '''
+        Return the key of a snapshot of the parsed INI file, which changes if
+        the file is modified or the snapshot format changes. Return None if the
+        file does not exist.
+        '''
+        try:
+            stat = os.stat(self.loanConfigFilePath)
+        except OSError:
+            return None
+
+        path = os.path.abspath(self.loanConfigFilePath)
+        return (path, stat.st_mtime, stat.st_size, LoanConfig.SNAPSHOT_VERSION, Loan.__slots__)
+
+    def _get_snapshot_path(self, snapshotDir, key):
+        '''
+        Return the path of the snapshot with the given key in the given
+        directory. Snapshots are named by a checksum of the INI file's path,
+        and hold the whole key, so that a snapshot of another file with the
+        same name is never loaded.
+        '''
+        return os.path.join(snapshotDir, '%08x.snapshot' % (zlib.crc32(key[0]) & 0xffffffff))
+
+    def _load_snapshot(self, snapshotDir):
+        '''
+        Load the parsed configuration and loan data from a snapshot in the
+        given directory, rather than parsing the INI file. Return true if there
+        was a snapshot of the file as it is now.
+        '''
+        key = self._get_snapshot_key()
+
+        if not key:
+            return False
+
+        try:
+            with open(self._get_snapshot_path(snapshotDir, key), 'rb') as snapshotFile:
+                [snapshotKey, state] = cPickle.load(snapshotFile)
+        except (IOError, OSError, EOFError, ValueError, cPickle.UnpicklingError):
+            return False
+
+        if snapshotKey != key:
+            return False
+
+        [self.upfrontPayment, self.monthlyIncrease, self.dateOfBirth, self.loans] = state
+        return True
+
+    def _save_snapshot(self, snapshotDir):
+        '''
+        Save the parsed configuration and loan data to a snapshot in the given
+        directory. The snapshot is written to a temporary file which is then
+        moved into place, so that a partial snapshot is never loaded. Failure
+        to save a snapshot is ignored.
+        '''
+        key = self._get_snapshot_key()
+
+        if not key:
+            return
+
+        state = [self.upfrontPayment, self.monthlyIncrease, self.dateOfBirth, self.loans]
+
+        path = self._get_snapshot_path(snapshotDir, key)
+        tempPath = '%s.%d.tmp' % (path, os.getpid())
+
+        try:
+            if not os.path.isdir(snapshotDir):
+                os.makedirs(snapshotDir)
+
+            with open(tempPath, 'wb') as snapshotFile:
+                cPickle.dump([key, state], snapshotFile, cPickle.HIGHEST_PROTOCOL)
+
+            os.rename(tempPath, path)
+        except (IOError, OSError):
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+
+    def _parse_config(self, parser):
+        '''
+        Parse all configuration and loan data from the given parser.
+        '''
         # Parse global options
         if parser.has_section(LoanConfig.OPTIONS):
             self._parse_loan_options(parser)
@@ -156,6 +353,7 @@ class LoanConfig(object):
         interestRate = parser.getfloat(loanName, LoanConfig.INTEREST_RATE)
         monthlyPayment = parser.getfloat(loanName, LoanConfig.MONTHLY_PAYMENT)
         paymentDay = parser.getint(loanName, LoanConfig.PAYMENT_DAY)
+        rateVolatility = parser.getfloat(loanName, LoanConfig.RATE_VOLATILITY)
 
-        loan = Loan(loanName, balance, interestRate, monthlyPayment, paymentDay)
+        loan = Loan(loanName, balance, interestRate, monthlyPayment, paymentDay, rateVolatility)
         self.loans.append(loan)
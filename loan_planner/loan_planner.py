@@ -6,22 +6,127 @@ Example
 python loan_planner.py -c loans.ini
 '''
 import argparse
-import copy
+import datetime
+import imp
 import sys
 
+import allocation
+import checkpoint
+import heuristic_stats
 import heuristics
 import loan_config
+import optimizer
 import payment_device
+import profiling
+import schedule_export
 
 DEFAULT_CONFIG_FILE_PATH = 'loans.ini'
 
+ENGINES = dict(payment_device.ENGINES)
+
+# Engines whose modules are only imported once used, by name, with the module
+# and class of each engine and the optional package it depends on. NumPy is
+# optional, and only needed by the vector engine.
+OPTIONAL_ENGINES = {
+    'vector' : ('vector_device', 'VectorPaymentDevice', 'numpy'),
+}
+
+def is_available(package):
+    '''
+    Return true if the given package may be imported, without importing it.
+    '''
+    try:
+        imp.find_module(package)
+    except ImportError:
+        return False
+
+    return True
+
+ENGINE_NAMES = sorted(ENGINES.keys() + [x for [x, y] in OPTIONAL_ENGINES.iteritems() if is_available(y[2])])
+
+def get_engine(engine):
+    '''
+    Return the payment device class of the given engine, importing the engine's
+    module on first use.
+    '''
+    if engine not in ENGINES:
+        [moduleName, className, _] = OPTIONAL_ENGINES[engine]
+        ENGINES[engine] = getattr(__import__(moduleName), className)
+
+    return ENGINES[engine]
+
+# Lowest amount paid by any plan completed in a worker process, installed in
+# each worker when the process pool is created
+_pruneBound = None
+
+# Checkpoints of the plans simulated by a worker process, if enabled
+_checkpoints = None
+
+def _init_worker(pruneBound, useCheckpoints):
+    '''
+    Store the shared pruning bound in a newly started worker process, and
+    create its checkpoint store if checkpoints are enabled.
+    '''
+    global _pruneBound
+    global _checkpoints
+
+    _pruneBound = pruneBound
+    _checkpoints = checkpoint.CheckpointStore() if useCheckpoints else None
+
+def _pay_loans(args):
+    '''
+    Simulate the payment of loans in a worker process, pruning against the
+    shared bound if pruning is given. Publish the amount paid if pruning and
+    the simulation was successful. Return the heuristic, the payment device if
+    successful, and the device's profile if profiling is enabled.
+    '''
+    [paymentDeviceClass, dateOfBirth, loans, heuristic, profile, exportSchedule, pruning, boundPruning] = args
+
+    scheduleSink = schedule_export.ScheduleSink() if exportSchedule else None
+    pruneBound = _pruneBound if pruning else None
+
+    paymentDevice = paymentDeviceClass(dateOfBirth, loans, heuristic, pruneBound=pruneBound, profile=profile,
+        scheduleSink=scheduleSink, checkpoints=_checkpoints, boundPruning=boundPruning)
+    status = paymentDevice.pay_loans()
+
+    # The shared bound may only be passed to processes through inheritance,
+    # the checkpoints are kept by the worker, and the heuristic may have been
+    # wrapped by the profile
+    paymentDevice.pruneBound = None
+    paymentDevice.checkpoints = None
+    paymentDevice.allocationDecider = heuristic
+
+    if not status:
+        paymentDevice.release()
+        return [heuristic, None, profile]
+
+    if pruning:
+        with _pruneBound.get_lock():
+            _pruneBound.value = min(_pruneBound.value, paymentDevice.paymentStats.amountPaid)
+
+    return [heuristic, paymentDevice, profile]
+
 class LoanPlanner(object):
     '''
     Class to evaluate loan payment plans using a variety of metrics, taking
     into consideration any user-specified payment changes.
     '''
-    def __init__(self, loanConfigFilePath):
-        self.loanConfig = loan_config.LoanConfig(loanConfigFilePath)
+    def __init__(self, loanConfigFilePath, engine=payment_device.DEFAULT_ENGINE, jobs=1, portfolio=None, profile=None,
+            cache=None, exportSchedule=False, planOptimizer=None, checkpoints=None, configSnapshotDir=None,
+            boundPruning=False, heuristicStats=None):
+        self.loanConfig = loan_config.LoanConfig(loanConfigFilePath, portfolio, configSnapshotDir)
+        self.paymentDeviceClass = get_engine(engine)
+        self.profile = profile
+        self.cache = cache
+        self.exportSchedule = exportSchedule
+        self.planOptimizer = planOptimizer
+        self.checkpoints = checkpoints
+        self.boundPruning = boundPruning
+        self.heuristicStats = heuristicStats or heuristic_stats.HeuristicStats()
+
+        self.jobs = jobs
+        self.pruneBound = None
+        self.pool = None
 
         self.initialPaymentDevices = dict()
         self.changedPaymentDevices = dict()
@@ -29,6 +134,11 @@ class LoanPlanner(object):
         self.bestInitialPlan = None
         self.bestChangedPlan = None
 
+        # Loans which no plan could pay off, with the least increase to the
+        # monthly payment of each before one could, and the increase after
+        # which each loan's own payment pays it down
+        self.unpayableLoans = list()
+
     def __str__(self):
         initialPlan = self.bestInitialPlan
         changedPlan = self.bestChangedPlan
@@ -37,7 +147,16 @@ class LoanPlanner(object):
             return 'Could not parse given config file: %s\n' % (self.loanConfig.loanConfigFilePath)
 
         if not initialPlan and not changedPlan:
-            return 'Could not determine a payment plan for the given loans\n'
+            ret = 'Could not determine a payment plan for the given loans\n'
+
+            if self.unpayableLoans:
+                ret += '\nLoans which can never be paid off:\n\n'
+
+                for [loan, increase, ownIncrease] in self.unpayableLoans:
+                    ret += '\t%s needs at least $%.2f more each month, and pays itself down with $%.2f more\n' % (
+                        loan.name, increase, ownIncrease)
+
+            return ret
 
         ret = '%s\n' % (self.loanConfig)
 
@@ -58,6 +177,10 @@ class LoanPlanner(object):
         ret += 'Payment plan:\n\n'
         ret += '\t%s\n' % (changedPlan if changedPlan else initialPlan)
 
+        if self.planOptimizer and (self.planOptimizer.gap is not None):
+            ret += 'Plan is within $%.2f of the best plan giving each paid off loan\'s payment to one loan\n\n' % (
+                self.planOptimizer.gap)
+
         if initialPlan:
             ret += 'Without changing payment plan:\n\n%s\n' % (initialPlan.paymentStats)
 
@@ -69,6 +192,50 @@ class LoanPlanner(object):
 
         return ret
 
+    def to_dict(self):
+        '''
+        Return the best payment plans and their statistics as a dict, for
+        example to be serialized to JSON.
+        '''
+        initialPlan = self.bestInitialPlan
+        changedPlan = self.bestChangedPlan
+
+        ret = {
+            'config' : self.loanConfig.loanConfigFilePath,
+            'parsed' : self.loanConfig.parsed(),
+            'success' : bool(initialPlan or changedPlan)
+        }
+
+        if not ret['success']:
+            if self.unpayableLoans:
+                ret['unpayableLoans'] = dict((x.name, {'minIncrease' : y, 'ownIncrease' : z}) \
+                    for [x, y, z] in self.unpayableLoans)
+
+            return ret
+
+        if changedPlan:
+            originalLoans = changedPlan.originalLoans
+
+            ret['upfrontPayments'] = dict((x.name, x.upfrontPayment) for x in originalLoans if x.upfrontPayment > 0)
+            ret['monthlyIncreases'] = dict((x.name, x.monthlyIncrease) for x in originalLoans if x.monthlyIncrease > 0)
+
+        bestPlan = changedPlan if changedPlan else initialPlan
+        ret['plan'] = [x.strip() for x in bestPlan.get_payment_plan() if x.strip()]
+
+        if initialPlan:
+            ret['initialStats'] = initialPlan.paymentStats.to_dict()
+
+        if changedPlan:
+            ret['changedStats'] = changedPlan.paymentStats.to_dict()
+
+        if initialPlan and changedPlan:
+            ret['comparison'] = initialPlan.paymentStats.compare(changedPlan.paymentStats).to_dict()
+
+        if self.planOptimizer and (self.planOptimizer.gap is not None):
+            ret['optimalityGap'] = self.planOptimizer.gap
+
+        return ret
+
     def find_best_plan(self):
         '''
         Simulate the payment of all loans before and after changes to the
@@ -78,89 +245,339 @@ class LoanPlanner(object):
         if not self.loanConfig.parsed():
             return
 
-        if self._do_initial_payments() and self.loanConfig.any_changes():
-            self._do_changed_payments()
+        if (self.jobs > 1) and not self.planOptimizer:
+            # Only imported when needed, as it is slow to import
+            import multiprocessing
+
+            self.pruneBound = multiprocessing.Value('d', float('inf'))
+            self.pool = multiprocessing.Pool(self.jobs, _init_worker, (self.pruneBound, bool(self.checkpoints)))
+
+        try:
+            initialPayments = self.find_initial_plan()
+
+            if initialPayments and self.loanConfig.any_changes():
+                with profiling.time_phase(self.profile, 'changed plans'):
+                    self._do_changed_payments()
+
+            if not self.planOptimizer:
+                self.heuristicStats.record(self.loanConfig.loans, heuristic_stats.INITIAL, self.initialPaymentDevices)
+                self.heuristicStats.record(self.loanConfig.loans, heuristic_stats.CHANGED, self.changedPaymentDevices)
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+    def find_initial_plan(self):
+        '''
+        Simulate the payment of all loans without changes to the payment plans,
+        using all available metrics, and decide which plan is the best. Return
+        true if any simulations were completed successfully. The successful
+        devices are kept by metric, so that other changes may be planned with
+        the same metrics.
+        '''
+        if not self.loanConfig.parsed():
+            return False
+
+        with profiling.time_phase(self.profile, 'initial plans'):
+            return self._do_initial_payments()
 
     def _do_initial_payments(self):
         '''
         Without making changes to the payment plans, simulate the payment of
         all loans using all available metrics. Return true if any simulations
-        were completed successfully.
+        were completed successfully. Nothing is simulated if some loan could
+        never be paid off, as every simulation would reach the end of time.
+
+        Changed plans are only simulated with the metrics whose initial plans
+        were completed, and which plans are pruned depends on the order they
+        are simulated in, which varies between worker processes. So initial
+        plans are only ordered by their expected quality, and pruned against
+        the best plan so far or by their lower bounds, if there are no changes
+        to make.
+
+        If optimizing, the best plan is then searched for, starting from the
+        best plan of any metric.
         '''
-        for heuristic in heuristics.ALL_HEURISTICS:
-            paymentDevice = payment_device.PaymentDevice(
-                self.loanConfig.dateOfBirth, self.loanConfig.loans, heuristic, self.bestInitialPlan)
+        with profiling.time_phase(self.profile, 'pre-flight'):
+            self.unpayableLoans = payment_device.find_unpayable_loans(self.loanConfig.loans)
+
+        if self.unpayableLoans:
+            return False
 
-            if paymentDevice.pay_loans():
-                self.initialPaymentDevices[heuristic] = paymentDevice
-                self.bestInitialPlan = self._get_best_payment_plan(self.initialPaymentDevices)
+        if self.loanConfig.any_changes():
+            [pruning, boundPruning, heuristicOrder] = [False, False, heuristics.ALL_HEURISTICS]
+        else:
+            [pruning, boundPruning] = [True, self.boundPruning]
+            heuristicOrder = self.heuristicStats.rank(self.loanConfig.loans, heuristic_stats.INITIAL)
+
+        if self.pool:
+            loans = self.loanConfig.loans
+            self._do_parallel_payments([[x, loans] for x in heuristicOrder], self.initialPaymentDevices, pruning,
+                boundPruning)
+            self.bestInitialPlan = self._get_best_payment_plan(self.initialPaymentDevices)
+        else:
+            for heuristic in heuristicOrder:
+                paymentDevice = self.paymentDeviceClass(
+                    self.loanConfig.dateOfBirth, self.loanConfig.loans, heuristic,
+                    self.bestInitialPlan if pruning else None,
+                    profile=self.profile, scheduleSink=self._create_schedule_sink(), checkpoints=self.checkpoints,
+                    boundPruning=boundPruning)
 
-        return (len(self.initialPaymentDevices) > 0)
+                if self._pay_loans(paymentDevice, heuristic):
+                    self.initialPaymentDevices[heuristic] = paymentDevice
+                    self.bestInitialPlan = self._get_best_payment_plan(self.initialPaymentDevices)
+
+        if self.planOptimizer:
+            self.bestInitialPlan = self._optimize_payments([self.loanConfig.loans], self.bestInitialPlan)
+
+        return bool(self.bestInitialPlan)
 
     def _do_changed_payments(self):
         '''
         For all available metrics, make any changes to loan payment plans that
-        were specified by the user. Then, simulate the payment of all loans.
+        were specified by the user. Then, simulate the payment of all loans,
+        starting with the metrics expected to find the best plan. If optimizing,
+        the best plan is then searched for, starting from the best plan of any
+        metric.
         '''
-        for heuristic in self.initialPaymentDevices:
-            loans = copy.deepcopy(self.loanConfig.loans)
+        heuristicOrder = self.heuristicStats.rank(self.loanConfig.loans, heuristic_stats.CHANGED,
+            self.initialPaymentDevices)
+
+        if self.pool:
+            changedLoans = [[x, self.get_changed_loans(x)] for x in heuristicOrder]
+            self._do_parallel_payments(changedLoans, self.changedPaymentDevices, True, self.boundPruning)
+            self.bestChangedPlan = self._get_best_payment_plan(self.changedPaymentDevices)
+        else:
+            for heuristic in heuristicOrder:
+                loans = self.get_changed_loans(heuristic)
 
-            self._allocate_upfront_payment(loans, heuristic)
-            self._allocate_monthly_increase(loans, heuristic)
+                paymentDevice = self.paymentDeviceClass(
+                    self.loanConfig.dateOfBirth, loans, heuristic, self.bestChangedPlan, profile=self.profile,
+                    scheduleSink=self._create_schedule_sink(), checkpoints=self.checkpoints,
+                    boundPruning=self.boundPruning)
 
-            paymentDevice = payment_device.PaymentDevice(
-                self.loanConfig.dateOfBirth, loans, heuristic, self.bestChangedPlan)
+                if self._pay_loans(paymentDevice, heuristic):
+                    self.changedPaymentDevices[heuristic] = paymentDevice
+                    self.bestChangedPlan = self._get_best_payment_plan(self.changedPaymentDevices)
 
-            if paymentDevice.pay_loans():
-                self.changedPaymentDevices[heuristic] = paymentDevice
-                self.bestChangedPlan = self._get_best_payment_plan(self.changedPaymentDevices)
+        if self.planOptimizer:
+            self.bestChangedPlan = self._optimize_payments(self._get_distinct_changed_loans(), self.bestChangedPlan)
 
-    def _allocate_upfront_payment(self, loans, heuristic):
+    def _optimize_payments(self, loanSets, incumbent=None):
         '''
-        Use the given metric to modify the given loans using the user-specified
-        upfront payment amount.
+        Search the decisions made each time a loan is paid off for the best plan
+        to pay any of the given sets of loans, starting from the given plan if
+        any. Return the payment device of the better of the two plans, or None
+        if no plan could pay off the loans.
         '''
-        unpaid = lambda x: x.balance > 0
-        paid = lambda x: x.balance <= 0
+        scheduleSink = self._create_schedule_sink()
+
+        with profiling.time_phase(self.profile, 'optimization'):
+            bestPlan = self.planOptimizer.optimize(self.paymentDeviceClass, self.loanConfig.dateOfBirth, loanSets,
+                self.profile, scheduleSink, incumbent)
 
-        for dollar in range(int(self.loanConfig.upfrontPayment)):
-            loan = heuristic(filter(unpaid, loans), loan_config.LoanConfig.DAYS_PER_MONTH)
-            loan.upfrontPayment += 1
-            loan.balance -= 1
+        if scheduleSink and (not bestPlan or (bestPlan.scheduleSink is not scheduleSink)):
+            scheduleSink.discard()
 
-        for loan in filter(paid, loans):
-            for dollar in range(int(loan.monthlyPayment)):
-                loan2 = heuristic(filter(unpaid, loans), loan_config.LoanConfig.DAYS_PER_MONTH)
-                loan2.monthlyIncrease += 1
-                loan2.monthlyPayment += 1
+        if incumbent and (incumbent is not bestPlan):
+            incumbent.release()
 
-    def _allocate_monthly_increase(self, loans, heuristic):
+        return bestPlan
+
+    def _get_distinct_changed_loans(self):
         '''
-        Use the given metric to modify the given loans using the user-specified
-        monthly payment increase.
+        Return each distinct set of loans resulting from making the user-specified
+        payment changes using each of the available metrics.
         '''
-        unpaid = lambda x: x.balance > 0
+        [loanSets, seen] = [list(), set()]
+
+        for heuristic in heuristics.ALL_HEURISTICS:
+            loans = self.get_changed_loans(heuristic)
+            key = tuple((x.balance, x.monthlyPayment) for x in loans)
 
-        for dollar in range(int(self.loanConfig.monthlyIncrease)):
-            loan = heuristic(filter(unpaid, loans), loan_config.LoanConfig.DAYS_PER_MONTH)
-            loan.monthlyIncrease += 1
-            loan.monthlyPayment += 1
+            if key not in seen:
+                seen.add(key)
+                loanSets.append(loans)
+
+        return loanSets
+
+    def _do_parallel_payments(self, heuristicLoans, paymentDevices, pruning=True, boundPruning=False):
+        '''
+        Simulate the payment of each given pair of heuristic and loans in the
+        process pool. If pruning is given, every worker prunes against the
+        lowest amount paid by any plan completed so far, and against lower
+        bounds on the amounts paid if bound pruning is also given. Store each
+        successful device in the given dict.
+        '''
+        dateOfBirth = self.loanConfig.dateOfBirth
+        profile = profiling.Profile() if self.profile else None
+
+        [jobs, cacheKeys] = [list(), dict()]
+        bestAmountPaid = float('inf')
+
+        # Cached results are loaded here, and only published to the workers
+        for [heuristic, loans] in heuristicLoans:
+            paymentDevice = self.paymentDeviceClass(dateOfBirth, loans, heuristic)
+            cacheKeys[heuristic] = self._get_cache_key(paymentDevice, heuristic)
+
+            if self._load_cached_result(paymentDevice, cacheKeys[heuristic]):
+                paymentDevices[heuristic] = paymentDevice
+                bestAmountPaid = min(bestAmountPaid, paymentDevice.paymentStats.amountPaid)
+            else:
+                jobs.append([self.paymentDeviceClass, dateOfBirth, loans, heuristic, profile, self.exportSchedule,
+                    pruning, boundPruning])
+
+        with self.pruneBound.get_lock():
+            self.pruneBound.value = bestAmountPaid
+
+        for [heuristic, paymentDevice, profile] in self.pool.imap_unordered(_pay_loans, jobs):
+            if paymentDevice:
+                paymentDevices[heuristic] = paymentDevice
+
+                if cacheKeys[heuristic]:
+                    self.cache.put(cacheKeys[heuristic], paymentDevice)
+
+            if profile:
+                self.profile.merge(profile)
+
+    def _pay_loans(self, paymentDevice, heuristic):
+        '''
+        Simulate the payment of the given device's loans, unless the result of
+        simulating the same loans with the same metric is cached. Return true
+        if the simulation was successful.
+        '''
+        cacheKey = self._get_cache_key(paymentDevice, heuristic)
+
+        if self._load_cached_result(paymentDevice, cacheKey):
+            return True
+
+        if not paymentDevice.pay_loans():
+            paymentDevice.release()
+            return False
+
+        if cacheKey:
+            self.cache.put(cacheKey, paymentDevice)
+
+        return True
+
+    def _get_cache_key(self, paymentDevice, heuristic):
+        '''
+        Return the key of the cached result of simulating the given device's
+        loans with the given metric from today, or None if results may not be
+        cached.
+        '''
+        if not self.cache:
+            return None
+
+        return self.cache.get_key(paymentDevice, heuristic, datetime.datetime.now())
+
+    def _load_cached_result(self, paymentDevice, cacheKey):
+        '''
+        Store the cached result with the given key in the given device. Return
+        true if there was such a result. Cached results have no schedule, so
+        none are used when exporting the schedule of the best plan.
+        '''
+        result = self.cache.get(cacheKey) if (cacheKey and not self.exportSchedule) else None
+
+        if not result:
+            return False
+
+        result.apply(paymentDevice)
+
+        if self.profile:
+            self.profile.cacheHits += 1
+
+        return True
+
+    def export_schedule(self, outputFile, fileFormat=schedule_export.CSV):
+        '''
+        Write the payment schedule of the best plan to the given file in the
+        given format. The planner must have been created to export schedules.
+        Return true if there was a plan to export.
+        '''
+        bestPlan = self.bestChangedPlan or self.bestInitialPlan
+
+        if not bestPlan or not bestPlan.scheduleSink:
+            return False
+
+        bestPlan.scheduleSink.export(outputFile, fileFormat)
+        return True
+
+    def discard_schedules(self):
+        '''
+        Remove the temporary schedules of the best plans.
+        '''
+        for plan in (self.bestInitialPlan, self.bestChangedPlan):
+            if plan and plan.scheduleSink:
+                plan.scheduleSink.discard()
+
+    def _create_schedule_sink(self):
+        '''
+        Return a sink for the payment schedule of a new payment device, or None
+        if schedules are not being exported.
+        '''
+        return schedule_export.ScheduleSink() if self.exportSchedule else None
+
+    def get_changed_loans(self, heuristic, upfrontPayment=None, monthlyIncrease=None):
+        '''
+        Return a copy of the configured loans, modified by the user-specified
+        payment changes using the given metric. Other changes may be given in
+        place of the user-specified changes, for example to plan other changes
+        with the same metric.
+        '''
+        loans = [x.clone() for x in self.loanConfig.loans]
+
+        if upfrontPayment is None:
+            upfrontPayment = self.loanConfig.upfrontPayment
+
+        if monthlyIncrease is None:
+            monthlyIncrease = self.loanConfig.monthlyIncrease
+
+        if self.profile:
+            heuristic = self.profile.count_calls(heuristic)
+
+        with profiling.time_phase(self.profile, 'allocation'):
+            allocation.allocate_upfront_payment(heuristic, loans, upfrontPayment)
+            allocation.allocate_monthly_increase(heuristic, loans, monthlyIncrease)
+
+        return loans
 
     def _get_best_payment_plan(self, listOfPaymentPlans):
         '''
-        Return the best payment plan in the given list of plans.
+        Return the best payment plan in the given list of plans. All other
+        plans are released, keeping only their payment statistics.
+
+        Ties are settled by the name of each plan's metric, rather than by the
+        order of the dict, so that a plan released in favor of a tied plan is
+        never chosen once more plans are added.
         '''
         bestPlan = None
 
-        for [heuristic, plan] in listOfPaymentPlans.iteritems():
+        for [heuristic, plan] in sorted(listOfPaymentPlans.iteritems(), key=lambda x: x[0].__name__):
             amountPaid = plan.paymentStats.amountPaid
             lowestAmountPaid = bestPlan.paymentStats.amountPaid if bestPlan else 0
 
             if not bestPlan or (amountPaid < lowestAmountPaid):
                 bestPlan = plan
 
+        for plan in listOfPaymentPlans.itervalues():
+            if plan is not bestPlan:
+                plan.release()
+
         return bestPlan
 
+def get_result_cache(cacheDir, cacheSize=None):
+    '''
+    Return a result cache in the given directory, bounded by the given size in
+    megabytes. The cache module hashes the source of the loan planner when it
+    is imported, so it is only imported when a cache is used.
+    '''
+    import result_cache
+
+    maxBytes = (cacheSize * 1024 * 1024) if cacheSize else result_cache.DEFAULT_MAX_BYTES
+    return result_cache.ResultCache(cacheDir, maxBytes=maxBytes)
+
 def main():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -170,12 +587,115 @@ def main():
         '-c', '--config-file-path', dest='config_file_path',
         default=DEFAULT_CONFIG_FILE_PATH, help='Path to loan configuration file')
 
+    parser.add_argument(
+        '-e', '--engine', dest='engine', choices=ENGINE_NAMES,
+        default=payment_device.DEFAULT_ENGINE, help='Payment simulation engine')
+
+    parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=1,
+        help='Number of processes to evaluate heuristics with')
+
+    parser.add_argument(
+        '-p', '--profile', dest='profile', action='store_true',
+        help='Report counters and timers of the work done to find the best plan')
+
+    parser.add_argument(
+        '--profile-file', dest='profile_file', default=None,
+        help='Path to write cProfile statistics to, readable with pstats (only covers the main process)')
+
+    parser.add_argument(
+        '-O', '--optimize', dest='optimize', action='store_true',
+        help='Search the decisions made each time a loan is paid off, rather than only following each heuristic')
+
+    parser.add_argument(
+        '--tolerance', dest='tolerance', type=float, default=0.0,
+        help='Dollars within which an optimized plan must be of the best plan searched')
+
+    parser.add_argument(
+        '--time-budget', dest='time_budget', type=float, default=None,
+        help='Seconds to search for each optimized plan before settling for the best plan found')
+
+    parser.add_argument(
+        '-s', '--schedule-file', dest='schedule_file', default=None,
+        help='Path to export the payment schedule of the best plan to')
+
+    parser.add_argument(
+        '--schedule-format', dest='schedule_format', choices=schedule_export.FORMATS,
+        default=schedule_export.CSV, help='Format of the exported payment schedule')
+
+    parser.add_argument(
+        '--sensitivity', dest='sensitivity', type=int, nargs='?', const=100, default=None,
+        help='Also rank the value of giving this many more dollars to each loan (100 if not given)')
+
+    parser.add_argument(
+        '--bound-pruning', dest='bound_pruning', action='store_true',
+        help='Prune a plan once a lower bound on its total amount paid exceeds the best plan so far')
+
+    parser.add_argument(
+        '--no-checkpoints', dest='checkpoints', action='store_false',
+        help='Simulate every plan from the start, rather than resuming from states shared with other plans')
+
+    parser.add_argument(
+        '--heuristic-stats', dest='heuristic_stats', default=None,
+        help='Path to a file of which heuristics found the best plans, used to simulate the likely best first')
+
+    parser.add_argument(
+        '--cache-dir', dest='cache_dir', default=None,
+        help='Directory in which to cache simulation results between runs')
+
+    parser.add_argument(
+        '--cache-size', dest='cache_size', type=int, default=None,
+        help='Maximum size of the cache directory in megabytes (64 by default)')
+
+    parser.add_argument(
+        '--config-snapshot-dir', dest='config_snapshot_dir', default=None,
+        help='Directory in which to keep snapshots of parsed config files, to skip parsing unchanged files')
+
     args = parser.parse_args()
 
-    loanPlanner = LoanPlanner(args.config_file_path)
-    loanPlanner.find_best_plan()
+    profile = profiling.Profile() if (args.profile or args.profile_file) else None
+    cache = get_result_cache(args.cache_dir, args.cache_size) if args.cache_dir else None
+
+    planOptimizer = optimizer.PlanOptimizer(args.tolerance, args.time_budget) if args.optimize else None
+    checkpoints = checkpoint.CheckpointStore() if args.checkpoints else None
+    heuristicStats = heuristic_stats.HeuristicStats(args.heuristic_stats)
+
+    loanPlanner = LoanPlanner(args.config_file_path, args.engine, args.jobs, profile=profile, cache=cache,
+        exportSchedule=bool(args.schedule_file), planOptimizer=planOptimizer, checkpoints=checkpoints,
+        configSnapshotDir=args.config_snapshot_dir, boundPruning=args.bound_pruning, heuristicStats=heuristicStats)
+
+    try:
+        if args.profile_file:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.runcall(loanPlanner.find_best_plan)
+            profiler.dump_stats(args.profile_file)
+        else:
+            loanPlanner.find_best_plan()
+
+        if args.schedule_file:
+            with open(args.schedule_file, 'wb') as scheduleFile:
+                loanPlanner.export_schedule(scheduleFile, args.schedule_format)
+
+        heuristicStats.save()
+    finally:
+        loanPlanner.discard_schedules()
+
     print loanPlanner
 
+    if args.sensitivity:
+        # Only imported when used, as it may import NumPy
+        import sensitivity
+
+        sensitivities = sensitivity.analyze(loanPlanner, args.sensitivity)
+
+        if sensitivities:
+            print sensitivity.format_sensitivities(sensitivities, args.sensitivity),
+
+    if profile:
+        print 'Profile:\n\n%s' % (profile)
+
     return (loanPlanner.bestInitialPlan or loanPlanner.bestChangedPlan)
 
 if __name__ == '__main__':
@@ -0,0 +1,260 @@
+'''
+Simulate the payment of loans with variable interest rates, and report the
+distribution of the amount paid and finish date of each heuristic's plan.
+
+A loan's rate is variable if it is given a RateVolatility, the yearly standard
+deviation of its rate in percentage points. Rate paths are sampled from a
+seeded mean-reverting model, which drifts each rate back towards its configured
+value. Paths are simulated side by side in batches, spread across worker
+processes, and every heuristic is simulated on the same paths. Loans with fixed
+rates pay exactly as they do in the daily engine.
+
+Example
+-------
+python monte_carlo.py -c loans.ini -n 5000 -s 42
+python monte_carlo.py -c loans.ini -n 20000 -j 8 --reversion 0.5
+'''
+import argparse
+import datetime
+import multiprocessing
+import random
+import sys
+
+import numpy
+
+import heuristics
+import loan_planner
+import scenario_device
+
+# Default number of rate paths simulated for each heuristic
+DEFAULT_PATHS = 1000
+
+# Default number of rate paths simulated side by side by a single process
+DEFAULT_BATCH_SIZE = 250
+
+# Default yearly rate at which interest rates revert to their configured values
+DEFAULT_REVERSION = 0.25
+
+# Number of months of each sampled rate path, after which rates stay constant
+HORIZON_MONTHS = 50 * 12
+
+# Percentiles reported for each heuristic
+PERCENTILES = [5, 25, 50, 75, 95]
+
+class RateModel(object):
+    '''
+    Class to sample monthly interest rate paths from a discretized Vasicek
+    model. Each month, a rate moves towards its loan's configured rate by the
+    reversion rate, plus a normally distributed shock scaled by the loan's
+    volatility. Rates are floored at zero. Every path starts at the configured
+    rate, so a loan without volatility keeps exactly that rate.
+    '''
+    def __init__(self, reversion=DEFAULT_REVERSION, horizonMonths=HORIZON_MONTHS):
+        self.reversion = reversion
+        self.horizonMonths = horizonMonths
+
+    def sample(self, loans, paths, randomState):
+        '''
+        Return an array of sampled yearly interest rates, with a row per path,
+        a column per loan, and a rate for each month of the horizon.
+        '''
+        interestRate = numpy.array([x.interestRate for x in loans], dtype=float)
+        volatility = numpy.array([x.rateVolatility for x in loans], dtype=float)
+
+        timeStep = 1.0 / 12.0
+        shocks = randomState.standard_normal((paths, len(loans), self.horizonMonths))
+        shocks *= volatility[:, numpy.newaxis] * numpy.sqrt(timeStep)
+
+        rates = numpy.empty((paths, len(loans), self.horizonMonths), dtype=float)
+        rates[:, :, 0] = interestRate
+
+        for month in xrange(1, self.horizonMonths):
+            lastRates = rates[:, :, month - 1]
+            rates[:, :, month] = lastRates + (self.reversion * (interestRate - lastRates) * timeStep)
+            rates[:, :, month] += shocks[:, :, month]
+
+        return numpy.maximum(rates, 0.0, out=rates)
+
+class RateDistribution(object):
+    '''
+    Class to store the amount paid and finish date of a heuristic's plan on
+    each rate path. Paths which reached the end of time are counted apart.
+    '''
+    def __init__(self):
+        self.amountsPaid = list()
+        self.finishDates = list()
+        self.unfinished = 0
+
+    def add(self, paymentStats):
+        '''
+        Add the payment statistics of a single rate path, which are None if the
+        path did not finish.
+        '''
+        if paymentStats:
+            self.amountsPaid.append(paymentStats.amountPaid)
+            self.finishDates.append(paymentStats.finishDate.date().toordinal())
+        else:
+            self.unfinished += 1
+
+    def merge(self, other):
+        '''
+        Add the paths of another distribution to this one.
+        '''
+        self.amountsPaid.extend(other.amountsPaid)
+        self.finishDates.extend(other.finishDates)
+        self.unfinished += other.unfinished
+
+    def get_percentiles(self):
+        '''
+        Return the amount paid and finish date at each reported percentile, or
+        None if no path finished. Finish dates are those of actual paths.
+        '''
+        if not self.amountsPaid:
+            return None
+
+        amountsPaid = numpy.percentile(self.amountsPaid, PERCENTILES)
+        finishDates = numpy.percentile(self.finishDates, PERCENTILES, interpolation='nearest')
+
+        return [[p, a, datetime.date.fromordinal(int(d))] for [p, a, d] in zip(PERCENTILES, amountsPaid, finishDates)]
+
+def _simulate_batch(args):
+    '''
+    Simulate a single batch of rate paths for each heuristic, in a worker
+    process. The batch's paths, and the choices of the random heuristic, are
+    seeded from the given seed and the batch's index, so results do not depend
+    on how batches are spread across processes. Return the distribution of each
+    heuristic over the batch.
+    '''
+    [dateOfBirth, heuristicLoans, rateModel, seed, batchIndex, paths] = args
+
+    randomState = numpy.random.RandomState([seed, batchIndex])
+    random.seed((seed, batchIndex))
+    ratePaths = rateModel.sample(heuristicLoans[0][1], paths, randomState)
+
+    distributions = list()
+
+    for [heuristic, loans] in heuristicLoans:
+        paymentDevice = scenario_device.ScenarioPaymentDevice(dateOfBirth, [loans] * paths, heuristic,
+            ratePaths=ratePaths)
+
+        distribution = RateDistribution()
+
+        for paymentStats in paymentDevice.pay_loans():
+            distribution.add(paymentStats)
+
+        distributions.append([heuristic, distribution])
+
+    return distributions
+
+def simulate(loanPlanner, paths, rateModel, seed, batchSize=DEFAULT_BATCH_SIZE, jobs=1):
+    '''
+    Simulate the given number of rate paths for each heuristic, following the
+    plan the given loan planner would make with that heuristic, including any
+    user-specified changes. Return a list of each heuristic and its
+    distribution. The random heuristic's changes are seeded as well.
+    '''
+    loanConfig = loanPlanner.loanConfig
+    heuristicLoans = list()
+
+    random.seed(seed)
+
+    for heuristic in heuristics.ALL_HEURISTICS:
+        loans = loanPlanner.get_changed_loans(heuristic) if loanConfig.any_changes() else loanConfig.loans
+        heuristicLoans.append([heuristic, loans])
+
+    tasks = list()
+
+    for [batchIndex, start] in enumerate(xrange(0, paths, batchSize)):
+        tasks.append([loanConfig.dateOfBirth, heuristicLoans, rateModel, seed, batchIndex,
+            min(batchSize, paths - start)])
+
+    distributions = [[x, RateDistribution()] for x in heuristics.ALL_HEURISTICS]
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+
+        try:
+            results = pool.map(_simulate_batch, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_simulate_batch(x) for x in tasks]
+
+    for result in results:
+        for [[_, distribution], [_, batchDistribution]] in zip(distributions, result):
+            distribution.merge(batchDistribution)
+
+    return distributions
+
+def format_distributions(distributions):
+    '''
+    Format the percentiles of each heuristic's distribution.
+    '''
+    ret = ''
+
+    for [heuristic, distribution] in distributions:
+        ret += '%s:\n\n' % (heuristic.__name__)
+        percentiles = distribution.get_percentiles()
+
+        if percentiles:
+            for [percentile, amountPaid, finishDate] in percentiles:
+                ret += '\tP%d: $%.2f, finished %s\n' % (percentile, amountPaid, finishDate.strftime('%m/%d/%Y'))
+
+        if distribution.unfinished:
+            ret += '\t%d paths reached the end of time without paying all loans\n' % (distribution.unfinished)
+
+        ret += '\n'
+
+    return ret
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+
+    parser.add_argument(
+        '-c', '--config-file-path', dest='config_file_path',
+        default=loan_planner.DEFAULT_CONFIG_FILE_PATH, help='Path to loan configuration file')
+
+    parser.add_argument(
+        '-n', '--paths', dest='paths', type=int, default=DEFAULT_PATHS,
+        help='Number of rate paths to simulate for each heuristic')
+
+    parser.add_argument(
+        '-s', '--seed', dest='seed', type=int, default=None,
+        help='Seed of the sampled rate paths (random if not given)')
+
+    parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=multiprocessing.cpu_count(),
+        help='Number of processes to simulate rate paths with')
+
+    parser.add_argument(
+        '-b', '--batch-size', dest='batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+        help='Number of rate paths to simulate side by side')
+
+    parser.add_argument(
+        '--reversion', dest='reversion', type=float, default=DEFAULT_REVERSION,
+        help='Yearly rate at which interest rates revert to their configured values')
+
+    args = parser.parse_args()
+
+    loanPlanner = loan_planner.LoanPlanner(args.config_file_path)
+
+    if not loanPlanner.loanConfig.parsed():
+        print 'Could not parse given config file: %s' % (args.config_file_path)
+        return False
+
+    seed = random.randint(0, (2 ** 32) - 1) if (args.seed is None) else args.seed
+    rateModel = RateModel(args.reversion)
+
+    distributions = simulate(loanPlanner, args.paths, rateModel, seed, args.batch_size, args.jobs)
+
+    print '%s' % (loanPlanner.loanConfig)
+    print 'Simulated %d rate paths (seed %d):\n' % (args.paths, seed)
+    print format_distributions(distributions),
+
+    return any(x.amountsPaid for [_, x] in distributions)
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,226 @@
+'''
+optimizer
+'''
+import timeit
+
+import heuristics
+import payment_device
+
+def get_target_heuristic(targetName):
+    '''
+    Return a heuristic which gives dollars to the loan with the given name.
+    Once that loan is no longer eligible, or if no loan is named, dollars go to
+    the loan with the highest interest rate.
+    '''
+    key = lambda loan, daysSinceLastPayment: (loan.name != targetName, -loan.interestRate)
+
+    @heuristics.priority_key(key)
+    def target_heuristic(loans, daysSinceLastPayment):
+        return min(loans, key=lambda x: key(x, daysSinceLastPayment))
+
+    return target_heuristic
+
+class SearchBound(object):
+    '''
+    Class to hold the amount above which a partial plan can no longer improve
+    on the best plan found so far, in the same form as the bound shared by
+    worker processes.
+    '''
+    def __init__(self):
+        self.value = float('inf')
+
+class PlanOptimizer(object):
+    '''
+    Class to search the decisions made each time a loan is paid off for the
+    plan which pays the least, rather than following a single heuristic. Each
+    decision gives the paid loan's monthly payment to one of the eligible loans.
+
+    The search is a depth-first branch-and-bound over these decisions. Each
+    node is a snapshot of a simulation just after a reallocation, and children
+    are visited in order of their lower bound. A node is pruned once its lower
+    bound comes within the tolerance of the best plan found so far, and a
+    simulation is pruned once its amount paid does the same. If the time
+    budget runs out once a plan has been found, the best plan found so far is
+    returned, and the gap to the lowest bound of the unexplored nodes is
+    reported.
+
+    Decisions only give each paid loan's payment to a single loan, so the
+    plans of heuristics which split it are outside the searched space. The
+    search may thus start from an incumbent plan found by a heuristic, which
+    is returned if no searched plan improves on it. The gap is always to the
+    best plan within the searched space.
+    '''
+    def __init__(self, tolerance=0.0, timeBudget=None):
+        self.tolerance = tolerance
+        self.timeBudget = timeBudget
+
+        self.nodes = 0
+        self.prunedNodes = 0
+        self.lowerBound = None
+        self.gap = None
+
+        self.paymentDeviceClass = None
+        self.dateOfBirth = None
+        self.profile = None
+
+        self.bound = None
+        self.bestAmountPaid = None
+        self.bestDecisions = None
+        self.deadline = None
+
+    def optimize(self, paymentDeviceClass, dateOfBirth, loanSets, profile=None, scheduleSink=None, incumbent=None):
+        '''
+        Search for the best plan to pay off any of the given sets of loans,
+        using the given payment device class, starting from the given completed
+        payment device if any. The best searched plan is simulated once more in
+        a new payment device, which is returned if it improves on the incumbent.
+        Otherwise the incumbent is returned, or None if no plan could pay off
+        the loans.
+        '''
+        self.paymentDeviceClass = paymentDeviceClass
+        self.dateOfBirth = dateOfBirth
+        self.profile = profile
+
+        self.nodes = 0
+        self.prunedNodes = 0
+
+        self.bound = SearchBound()
+        self.bestAmountPaid = float('inf')
+        self.bestDecisions = None
+
+        if incumbent:
+            self.bestAmountPaid = incumbent.paymentStats.amountPaid
+            self.bound.value = self.bestAmountPaid - self.tolerance
+
+        self.lowerBound = float('inf')
+        self.deadline = (timeit.default_timer() + self.timeBudget) if self.timeBudget else None
+
+        roots = list()
+
+        for loans in loanSets:
+            paymentDevice = self._create_device(loans)
+
+            if paymentDevice.start():
+                snapshot = paymentDevice.snapshot()
+                lowerBound = payment_device.get_lower_bound(snapshot.amountPaid, snapshot.loans)
+
+                roots.append([lowerBound, len(roots), snapshot, loans])
+
+        for [lowerBound, _, snapshot, loans] in sorted(roots):
+            self._search(snapshot, lowerBound, [loans])
+
+        if (self.bestDecisions is None) and not incumbent:
+            self.gap = None
+            return None
+
+        self.lowerBound = min(self.lowerBound, self.bestAmountPaid - self.tolerance)
+        self.gap = max(self.bestAmountPaid - self.lowerBound, 0.0)
+
+        if self.bestDecisions is None:
+            return incumbent
+
+        return self._replay(scheduleSink)
+
+    def is_proven(self):
+        '''
+        Return true if the last plan found is known to be within the tolerance
+        of the best plan in the searched space.
+        '''
+        return (self.gap is not None) and (self.gap <= self.tolerance)
+
+    def _search(self, snapshot, lowerBound, decisions):
+        '''
+        Search the plans resumed from the given snapshot, which was reached by
+        the given decisions. The first decision is the set of loans the plan
+        started with.
+        '''
+        if lowerBound >= self.bound.value:
+            self.prunedNodes += 1
+            return
+
+        if self.deadline and (self.bestAmountPaid < float('inf')) and (timeit.default_timer() > self.deadline):
+            self.lowerBound = min(self.lowerBound, lowerBound)
+            return
+
+        self.nodes += 1
+
+        paymentDevice = self._create_device(list(), self.bound)
+        paymentDevice.restore(snapshot)
+
+        paidLoans = paymentDevice.advance()
+
+        if not paidLoans:
+            return
+
+        if not paymentDevice.loans:
+            paymentDevice.reallocate(paidLoans)
+            paymentDevice.finish(True)
+
+            amountPaid = paymentDevice.paymentStats.amountPaid
+
+            if amountPaid < self.bestAmountPaid:
+                self.bestAmountPaid = amountPaid
+                self.bestDecisions = decisions
+                self.bound.value = amountPaid - self.tolerance
+
+            return
+
+        payoff = paymentDevice.snapshot()
+        children = dict()
+
+        targets = [x.name for x in payoff.loans if x.balance > x.monthlyPayment] or [None]
+
+        for target in targets:
+            child = self._create_device(list(), self.bound)
+            child.restore(payoff)
+
+            child.allocationDecider = self._get_decider(target)
+            child.reallocate(paidLoans)
+
+            childSnapshot = child.snapshot()
+            key = tuple(x.monthlyPayment for x in childSnapshot.loans)
+
+            # Targets which end up with the same payments lead to the same plans
+            if key not in children:
+                childBound = payment_device.get_lower_bound(childSnapshot.amountPaid, childSnapshot.loans)
+                children[key] = [childBound, len(children), childSnapshot, target]
+
+        for [childBound, _, childSnapshot, target] in sorted(children.itervalues()):
+            self._search(childSnapshot, childBound, decisions + [target])
+
+    def _replay(self, scheduleSink):
+        '''
+        Simulate the best plan found from the start, following its decisions,
+        so that the returned device holds the whole plan and its schedule.
+        '''
+        decisions = list(self.bestDecisions)
+        paymentDevice = self._create_device(decisions.pop(0), scheduleSink=scheduleSink)
+
+        if not paymentDevice.start():
+            return None
+
+        status = True
+
+        while paymentDevice.loans and status:
+            paidLoans = paymentDevice.advance()
+            target = decisions.pop(0) if (decisions and paymentDevice.loans) else None
+
+            paymentDevice.allocationDecider = self._get_decider(target)
+            status = paymentDevice.reallocate(paidLoans)
+
+        return paymentDevice if paymentDevice.finish(status) else None
+
+    def _create_device(self, loans, pruneBound=None, scheduleSink=None):
+        '''
+        Create a payment device for the given loans.
+        '''
+        return self.paymentDeviceClass(self.dateOfBirth, loans, get_target_heuristic(None), pruneBound=pruneBound,
+            profile=self.profile, scheduleSink=scheduleSink)
+
+    def _get_decider(self, target):
+        '''
+        Return the heuristic for the given decision, counted by the profile if
+        profiling is enabled.
+        '''
+        heuristic = get_target_heuristic(target)
+        return self.profile.count_calls(heuristic) if self.profile else heuristic
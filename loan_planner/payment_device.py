@@ -1,10 +1,37 @@
-import collections
-import copy
+import calendar
 import datetime
+import heapq
 
 from dateutil import relativedelta
 
+import allocation
 import loan_config
+import profiling
+
+# Kinds of event recorded in a payment plan. Each event is a tuple of its kind
+# followed by the values it is formatted with, and is only formatted when the
+# plan is printed.
+LOAN_ALREADY_PAID = 'alreadyPaid'
+LOAN_PAID = 'paid'
+PAYMENT_INCREASED = 'increased'
+PAYMENTS_REALLOCATED = 'reallocated'
+PLAN_PRUNED = 'pruned'
+END_OF_TIME = 'endOfTime'
+
+PLAN_EVENT_FORMATS = {
+    LOAN_ALREADY_PAID : 'Loan %s finished in 0 months\n\n',
+    LOAN_PAID : 'Loan %s finished in %d months\n',
+    PAYMENT_INCREASED : 'Increase %s by $%.2f to $%.2f\n',
+    PAYMENTS_REALLOCATED : '\n',
+    PLAN_PRUNED : 'Prune plan at $%.2f',
+    END_OF_TIME : 'Reached end of time without paying all loans\n',
+}
+
+def format_plan_event(event):
+    '''
+    Format a single payment plan event.
+    '''
+    return PLAN_EVENT_FORMATS[event[0]] % event[1:]
 
 def to_months(timeDiff):
     '''
@@ -31,6 +58,273 @@ def get_age_on_date(dateOfBirth, date):
 
     return (date.year - dateOfBirth.year)
 
+def increase_payment(loan, dollars):
+    '''
+    Increase a loan's monthly payment by the given whole number of dollars.
+    '''
+    loan.monthlyPayment = loan_config.add_dollars(loan.monthlyPayment, dollars)
+
+def get_days_since_last_payment(paymentDate):
+    '''
+    Determine the number of days between the given payment date and the same
+    day of the previous month.
+    '''
+    calendarTable = get_calendar_table(paymentDate)
+    return calendarTable.daysSinceLastPayment[calendarTable.get_index(paymentDate.toordinal())]
+
+def get_days_in_month(month):
+    '''
+    Determine the number of days in the given month, counted in months since
+    the start of year zero.
+    '''
+    [year, monthOfYear] = divmod(month, 12)
+    return calendar.monthrange(year, monthOfYear + 1)[1]
+
+def get_next_payment_date(date, paymentDay):
+    '''
+    Find the first date on or after the given date which falls on the given
+    day of the month. Months without that day are skipped, just as they are
+    when stepping through each day. Return None if no such date exists.
+    '''
+    if (paymentDay < 1) or (paymentDay > 31):
+        return None
+
+    year = date.year
+    month = date.month
+
+    if date.day > paymentDay:
+        [year, month] = [year + (month // 12), (month % 12) + 1]
+
+    while True:
+        try:
+            return date.replace(year=year, month=month, day=paymentDay)
+        except ValueError:
+            [year, month] = [year + (month // 12), (month % 12) + 1]
+
+# Fewest days between two payments of a loan, so the least interest accrued by
+# any payment is this many days of interest on the loan's balance
+MIN_DAYS_BETWEEN_PAYMENTS = 28
+
+# Most rounds of tightening a lower bound on the total amount paid
+MAX_LOWER_BOUND_ROUNDS = 3
+
+def get_payoff_lower_bound(loan, get_max_payment, constantAfter=0):
+    '''
+    Return lower bounds on the number of payments needed to pay off the given
+    loan, and on the interest it must accrue before then, given the most that
+    may be paid towards the loan by each of its payments. Return None if the
+    loan could not be paid off before the end of time.
+
+    The most that may be paid must not change after the given number of
+    payments, so that a loan which then accrues at least that much interest
+    each payment is known to be unpayable without counting to the end of time.
+    '''
+    rate = loan.interestRate * (MIN_DAYS_BETWEEN_PAYMENTS / 365.0)
+    maxPayments = PaymentDevice.MAX_YEAR * 12
+
+    [balance, interest, payments] = [loan.balance, 0.0, 0]
+
+    while payments < maxPayments:
+        accrued = balance * rate
+        maxPayment = get_max_payment(payments)
+
+        if (payments >= constantAfter) and (accrued >= maxPayment):
+            return None
+
+        payments += 1
+        interest += accrued
+        balance += accrued
+
+        if balance <= maxPayment:
+            return [payments, interest]
+
+        balance -= maxPayment
+
+    return None
+
+def get_payoff_lower_bounds(loans):
+    '''
+    Return lower bounds on the number of payments needed to pay off each of
+    the given loans, and on the interest each must accrue before then. The
+    bound of a loan is None if no plan could pay it off before the end of time.
+
+    Payments are never reduced, so while other loans are unpaid their monthly
+    payments can not be paid towards a loan. A loan's payment is thus bounded
+    by the total monthly payment, less the payments of the loans which could
+    not yet have been paid off. Each loan is relaxed to accrue the least
+    interest of any payment. Loans paid on days which some months skip may
+    make their payments later than counted, so they are only bounded by the
+    total monthly payment.
+
+    The number of payments before each loan could be paid off is first bounded
+    by giving it the total monthly payment. Bounding each loan's payments by
+    the loans which could not yet have been paid off then gives later payoffs,
+    which lock more payments in turn. Each round of this stays a lower bound,
+    and rounds are repeated until the payoffs no longer change, or until some
+    loan could not be paid off.
+    '''
+    if not loans:
+        return list()
+
+    totalPayment = sum(x.monthlyPayment for x in loans)
+    payoffs = [get_payoff_lower_bound(x, lambda payments: totalPayment) for x in loans]
+
+    for _ in xrange(MAX_LOWER_BOUND_ROUNDS):
+        if None in payoffs:
+            return payoffs
+
+        # The number of payments of other loans which must be made before each
+        # loan's payment could be freed. A loan paid off by its last payment
+        # frees its payment for the other loans' payments of the same number.
+        freedAfter = [x[0] - 1 for x in payoffs]
+
+        # The total payment of the loans still unpaid after each number of
+        # payments
+        lockedPayments = [0.0] * (max(freedAfter) + 1)
+
+        for [loan, freed] in zip(loans, freedAfter):
+            for payments in xrange(freed):
+                lockedPayments[payments] += loan.monthlyPayment
+
+        lastPayoffs = payoffs
+        payoffs = list()
+
+        for [loan, freed] in zip(loans, freedAfter):
+            if loan.paymentDay > MIN_DAYS_BETWEEN_PAYMENTS:
+                get_max_payment = lambda payments: totalPayment
+            else:
+                get_max_payment = lambda payments, loan=loan, freed=freed: totalPayment - \
+                    (lockedPayments[payments] if (payments < len(lockedPayments)) else 0.0) + \
+                    (loan.monthlyPayment if (payments < freed) else 0.0)
+
+            payoffs.append(get_payoff_lower_bound(loan, get_max_payment, len(lockedPayments)))
+
+        if payoffs == lastPayoffs:
+            break
+
+    return payoffs
+
+def get_lower_bound(amountPaid, loans):
+    '''
+    Return a lower bound on the total amount paid by any plan which has paid
+    the given amount so far and has the given loans left to pay, or infinity
+    if no such plan can pay off every loan. The bound is the balance of each
+    loan plus the least interest it must accrue before being paid off.
+    '''
+    if not loans:
+        return amountPaid
+
+    payoffs = get_payoff_lower_bounds(loans)
+
+    if None in payoffs:
+        return float('inf')
+
+    return amountPaid + sum(x.balance for x in loans) + sum(x[1] for x in payoffs)
+
+def find_unpayable_loans(loans):
+    '''
+    Find the given loans which no plan could pay off before the end of time,
+    however the payments of other loans are reallocated once they are paid off.
+    Return a list of each such loan, a lower bound on the whole number of
+    dollars its monthly payment must be increased by before any plan could pay
+    it off, and the whole number of dollars after which its own payment covers
+    the interest of its longest month. Each loan's increase is bounded with the
+    other loans unchanged.
+    '''
+    loans = [x for x in loans if x.balance > 0]
+
+    if not loans:
+        return list()
+
+    payoffs = get_payoff_lower_bounds(loans)
+    unpayableLoans = list()
+
+    for index in [i for [i, x] in enumerate(payoffs) if x is None]:
+        loan = loans[index]
+
+        def is_payable(increase):
+            increasedLoans = list(loans)
+            increasedLoans[index] = loan.clone()
+            increase_payment(increasedLoans[index], increase)
+
+            return get_payoff_lower_bounds(increasedLoans)[index] is not None
+
+        interest = loan.get_interest_accrued(31)
+        [low, high] = [0, max(int(interest - loan.monthlyPayment) + 1, 1)]
+
+        while not is_payable(high):
+            [low, high] = [high, high * 2]
+
+        ownIncrease = high
+
+        while (high - low) > 1:
+            middle = (low + high) // 2
+
+            if is_payable(middle):
+                high = middle
+            else:
+                low = middle
+
+        unpayableLoans.append([loan, high, ownIncrease])
+
+    return unpayableLoans
+
+class CalendarTable(object):
+    '''
+    Class to map each day, given as its proleptic Gregorian ordinal, to its day
+    of the month and to the number of days since the same day of the previous
+    month, so that days may be stepped through as integers. The same day of a
+    shorter previous month is its last day. The table covers whole months from
+    the month of its first date, and grows a year at a time as later days are
+    needed.
+    '''
+    def __init__(self, firstDate):
+        self.firstOrdinal = datetime.date(firstDate.year, firstDate.month, 1).toordinal()
+        self.nextMonth = (firstDate.year * 12) + firstDate.month - 1
+
+        self.daysOfMonth = list()
+        self.daysSinceLastPayment = list()
+
+    def get_index(self, ordinal):
+        '''
+        Return the index of the given day in the table, growing the table to
+        cover the day if needed.
+        '''
+        index = ordinal - self.firstOrdinal
+
+        while index >= len(self.daysOfMonth):
+            self._extend()
+
+        return index
+
+    def _extend(self):
+        '''
+        Add the next year of days to the table.
+        '''
+        for month in xrange(self.nextMonth, self.nextMonth + 12):
+            daysInLastMonth = get_days_in_month(month - 1)
+            days = range(1, get_days_in_month(month) + 1)
+
+            self.daysOfMonth.extend(days)
+            self.daysSinceLastPayment.extend(max(daysInLastMonth, day) for day in days)
+
+        self.nextMonth += 12
+
+# Calendar table of this process, shared by every simulation
+_calendarTable = None
+
+def get_calendar_table(date):
+    '''
+    Return the calendar table of this process, which covers the given date. The
+    table is only rebuilt if it starts after the given date.
+    '''
+    global _calendarTable
+
+    if not _calendarTable or (date.toordinal() < _calendarTable.firstOrdinal):
+        _calendarTable = CalendarTable(date)
+
+    return _calendarTable
+
 class PaymentStats(object):
     '''
     Class to store statistics about a payment device, or a comparison of two
@@ -61,6 +355,38 @@ class PaymentStats(object):
 
         return ret
 
+    def to_dict(self):
+        '''
+        Return the payment statistics as a dict, for example to be serialized
+        to JSON.
+        '''
+        if self.isRelative:
+            return {
+                'paymentDifference' : self.paymentDifference,
+                'monthsDifference' : self.monthsDifference
+            }
+
+        return {
+            'amountPaid' : self.amountPaid,
+            'monthsPaid' : self.monthsPaid,
+            'yearsPaid' : self.yearsPaid,
+            'finishDate' : self.finishDateStr,
+            'finishAge' : self.finishAge
+        }
+
+    def finish(self, finishDate):
+        '''
+        Set the statistics of a simulation which started at the start date and
+        paid off all loans on the given date.
+        '''
+        timeDiff = relativedelta.relativedelta(finishDate, self.startDate)
+
+        self.finishDate = finishDate
+        self.finishDateStr = finishDate.strftime(loan_config.LoanConfig.DATE_FORMAT)
+        self.monthsPaid = to_months(timeDiff)
+        self.yearsPaid = self.monthsPaid / 12.0
+        self.finishAge = get_age_on_date(self.dateOfBirth, finishDate)
+
     def compare(self, other):
         '''
         Construct a PaymentStats instance to represent the comparison of these
@@ -74,33 +400,80 @@ class PaymentStats(object):
 
         return ret
 
+class PaymentSnapshot(object):
+    '''
+    Class to store the state of a payment device between loan payoffs, from
+    which the simulation may be resumed.
+    '''
+    def __init__(self, paymentStats, currentDate, loans, paymentPlan):
+        self.startDate = paymentStats.startDate
+        self.amountPaid = paymentStats.amountPaid
+
+        self.currentDate = currentDate
+        self.loans = loans
+        self.paymentPlan = list(paymentPlan)
+
 class PaymentDevice(object):
     '''
     Class to simulate paying loans over time.
     '''
     ONE_DAY_DELTA = relativedelta.relativedelta(days=1)
-    ONE_MONTH_DELTA = relativedelta.relativedelta(months=1)
 
     # If this year is reached, stop the simulation
     MAX_YEAR = 3000
+    MAX_ORDINAL = datetime.date(MAX_YEAR, 1, 1).toordinal()
+
+    # Whether a simulation resumed from a checkpoint makes exactly the same
+    # payments as one which never stopped
+    RESUMES_EXACTLY = True
 
-    def __init__(self, dateOfBirth, loans, allocationDecider, bestDevice=None):
+    def __init__(self, dateOfBirth, loans, allocationDecider, bestDevice=None, pruneBound=None, profile=None,
+            scheduleSink=None, checkpoints=None, boundPruning=False):
         self.originalLoans = list()
         self.loans = None
+        self.currentDate = None
 
-        self.allocationDecider = allocationDecider
+        self.allocationDecider = profile.count_calls(allocationDecider) if profile else allocationDecider
         self.bestDevice = bestDevice
+        self.pruneBound = pruneBound
+        self.profile = profile
+        self.scheduleSink = scheduleSink
+        self.checkpoints = checkpoints
+        self.checkedAmountPaid = 0
+
+        # Whether to prune the plan once a lower bound on its total amount paid
+        # exceeds the best plan so far, rather than only its amount paid
+        self.boundPruning = boundPruning
 
         self.paymentStats = PaymentStats(dateOfBirth)
         self.paymentPlan = list()
 
         for loan in loans:
             if loan.balance <= 0:
-                self.paymentPlan.append('Loan %s finished in 0 months\n\n' % (loan.name))
+                self.paymentPlan.append((LOAN_ALREADY_PAID, loan.name))
             self.originalLoans.append(loan)
 
     def __str__(self):
-        return '\t'.join(self.paymentPlan)
+        return '\t'.join(self.get_payment_plan())
+
+    def get_payment_plan(self):
+        '''
+        Return the payment plan as a list of formatted events.
+        '''
+        return [format_plan_event(x) for x in self.paymentPlan]
+
+    def release(self):
+        '''
+        Free the payment plan and simulation state of this device, keeping only
+        its payment statistics. Used once a device's plan is known not to be
+        the best plan.
+        '''
+        self.originalLoans = list()
+        self.loans = list()
+        self.paymentPlan = list()
+
+        if self.scheduleSink:
+            self.scheduleSink.discard()
 
     def pay_loans(self):
         '''
@@ -108,82 +481,298 @@ class PaymentDevice(object):
         paid, reallocate that loan's monthly payment to another loan. Return a
         boolean indicating if the simulation was successful.
         '''
-        self.loans = copy.deepcopy([x for x in self.originalLoans if (x.balance > 0)])
-        status = (len(self.loans) > 0)
+        if not self.start():
+            return False
+
+        return self.resume()
+
+    def start(self):
+        '''
+        Prepare to make monthly loan payments starting today. Return false if
+        there are no loans to pay.
+        '''
+        self.loans = [x.clone() for x in self.originalLoans if (x.balance > 0)]
 
         self.paymentStats.startDate = datetime.datetime.now()
-        currentDate = self.paymentStats.startDate
+        self.currentDate = self.paymentStats.startDate
+
+        if not self.loans:
+            return False
+
+        if self.profile:
+            self.profile.simulations += 1
+
+        if self.scheduleSink:
+            self.scheduleSink.open(self.loans)
+
+        with profiling.time_phase(self.profile, 'scheduling'):
+            self._schedule_payments(self.currentDate)
+
+        return True
+
+    def resume(self):
+        '''
+        Continue making monthly loan payments from the current date until all
+        loans are paid off. Return a boolean indicating if the simulation was
+        successful.
+        '''
+        status = True
 
         while self.loans and status:
-            [paidLoans, currentDate] = self._make_payments_until_loan_paid(currentDate)
-            status = self._handle_paid_loans(paidLoans, currentDate)
+            paidLoans = self.advance()
+            status = self.reallocate(paidLoans)
+
+        return self.finish(status)
+
+    def advance(self):
+        '''
+        Make loan payments from the current date until one or more loans have
+        been paid off. Return a list of those paid loans, which is empty if the
+        plan was pruned or the end of time was reached. If another device made
+        these payments from the same state, resume from its checkpoint instead.
+        '''
+        with profiling.time_phase(self.profile, 'payments'):
+            if self._should_prune_by_bound():
+                self.paymentPlan.append((PLAN_PRUNED, self.paymentStats.amountPaid))
+                return list()
+
+            key = self._get_checkpoint_key()
+            checkpoint = self.checkpoints.get(key) if key else None
+
+            if checkpoint:
+                return self._resume_checkpoint(checkpoint)
+
+            [paidLoans, self.currentDate] = self._make_payments_until_loan_paid(self.currentDate)
+
+            if key and paidLoans:
+                self._sync_loans()
+                self.checkpoints.put(key, self, paidLoans, self.checkedAmountPaid)
+
+        return paidLoans
 
+    def reallocate(self, paidLoans):
+        '''
+        Reallocate the monthly payments of the given paid loans, as returned by
+        advance. Return false if there were no paid loans.
+        '''
+        with profiling.time_phase(self.profile, 'reallocation'):
+            return self._handle_paid_loans(paidLoans, self.currentDate)
+
+    def finish(self, status):
+        '''
+        End the simulation, collecting the payment statistics if it was
+        successful. The schedule sink, if any, is closed. Return the given
+        status.
+        '''
         if status:
-            self._collect_payment_stats(currentDate)
+            self._collect_payment_stats(self.currentDate)
+
+        if self.scheduleSink:
+            self.scheduleSink.close()
 
         return status
 
+    def snapshot(self):
+        '''
+        Return a copy of the state of the simulation, from which it may later
+        be resumed. Only valid between loan payoffs.
+        '''
+        self._sync_loans()
+
+        loans = [x.clone() for x in self.loans]
+        return PaymentSnapshot(self.paymentStats, self.currentDate, loans, self.paymentPlan)
+
+    def restore(self, snapshot):
+        '''
+        Restore the state of the simulation from the given snapshot, which may
+        have been taken from another device using the same heuristic. The
+        schedule sink, if any, only records payments made after the snapshot.
+        '''
+        self.loans = [x.clone() for x in snapshot.loans]
+        self.currentDate = snapshot.currentDate
+
+        self.paymentStats.startDate = snapshot.startDate
+        self.paymentStats.amountPaid = snapshot.amountPaid
+        self.paymentPlan = list(snapshot.paymentPlan)
+
+        if self.scheduleSink and not self.scheduleSink.is_open():
+            self.scheduleSink.open(self.loans)
+
+        self._schedule_payments(self.currentDate)
+
+    def _get_checkpoint_key(self):
+        '''
+        Return the key of the current state in the checkpoint store, or None if
+        checkpoints are not used. Resuming from a checkpoint skips writing the
+        payments which led to it, so they are not used with a schedule sink.
+        '''
+        if not self.checkpoints or self.scheduleSink or not self.RESUMES_EXACTLY:
+            return None
+
+        self._sync_loans()
+        return self.checkpoints.get_key(self)
+
+    def _resume_checkpoint(self, checkpoint):
+        '''
+        Move to the given checkpoint, as if the payments which led to it were
+        made. The plan would have been pruned on the way if the highest amount
+        it was checked at exceeds the bound. Return the loans paid off at the
+        checkpoint, or an empty list if the plan was pruned.
+        '''
+        if self._should_prune_plan(checkpoint.checkedAmountPaid):
+            self.paymentPlan.append((PLAN_PRUNED, checkpoint.checkedAmountPaid))
+            return list()
+
+        self.loans = [x.clone() for x in checkpoint.loans]
+        self.currentDate += checkpoint.date - self.currentDate.date()
+        self.paymentStats.amountPaid = checkpoint.amountPaid
+
+        if self.profile:
+            self.profile.checkpointHits += 1
+
+        self._schedule_payments(self.currentDate)
+
+        return [x.clone() for x in checkpoint.paidLoans]
+
+    def _schedule_payments(self, startDate):
+        '''
+        Prepare to make payments starting at the given date. Stepping through
+        each day requires no preparation.
+        '''
+        pass
+
+    def _sync_loans(self):
+        '''
+        Bring the state of each unpaid loan up to date. Loans are always up to
+        date when stepping through each day.
+        '''
+        pass
+
     def _make_payments_until_loan_paid(self, currentDate):
         '''
         Make loan payments starting at the current date, while moving forward a
         day at a time. Stop when one or more loans have been paid off, or if
         this device has already paid more than the given best device.. Return a
         list of those paid loans and the date they were paid off.
+
+        Days are stepped through as ordinals in the calendar table, and only
+        converted back to a date once the loans are paid off.
         '''
+        calendarTable = get_calendar_table(currentDate)
+        startDay = day = currentDate.toordinal()
+
         paidLoans = list()
 
-        while not paidLoans and (currentDate.year < PaymentDevice.MAX_YEAR):
+        while not paidLoans and (day < PaymentDevice.MAX_ORDINAL):
             if self._should_prune_plan():
-                self.paymentPlan.append('Prune plan at $%.2f' % (self.paymentStats.amountPaid))
+                self.paymentPlan.append((PLAN_PRUNED, self.paymentStats.amountPaid))
                 break
 
-            paidLoans = self._make_payments_on_date(currentDate)
-            currentDate += PaymentDevice.ONE_DAY_DELTA
+            paidLoans = self._make_payments_on_day(calendarTable, day)
+            day += 1
 
-        return [paidLoans, currentDate]
+        return [paidLoans, currentDate + datetime.timedelta(days=day - startDay)]
 
-    def _make_payments_on_date(self, paymentDate):
+    def _make_payments_on_day(self, calendarTable, day):
         '''
         Make a single payment to all loans which have a payment due on the
-        given date. Return a list of any loans that have been paid off.
+        given day ordinal. Return a list of any loans that have been paid off.
         '''
-        loans = [x for x in self.loans if x.paymentDay == paymentDate.day]
+        index = calendarTable.get_index(day)
+        loans = [x for x in self.loans if x.paymentDay == calendarTable.daysOfMonth[index]]
+
+        if self.profile:
+            self.profile.daysStepped += 1
 
-        lastPaymentDate = paymentDate - PaymentDevice.ONE_MONTH_DELTA
-        daysSinceLastPayment = (paymentDate - lastPaymentDate).days
+        if not loans:
+            return loans
+
+        daysSinceLastPayment = calendarTable.daysSinceLastPayment[index]
+        paymentDate = datetime.date.fromordinal(day) if self.scheduleSink else None
 
         paidLoans = list()
 
         for loan in loans:
-            if self._make_loan_payment(loan, daysSinceLastPayment):
+            if self._make_loan_payment(loan, daysSinceLastPayment, paymentDate):
                 self.loans.remove(loan)
                 paidLoans.append(loan)
 
         return paidLoans
 
-    def _make_loan_payment(self, loan, daysSinceLastPayment):
+    def _make_loan_payment(self, loan, daysSinceLastPayment, paymentDate):
         '''
         Make a payment on a loan, handling accrued interest. Return boolean to
         indicate if the loan is paid off.
         '''
-        loan.balance += loan.get_interest_accrued(daysSinceLastPayment)
+        interest = loan.get_interest_accrued(daysSinceLastPayment)
+        loan.balance += interest
         payment = loan.get_payment_amount()
 
         self.paymentStats.amountPaid += payment
         loan.balance -= payment
 
+        if self.profile:
+            self.profile.paymentsMade += 1
+
+        if self.scheduleSink:
+            self.scheduleSink.write(paymentDate, loan, interest, payment - interest, loan.balance)
+
         return (loan.balance <= 0.0)
 
-    def _should_prune_plan(self):
+    def _should_prune_plan(self, amountPaid=None):
+        '''
+        If this payment device was given a best plan so far, or a bound shared
+        with other processes, compare the amount currently paid in this plan,
+        or the given amount, to decide if the simulation should just end early.
+        '''
+        if amountPaid is None:
+            amountPaid = self.checkedAmountPaid = self.paymentStats.amountPaid
+
+        shouldPrune = (self.bestDevice and (amountPaid > self.bestDevice.paymentStats.amountPaid)) or \
+            (self.pruneBound and (amountPaid > self.pruneBound.value))
+
+        if shouldPrune and self.profile:
+            self.profile.prunes += 1
+
+        return bool(shouldPrune)
+
+    def _should_prune_by_bound(self):
         '''
-        If this payment device was given a best plan so far, compare the amount
-        currently paid in this plan to decide if the simulation should just end
-        early.
+        If bound pruning is enabled, add a lower bound on the cost of paying off
+        the remaining loans to the amount currently paid in this plan, and
+        compare that to the best plan so far to decide if the simulation should
+        just end early. The bound only changes when payments are reallocated,
+        so it is only checked before making payments until the next payoff.
         '''
-        if not self.bestDevice:
+        if not self.boundPruning:
+            return False
+
+        incumbent = min(self.bestDevice.paymentStats.amountPaid if self.bestDevice else float('inf'),
+            self.pruneBound.value if self.pruneBound else float('inf'))
+
+        if incumbent == float('inf'):
             return False
 
-        return (self.paymentStats.amountPaid > self.bestDevice.paymentStats.amountPaid)
+        self._sync_loans()
+        amountPaid = self.paymentStats.amountPaid
+
+        with profiling.time_phase(self.profile, 'lower bounds'):
+            lowerBound = get_lower_bound(amountPaid, self.loans)
+
+        if not self._should_prune_plan(lowerBound):
+            return False
+
+        # The plan could not have been pruned by its amount paid until it had
+        # paid the difference, which takes at least this long at the total
+        # monthly payment
+        if self.profile:
+            totalPayment = sum(x.monthlyPayment for x in self.loans)
+            monthsSaved = (incumbent - amountPaid) / totalPayment
+
+            self.profile.boundPrunes += 1
+            self.profile.daysSaved += int(monthsSaved * loan_config.LoanConfig.DAYS_PER_MONTH)
+
+        return True
 
     def _handle_paid_loans(self, paidLoans, currentDate):
         '''
@@ -193,9 +782,12 @@ class PaymentDevice(object):
         timeSoFar = relativedelta.relativedelta(currentDate, self.paymentStats.startDate)
 
         if not paidLoans:
-            self.paymentPlan.append('Reached end of time without paying all loans\n')
+            self.paymentPlan.append((END_OF_TIME, ))
             return False
 
+        if self.profile:
+            self.profile.dollarsReallocated += sum(int(x.monthlyPayment) for x in paidLoans)
+
         for loan in paidLoans:
             self._handle_paid_loan(loan, timeSoFar)
 
@@ -206,35 +798,392 @@ class PaymentDevice(object):
         Handle a single paid loan. Decide which loan should receive the paid
         loan's monthly payment.
         '''
-        self.paymentPlan.append('Loan %s finished in %d months\n' % (paidLoan.name, to_months(timeSoFar)))
-        increasedLoans = collections.defaultdict(int)
+        self.paymentPlan.append((LOAN_PAID, paidLoan.name, to_months(timeSoFar)))
 
         # Only consider loans which have a balance greater than its payment
-        getEligibleLoans = lambda : [x for x in self.loans if (x.balance > x.monthlyPayment)]
-
-        for dollar in range(int(paidLoan.monthlyPayment)):
-            loans = getEligibleLoans()
+        isEligible = lambda x: (x.balance > x.monthlyPayment)
 
-            if loans:
-                loan = self.allocationDecider(loans, loan_config.LoanConfig.DAYS_PER_MONTH)
-
-                increasedLoans[loan] += 1
-                loan.monthlyPayment += 1
+        increasedLoans = allocation.allocate_dollars(self.allocationDecider, self.loans,
+            int(paidLoan.monthlyPayment), loan_config.LoanConfig.DAYS_PER_MONTH, isEligible, increase_payment)
 
         for loan, increase in increasedLoans.iteritems():
-            self.paymentPlan.append('Increase %s by $%.2f to $%.2f\n' % \
-                (loan.name, increase, loan.monthlyPayment))
+            self.paymentPlan.append((PAYMENT_INCREASED, loan.name, increase, loan.monthlyPayment))
 
-        self.paymentPlan.append('\n')
+        self.paymentPlan.append((PAYMENTS_REALLOCATED, ))
 
     def _collect_payment_stats(self, currentDate):
         '''
         Set the payment statistics after the payment simulation has finished.
         '''
-        timeDiff = relativedelta.relativedelta(currentDate, self.paymentStats.startDate)
+        self.paymentStats.finish(currentDate)
+
+class EventPaymentDevice(PaymentDevice):
+    '''
+    Payment device which keeps a queue of the next payment date of each loan,
+    and moves directly from one payment date to the next rather than stepping
+    through every day in between. Produces the same payment plan as stepping
+    day by day.
+    '''
+    def __init__(self, dateOfBirth, loans, allocationDecider, bestDevice=None, pruneBound=None, profile=None,
+            scheduleSink=None, checkpoints=None, boundPruning=False):
+        super(EventPaymentDevice, self).__init__(dateOfBirth, loans, allocationDecider, bestDevice, pruneBound, profile,
+            scheduleSink, checkpoints, boundPruning)
+        self.paymentQueue = list()
+
+    def _schedule_payments(self, startDate):
+        '''
+        Queue the first payment date of each loan. Loans are ordered by their
+        position in the loan list, so that loans due on the same day are paid
+        in the same order as when stepping day by day.
+        '''
+        self.paymentQueue = list()
+
+        for [index, loan] in enumerate(self.loans):
+            paymentDate = get_next_payment_date(startDate, loan.paymentDay)
+
+            if paymentDate:
+                self.paymentQueue.append((paymentDate, index, loan))
+
+        heapq.heapify(self.paymentQueue)
+
+    def _make_payments_until_loan_paid(self, currentDate):
+        '''
+        Make loan payments starting at the current date, while moving forward
+        to each queued payment date. Stop when one or more loans have been
+        paid off, or if this device has already paid more than the given best
+        device. Return a list of those paid loans and the day after they were
+        paid off.
+        '''
+        paidLoans = list()
+
+        while not paidLoans and (currentDate.year < PaymentDevice.MAX_YEAR):
+            if self._should_prune_plan():
+                self.paymentPlan.append((PLAN_PRUNED, self.paymentStats.amountPaid))
+                break
+
+            if not self.paymentQueue:
+                currentDate = datetime.datetime(PaymentDevice.MAX_YEAR, 1, 1)
+                break
+
+            currentDate = self.paymentQueue[0][0]
+
+            if currentDate.year < PaymentDevice.MAX_YEAR:
+                paidLoans = self._make_payments_on_date(currentDate)
+                currentDate += PaymentDevice.ONE_DAY_DELTA
+
+        return [paidLoans, currentDate]
+
+    def _make_payments_on_date(self, paymentDate):
+        '''
+        Make a single payment to all loans queued for the given date, and queue
+        the next payment date of each loan which is not yet paid off. Return a
+        list of any loans that have been paid off.
+        '''
+        daysSinceLastPayment = get_days_since_last_payment(paymentDate)
+        nextDate = paymentDate + PaymentDevice.ONE_DAY_DELTA
+
+        if self.profile:
+            self.profile.daysStepped += 1
+
+        paidLoans = list()
+
+        while self.paymentQueue and (self.paymentQueue[0][0] == paymentDate):
+            [_, index, loan] = heapq.heappop(self.paymentQueue)
+
+            if self._make_loan_payment(loan, daysSinceLastPayment, paymentDate):
+                self.loans.remove(loan)
+                paidLoans.append(loan)
+            else:
+                nextPaymentDate = get_next_payment_date(nextDate, loan.paymentDay)
+                heapq.heappush(self.paymentQueue, (nextPaymentDate, index, loan))
+
+        return paidLoans
+
+class AmortizationSchedule(object):
+    '''
+    Class to project the payments of a single loan while its monthly payment
+    stays fixed. A year of payments maps the balance at the start of the year
+    to the balance at the end of the year by a single growth factor and amount
+    owed, so the projection moves a year at a time and records the balance at
+    the start of each year. Months are counted since the start of year zero.
+    '''
+    def __init__(self, loan, index, month):
+        self.loan = loan
+        self.index = index
+
+        self.month = month
+        self.payments = 0
+
+        self.monthlyPayment = None
+        self.payoffMonth = None
+
+        self.startMonth = month
+        self.yearlyBalances = list()
+        self.yearlyPayments = list()
+        self.yearlyMaps = dict()
+
+    def get_payment_days(self, month):
+        '''
+        Return the number of days since the last payment for a payment made in
+        the given month, or 0 if the loan's payment day does not occur in that
+        month.
+        '''
+        paymentDay = self.loan.paymentDay
+
+        if paymentDay > get_days_in_month(month):
+            return 0
+
+        return max(get_days_in_month(month - 1), paymentDay)
+
+    def get_yearly_map(self, month):
+        '''
+        Return the growth factor, amount owed and number of payments which map
+        the balance at the start of the twelve months from the given month to
+        the balance at the end of those months. The map only depends on the
+        month of the year and which of the years involved are leap years.
+        '''
+        year = month // 12
+        key = (month % 12, calendar.isleap(year), calendar.isleap(year + 1))
+
+        if key not in self.yearlyMaps:
+            [growth, owed, payments] = [1.0, 0.0, 0]
+
+            for paymentMonth in xrange(month, month + 12):
+                days = self.get_payment_days(paymentMonth)
+
+                if days:
+                    rate = 1.0 + (self.loan.interestRate * (days / 365.0))
+                    growth *= rate
+                    owed = (owed * rate) + self.monthlyPayment
+                    payments += 1
+
+            self.yearlyMaps[key] = (growth, owed, payments)
+
+        return self.yearlyMaps[key]
+
+    def project(self):
+        '''
+        Project the loan's payments at its current monthly payment, starting
+        from its current balance, until it is paid off or the end of time.
+        Once the balance would drop to zero within a year, that year is paid a
+        month at a time to find the month in which the loan is paid off.
+        '''
+        maxMonth = PaymentDevice.MAX_YEAR * 12
+
+        self.monthlyPayment = self.loan.monthlyPayment
+        self.payoffMonth = None
+
+        self.startMonth = self.month
+        self.payments = 0
+        self.yearlyBalances = list()
+        self.yearlyPayments = list()
+        self.yearlyMaps = dict()
+
+        balance = self.loan.balance
+        payments = 0
+        month = self.month
+
+        while (month < maxMonth) and (self.payoffMonth is None):
+            self.yearlyBalances.append(balance)
+            self.yearlyPayments.append(payments)
+
+            [growth, owed, count] = self.get_yearly_map(month)
+
+            if ((balance * growth) - owed) > 0:
+                balance = (balance * growth) - owed
+                payments += count
+                month += 12
+                continue
+
+            for paymentMonth in xrange(month, month + 12):
+                days = self.get_payment_days(paymentMonth)
+
+                if days:
+                    balance += (balance * self.loan.interestRate) * (days / 365.0)
+
+                    if balance <= self.monthlyPayment:
+                        self.payoffMonth = paymentMonth
+                        break
+
+                    balance -= self.monthlyPayment
+                    payments += 1
+
+            month += 12
+
+        self.yearlyBalances.append(balance)
+        self.yearlyPayments.append(payments)
+
+    def get_balance(self, month):
+        '''
+        Return the projected balance at the start of the given month, and the
+        number of payments made since the start of the projection.
+        '''
+        year = (month - self.startMonth) // 12
+
+        balance = self.yearlyBalances[year]
+        payments = self.yearlyPayments[year]
+
+        for paymentMonth in xrange(self.startMonth + (year * 12), month):
+            days = self.get_payment_days(paymentMonth)
+
+            if days:
+                balance += (balance * self.loan.interestRate) * (days / 365.0)
+                balance -= self.monthlyPayment
+                payments += 1
+
+        return [balance, payments]
+
+    def advance(self, month):
+        '''
+        Make all payments due before the given month, none of which may pay off
+        the loan. Return the amount paid and the number of payments made.
+        '''
+        [balance, payments] = self.get_balance(month)
+        paymentsMade = payments - self.payments
+
+        self.loan.balance = balance
+        self.month = month
+        self.payments = payments
+
+        return [paymentsMade * self.monthlyPayment, paymentsMade]
+
+class AmortizationPaymentDevice(PaymentDevice):
+    '''
+    Payment device which projects each loan's fixed-payment amortization a year
+    at a time to find the next date on which any loan is paid off, and moves
+    straight to that date. Only the payments on payoff dates are made one at a
+    time. Totals agree with stepping day by day to within rounding error.
+    '''
+    # Schedules projected from a checkpoint's balances round differently than
+    # schedules projected from the start
+    RESUMES_EXACTLY = False
+
+    def __init__(self, dateOfBirth, loans, allocationDecider, bestDevice=None, pruneBound=None, profile=None,
+            scheduleSink=None, checkpoints=None, boundPruning=False):
+        super(AmortizationPaymentDevice, self).__init__(dateOfBirth, loans, allocationDecider, bestDevice, pruneBound, profile,
+            scheduleSink, checkpoints, boundPruning)
+        self.schedules = list()
+
+    def _schedule_payments(self, startDate):
+        '''
+        Create an amortization schedule for each loan, starting at the month of
+        its first payment.
+        '''
+        self.schedules = list()
+
+        for [index, loan] in enumerate(self.loans):
+            paymentDate = get_next_payment_date(startDate, loan.paymentDay)
+
+            if paymentDate:
+                month = (paymentDate.year * 12) + paymentDate.month - 1
+                self.schedules.append(AmortizationSchedule(loan, index, month))
+
+    def _make_payments_until_loan_paid(self, currentDate):
+        '''
+        Project each loan whose monthly payment changed, and make all payments
+        up to the earliest projected payoff date. Stop when one or more loans
+        have been paid off, or if this device has already paid more than the
+        given best device. Return a list of those paid loans and the day after
+        they were paid off.
+        '''
+        paidLoans = list()
+
+        while not paidLoans and (currentDate.year < PaymentDevice.MAX_YEAR):
+            if self._should_prune_plan():
+                self.paymentPlan.append((PLAN_PRUNED, self.paymentStats.amountPaid))
+                break
+
+            for schedule in self.schedules:
+                if schedule.monthlyPayment != schedule.loan.monthlyPayment:
+                    schedule.project()
+
+            payoffs = [(x.payoffMonth, x.loan.paymentDay) for x in self.schedules if x.payoffMonth is not None]
+
+            if payoffs:
+                [payoffMonth, payoffDay] = min(payoffs)
+                [year, month] = divmod(payoffMonth, 12)
+
+                currentDate = currentDate.replace(year=year, month=month + 1, day=payoffDay)
+            else:
+                [payoffMonth, payoffDay] = [PaymentDevice.MAX_YEAR * 12, 1]
+                currentDate = datetime.datetime(PaymentDevice.MAX_YEAR, 1, 1)
+
+            for schedule in self.schedules:
+                month = payoffMonth + (1 if schedule.loan.paymentDay < payoffDay else 0)
+                if self.scheduleSink:
+                    self._write_projected_payments(schedule, month)
+
+                [amountPaid, paymentsMade] = schedule.advance(month)
+                self.paymentStats.amountPaid += amountPaid
+
+                if self.profile:
+                    self.profile.paymentsMade += paymentsMade
+
+            if self._should_prune_plan():
+                self.paymentPlan.append((PLAN_PRUNED, self.paymentStats.amountPaid))
+                break
+
+            if currentDate.year < PaymentDevice.MAX_YEAR:
+                paidLoans = self._make_payments_on_date(currentDate)
+                currentDate += PaymentDevice.ONE_DAY_DELTA
+
+        return [paidLoans, currentDate]
+
+    def _write_projected_payments(self, schedule, month):
+        '''
+        Write a record of each payment made by advancing the given schedule to
+        the given month, stepping a month at a time from the loan's current
+        balance. The records of each loan are written in turn, rather than in
+        date order.
+        '''
+        loan = schedule.loan
+        balance = loan.balance
+
+        for paymentMonth in xrange(schedule.month, month):
+            days = schedule.get_payment_days(paymentMonth)
+
+            if days:
+                interest = (balance * loan.interestRate) * (days / 365.0)
+                balance += interest
+                balance -= schedule.monthlyPayment
+
+                [year, monthOfYear] = divmod(paymentMonth, 12)
+                paymentDate = datetime.date(year, monthOfYear + 1, loan.paymentDay)
+
+                self.scheduleSink.write(paymentDate, loan, interest, schedule.monthlyPayment - interest, balance)
+
+    def _make_payments_on_date(self, paymentDate):
+        '''
+        Make a single payment to all loans which have a payment due on the
+        given date. Return a list of any loans that have been paid off.
+        '''
+        month = (paymentDate.year * 12) + paymentDate.month - 1
+        paidLoans = list()
+
+        if self.profile:
+            self.profile.daysStepped += 1
+
+        for schedule in list(self.schedules):
+            loan = schedule.loan
+
+            if (schedule.month != month) or (loan.paymentDay != paymentDate.day):
+                continue
+
+            if self._make_loan_payment(loan, schedule.get_payment_days(month), paymentDate):
+                self.loans.remove(loan)
+                self.schedules.remove(schedule)
+                paidLoans.append(loan)
+            else:
+                schedule.month += 1
+                schedule.payments += 1
+
+        return paidLoans
+
+# Available payment simulation engines, by name
+ENGINES = {
+    'daily' : PaymentDevice,
+    'event' : EventPaymentDevice,
+    'amortization' : AmortizationPaymentDevice,
+}
 
-        self.paymentStats.finishDate = currentDate
-        self.paymentStats.finishDateStr = currentDate.strftime(loan_config.LoanConfig.DATE_FORMAT)
-        self.paymentStats.monthsPaid = to_months(timeDiff)
-        self.paymentStats.yearsPaid = self.paymentStats.monthsPaid / 12.0
-        self.paymentStats.finishAge = get_age_on_date(self.paymentStats.dateOfBirth, currentDate)
+DEFAULT_ENGINE = 'daily'
@@ -0,0 +1,132 @@
+'''
+profiling
+'''
+import timeit
+
+import heuristics
+
+class Profile(object):
+    '''
+    Class to count the work done while simulating the payment of loans, and to
+    time each phase of that work.
+    '''
+    # Each counter and its label, in the order they are reported
+    COUNTERS = [
+        ['simulations', 'Simulations'],
+        ['cacheHits', 'Cached results'],
+        ['checkpointHits', 'Resumed checkpoints'],
+        ['daysStepped', 'Days stepped'],
+        ['paymentsMade', 'Payments made'],
+        ['heuristicCalls', 'Heuristic invocations'],
+        ['priorityKeyCalls', 'Priority key evaluations'],
+        ['dollarsReallocated', 'Dollars reallocated'],
+        ['prunes', 'Plans pruned'],
+        ['boundPrunes', 'Plans pruned by lower bounds'],
+        ['daysSaved', 'Days skipped by lower bounds (at least)'],
+    ]
+
+    def __init__(self):
+        for [counter, _] in Profile.COUNTERS:
+            setattr(self, counter, 0)
+
+        self.phases = list()
+        self.phaseTimes = dict()
+
+    def __str__(self):
+        ret = ''
+
+        for [counter, label] in Profile.COUNTERS:
+            ret += '\t%s: %d\n' % (label, getattr(self, counter))
+
+        ret += '\n'
+
+        for phase in self.phases:
+            ret += '\tTime in %s: %.3fs\n' % (phase, self.phaseTimes[phase])
+
+        return ret
+
+    def time(self, phase):
+        '''
+        Return a context manager which adds the time spent within it to the
+        given phase.
+        '''
+        return PhaseTimer(self, phase)
+
+    def add_time(self, phase, seconds):
+        '''
+        Add the given number of seconds to the given phase.
+        '''
+        if phase not in self.phaseTimes:
+            self.phases.append(phase)
+            self.phaseTimes[phase] = 0.0
+
+        self.phaseTimes[phase] += seconds
+
+    def merge(self, other):
+        '''
+        Add the counters and phase times of another profile to this profile,
+        for example one returned by a worker process.
+        '''
+        for [counter, _] in Profile.COUNTERS:
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+
+        for phase in other.phases:
+            self.add_time(phase, other.phaseTimes[phase])
+
+    def count_calls(self, heuristic):
+        '''
+        Return a wrapper of the given heuristic, and of its priority key if it
+        has one, which counts each invocation. The wrapper is deterministic if
+        the given heuristic is.
+        '''
+        def counted(loans, daysSinceLastPayment):
+            self.heuristicCalls += 1
+            return heuristic(loans, daysSinceLastPayment)
+
+        counted.__name__ = heuristic.__name__
+        counted.isDeterministic = heuristics.is_deterministic(heuristic)
+        priorityKey = getattr(heuristic, 'priorityKey', None)
+
+        if priorityKey:
+            def counted_key(loan, daysSinceLastPayment):
+                self.priorityKeyCalls += 1
+                return priorityKey(loan, daysSinceLastPayment)
+
+            counted.priorityKey = counted_key
+
+        return counted
+
+class PhaseTimer(object):
+    '''
+    Context manager to time a single phase of a profile.
+    '''
+    def __init__(self, profile, phase):
+        self.profile = profile
+        self.phase = phase
+        self.start = None
+
+    def __enter__(self):
+        self.profile.add_time(self.phase, 0.0)
+        self.start = timeit.default_timer()
+
+    def __exit__(self, *exc):
+        self.profile.add_time(self.phase, timeit.default_timer() - self.start)
+
+class NullTimer(object):
+    '''
+    Context manager which does nothing, used when profiling is disabled.
+    '''
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+NULL_TIMER = NullTimer()
+
+def time_phase(profile, phase):
+    '''
+    Return a context manager to time the given phase of the given profile, or
+    one which does nothing if there is no profile.
+    '''
+    return profile.time(phase) if profile else NULL_TIMER
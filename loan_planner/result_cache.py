@@ -0,0 +1,242 @@
+'''
+result_cache
+'''
+import collections
+import copy
+import cPickle
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import heuristics
+
+# Default bounds on the number of results kept in memory, and on the size of
+# the results kept on disk
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Subdirectory of a cache directory which is owned by the cache, and under
+# which the on-disk tier of each code version is kept
+CACHE_SUBDIR = 'loan_planner_cache'
+
+# Names of the on-disk tiers, which are code version hashes
+VERSION_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+
+def get_code_version():
+    '''
+    Return a hash of the source of the loan planner, which changes whenever
+    any module which may affect a simulation result changes.
+    '''
+    sha = hashlib.sha1()
+
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(path, 'rb') as sourceFile:
+            sha.update(sourceFile.read())
+
+    return sha.hexdigest()
+
+CODE_VERSION = get_code_version()
+
+class CachedResult(object):
+    '''
+    Class to store the result of a successful simulation.
+    '''
+    def __init__(self, paymentDevice):
+        self.paymentPlan = list(paymentDevice.paymentPlan)
+        self.paymentStats = paymentDevice.paymentStats
+
+    def apply(self, paymentDevice):
+        '''
+        Store this result in the given payment device, in place of simulating
+        its loans.
+        '''
+        paymentDevice.paymentPlan = list(self.paymentPlan)
+        paymentDevice.paymentStats = copy.copy(self.paymentStats)
+
+class ResultCache(object):
+    '''
+    Class to cache the results of payment simulations, keyed by a canonical
+    hash of the simulated loans, heuristic, engine and start date. Results are
+    kept in a bounded in-memory LRU tier, and optionally in an on-disk tier
+    bounded by size. On-disk results are kept per code version, under a
+    subdirectory of the cache directory owned by the cache, and results of
+    other code versions are removed when the cache is opened. Nothing else in
+    the cache directory is touched.
+    '''
+    def __init__(self, cacheDir=None, maxEntries=DEFAULT_MAX_ENTRIES, maxBytes=DEFAULT_MAX_BYTES):
+        self.memory = collections.OrderedDict()
+        self.maxEntries = maxEntries
+
+        self.cacheDir = None
+        self.maxBytes = maxBytes
+        self.diskBytes = 0
+
+        if cacheDir:
+            self._open_cache_dir(cacheDir)
+
+    def get_key(self, paymentDevice, heuristic, startDate):
+        '''
+        Return the key of the result of simulating the given payment device's
+        loans using the given heuristic from the given date, or None if the
+        result may not be cached.
+        '''
+        if not heuristics.is_deterministic(heuristic):
+            return None
+
+        loans = [[x.name, x.balance, x.interestRate, x.monthlyPayment, x.paymentDay] for x in paymentDevice.originalLoans]
+        dateOfBirth = paymentDevice.paymentStats.dateOfBirth
+
+        state = [
+            type(paymentDevice).__name__,
+            heuristic.__name__,
+            str(dateOfBirth),
+            startDate.strftime('%Y-%m-%d'),
+            loans
+        ]
+
+        return hashlib.sha1(json.dumps(state)).hexdigest()
+
+    def get(self, key):
+        '''
+        Return the cached result with the given key, or None if there is no
+        such result.
+        '''
+        if key in self.memory:
+            result = self.memory.pop(key)
+            self.memory[key] = result
+
+            return result
+
+        result = self._read_result(key)
+
+        if result:
+            self._remember(key, result)
+
+        return result
+
+    def put(self, key, paymentDevice):
+        '''
+        Cache the result of the given successful payment device.
+        '''
+        result = CachedResult(paymentDevice)
+
+        self._remember(key, result)
+        self._write_result(key, result)
+
+    def _remember(self, key, result):
+        '''
+        Store a result in the in-memory tier, evicting the least recently used
+        results once it is full.
+        '''
+        self.memory.pop(key, None)
+        self.memory[key] = result
+
+        while len(self.memory) > self.maxEntries:
+            self.memory.popitem(last=False)
+
+    def _open_cache_dir(self, cacheDir):
+        '''
+        Create the on-disk tier for the current code version, removing the
+        tiers of any other code version.
+        '''
+        cacheDir = os.path.join(cacheDir, CACHE_SUBDIR)
+
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+        for path in os.listdir(cacheDir):
+            versionDir = os.path.join(cacheDir, path)
+
+            if (path != CODE_VERSION) and VERSION_PATTERN.match(path) and os.path.isdir(versionDir):
+                shutil.rmtree(versionDir, ignore_errors=True)
+
+        self.cacheDir = os.path.join(cacheDir, CODE_VERSION)
+
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+        self.diskBytes = sum(os.path.getsize(x) for x in self._get_result_paths())
+
+    def _get_result_path(self, key):
+        '''
+        Return the path to the on-disk result with the given key.
+        '''
+        return os.path.join(self.cacheDir, key + '.pkl')
+
+    def _get_result_paths(self):
+        '''
+        Return the paths to all on-disk results.
+        '''
+        return glob.glob(os.path.join(self.cacheDir, '*.pkl'))
+
+    def _read_result(self, key):
+        '''
+        Read the on-disk result with the given key, marking it as recently
+        used. Return None if there is no such result.
+        '''
+        if not self.cacheDir:
+            return None
+
+        path = self._get_result_path(key)
+
+        try:
+            with open(path, 'rb') as resultFile:
+                result = cPickle.load(resultFile)
+
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+            return None
+
+        return result
+
+    def _write_result(self, key, result):
+        '''
+        Write a result to the on-disk tier, evicting the least recently used
+        results once it is too large. Results are written to a temporary file
+        and renamed, so that other processes never read a partial result.
+        '''
+        if not self.cacheDir:
+            return
+
+        [handle, tempPath] = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+
+        with os.fdopen(handle, 'wb') as resultFile:
+            cPickle.dump(result, resultFile, cPickle.HIGHEST_PROTOCOL)
+
+        self.diskBytes += os.path.getsize(tempPath)
+        os.rename(tempPath, self._get_result_path(key))
+
+        if self.diskBytes > self.maxBytes:
+            self._evict_results()
+
+    def _evict_results(self):
+        '''
+        Remove the least recently used on-disk results until the tier fits
+        within its size bound. Other processes may share the tier, so its size
+        is found again before evicting.
+        '''
+        results = list()
+
+        for path in self._get_result_paths():
+            try:
+                results.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                pass
+
+        results.sort()
+        self.diskBytes = sum(x[1] for x in results)
+
+        for [_, size, path] in results:
+            if self.diskBytes <= self.maxBytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            self.diskBytes -= size
@@ -0,0 +1,158 @@
+'''
+scenario_device
+'''
+import datetime
+
+import numpy
+
+import allocation
+import loan_config
+import payment_device
+
+class ScenarioPaymentDevice(object):
+    '''
+    Class to simulate paying many scenarios of the same loans side by side,
+    using a single heuristic. Each scenario is a row of arrays with a column
+    per loan, and the payments due on each day are made as a single vectorized
+    step across all scenarios. Only loans which have been paid off are handled
+    a scenario at a time, to reallocate their payments. Payment statistics are
+    the same as stepping day by day through each scenario.
+
+    Scenarios may also be given their own interest rate paths, as an array with
+    a row per scenario, a column per loan, and the yearly interest rate of each
+    month since the start of the simulation. Months past the end of the paths
+    keep their last rate.
+    '''
+    def __init__(self, dateOfBirth, loanSets, allocationDecider, bestAmountsPaid=None, ratePaths=None):
+        self.dateOfBirth = dateOfBirth
+        self.loanSets = loanSets
+        self.allocationDecider = allocationDecider
+
+        # Scenarios which have paid more than these amounts are pruned
+        self.bestAmountsPaid = bestAmountsPaid
+        self.ratePaths = ratePaths
+
+        self.interestRate = numpy.array([x.interestRate for x in loanSets[0]], dtype=float)
+        self.paymentDay = numpy.array([x.paymentDay for x in loanSets[0]], dtype=int)
+
+        self.balance = numpy.array([[x.balance for x in loans] for loans in loanSets], dtype=float)
+        self.monthlyPayment = numpy.array([[x.monthlyPayment for x in loans] for loans in loanSets], dtype=float)
+        self.unpaid = (self.balance > 0)
+
+        self.amountPaid = numpy.zeros(len(loanSets), dtype=float)
+        self.active = self.unpaid.any(axis=1)
+
+        self.startDate = None
+        self.startMonth = None
+        self.paymentStats = [None] * len(loanSets)
+
+    def pay_loans(self):
+        '''
+        Make monthly loan payments in every scenario until all loans are paid
+        off, reallocating the payments of paid loans. Return the payment
+        statistics of each scenario, which are None for scenarios which were
+        pruned, had no loans to pay, or reached the end of time.
+        '''
+        self.startDate = datetime.datetime.now()
+
+        month = self.startMonth = (self.startDate.year * 12) + self.startDate.month - 1
+        firstDay = self.startDate.day
+        maxMonth = payment_device.PaymentDevice.MAX_YEAR * 12
+
+        paymentDays = sorted(set(self.paymentDay.tolist()))
+
+        while self.active.any() and (month < maxMonth):
+            daysInMonth = payment_device.get_days_in_month(month)
+            daysInLastMonth = payment_device.get_days_in_month(month - 1)
+
+            for day in paymentDays:
+                if (firstDay <= day <= daysInMonth) and self.active.any():
+                    self._make_payments_on_day(month, day, max(daysInLastMonth, day))
+
+            firstDay = 1
+            month += 1
+
+        return self.paymentStats
+
+    def _make_payments_on_day(self, month, day, daysSinceLastPayment):
+        '''
+        Make a single payment to each loan due on the given day of the given
+        month, in every active scenario. Loans are paid in the order of the
+        loan list, and any loans paid off are handled once all payments on the
+        day have been made.
+        '''
+        if self.bestAmountsPaid is not None:
+            self.active &= (self.amountPaid <= self.bestAmountsPaid)
+
+        columns = numpy.flatnonzero(self.paymentDay == day)
+        paid = numpy.zeros((len(self.loanSets), len(columns)), dtype=bool)
+
+        for [position, column] in enumerate(columns):
+            rows = numpy.flatnonzero(self.active & self.unpaid[:, column])
+
+            balance = self.balance[rows, column]
+            balance += (balance * self._get_interest_rates(rows, column, month)) * (daysSinceLastPayment / 365.0)
+
+            monthlyPayment = self.monthlyPayment[rows, column]
+            payment = numpy.where(monthlyPayment < balance, monthlyPayment, balance)
+
+            self.amountPaid[rows] += payment
+            balance -= payment
+
+            self.balance[rows, column] = balance
+            paid[rows, position] = (balance <= 0.0)
+
+        for row in numpy.flatnonzero(paid.any(axis=1)):
+            self._handle_paid_loans(row, columns[paid[row]], month, day)
+
+    def _get_interest_rates(self, rows, column, month):
+        '''
+        Return the interest rate of the given loan in the given month, for each
+        of the given scenarios.
+        '''
+        if self.ratePaths is None:
+            return self.interestRate[column]
+
+        period = min(month - self.startMonth, self.ratePaths.shape[2] - 1)
+        return self.ratePaths[rows, column, period]
+
+    def _handle_paid_loans(self, row, paidColumns, month, day):
+        '''
+        Handle the given paid loans of a single scenario, which were paid off on
+        the given day. Reallocate each paid loan's monthly payment, or collect
+        the scenario's payment statistics if all of its loans are paid off.
+        '''
+        self.unpaid[row, paidColumns] = False
+        unpaidColumns = numpy.flatnonzero(self.unpaid[row])
+
+        if not len(unpaidColumns):
+            [year, monthOfYear] = divmod(month, 12)
+            finishDate = self.startDate.replace(year=year, month=monthOfYear + 1, day=day)
+
+            paymentStats = payment_device.PaymentStats(self.dateOfBirth)
+            paymentStats.startDate = self.startDate
+            paymentStats.amountPaid = float(self.amountPaid[row])
+            paymentStats.finish(finishDate + payment_device.PaymentDevice.ONE_DAY_DELTA)
+
+            self.paymentStats[row] = paymentStats
+            self.active[row] = False
+
+            return
+
+        loans = list()
+
+        for column in unpaidColumns:
+            loan = self.loanSets[row][column].clone()
+            loan.balance = float(self.balance[row, column])
+            loan.monthlyPayment = float(self.monthlyPayment[row, column])
+            loan.interestRate = float(self._get_interest_rates(row, column, month))
+
+            loans.append(loan)
+
+        isEligible = lambda x: (x.balance > x.monthlyPayment)
+
+        for column in paidColumns:
+            allocation.allocate_dollars(self.allocationDecider, loans, int(self.monthlyPayment[row, column]),
+                loan_config.LoanConfig.DAYS_PER_MONTH, isEligible, payment_device.increase_payment)
+
+        self.monthlyPayment[row, unpaidColumns] = [x.monthlyPayment for x in loans]
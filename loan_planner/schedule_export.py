@@ -0,0 +1,241 @@
+'''
+schedule_export
+'''
+import array
+import csv
+import datetime
+import os
+import struct
+import sys
+
+import loan_config
+
+# Columnar schedule files start with this tag, followed by the table of loan
+# names, and then by blocks of payment records. Each block holds a row count
+# followed by each column in turn, and a block with no rows ends the file. All
+# values are little-endian.
+COLUMNAR_TAG = 'LPSCHED1'
+
+# Type code of each column of a block: the payment date as a proleptic
+# Gregorian ordinal, the index of the loan in the table, and the interest,
+# principal and remaining balance of the payment
+COLUMNS = [
+    ['date', 'i'],
+    ['loan', 'i'],
+    ['interest', 'd'],
+    ['principal', 'd'],
+    ['balance', 'd'],
+]
+
+# Number of payment records held in memory before a block is written
+BLOCK_ROWS = 4096
+
+CSV = 'csv'
+COLUMNAR = 'columnar'
+
+FORMATS = [CSV, COLUMNAR]
+
+def _write_array(values, outputFile):
+    '''
+    Write an array to a file in little-endian byte order.
+    '''
+    if sys.byteorder != 'little':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+
+    values.tofile(outputFile)
+
+def _read_array(typecode, count, inputFile):
+    '''
+    Read an array of the given type and length from a file in little-endian
+    byte order.
+    '''
+    values = array.array(typecode)
+    values.fromfile(inputFile, count)
+
+    if sys.byteorder != 'little':
+        values.byteswap()
+
+    return values
+
+def read_columnar(inputFile):
+    '''
+    Generate each payment record, as a date, loan name, interest, principal
+    and remaining balance, from a columnar schedule file. Only a single block
+    is held in memory at a time.
+    '''
+    if inputFile.read(len(COLUMNAR_TAG)) != COLUMNAR_TAG:
+        raise ValueError('Not a columnar schedule file')
+
+    [loanCount] = struct.unpack('<I', inputFile.read(4))
+    loanNames = list()
+
+    for _ in xrange(loanCount):
+        [length] = struct.unpack('<H', inputFile.read(2))
+        loanNames.append(inputFile.read(length).decode('utf-8'))
+
+    while True:
+        [rows] = struct.unpack('<I', inputFile.read(4))
+
+        if rows == 0:
+            return
+
+        columns = [_read_array(typecode, rows, inputFile) for [_, typecode] in COLUMNS]
+
+        for [date, loan, interest, principal, balance] in zip(*columns):
+            yield [datetime.date.fromordinal(date), loanNames[loan], interest, principal, balance]
+
+def write_csv(records, outputFile):
+    '''
+    Write payment records, as generated by read_columnar, to a CSV file.
+    '''
+    writer = csv.writer(outputFile)
+    writer.writerow([x[0] for x in COLUMNS])
+
+    for [date, loan, interest, principal, balance] in records:
+        writer.writerow([date.strftime(loan_config.LoanConfig.DATE_FORMAT), loan.encode('utf-8'),
+            '%.2f' % (interest), '%.2f' % (principal), '%.2f' % (balance)])
+
+class ScheduleSink(object):
+    '''
+    Class to stream the payment records of a single payment device to a
+    temporary columnar schedule file, so that a schedule never needs to be
+    held in memory. Once the best plan is known, its schedule may be exported
+    and the schedules of all other plans discarded.
+    '''
+    def __init__(self):
+        self.path = None
+        self.scheduleFile = None
+
+        self.loanIndices = dict()
+        self.columns = None
+
+    def __getstate__(self):
+        '''
+        Return the state of the sink to be pickled. Only a closed sink may be
+        passed between processes.
+        '''
+        if self.scheduleFile:
+            raise ValueError('Cannot pickle an open schedule sink')
+
+        return {'path' : self.path}
+
+    def __setstate__(self, state):
+        '''
+        Restore the state of the sink from an unpickled state.
+        '''
+        self.__init__()
+        self.path = state['path']
+
+    def open(self, loans):
+        '''
+        Create the temporary schedule file, with a table of the given loans.
+        '''
+        # Only imported when exporting, as it is slow to import
+        import tempfile
+
+        [handle, self.path] = tempfile.mkstemp(prefix='schedule', suffix='.bin')
+        self.scheduleFile = os.fdopen(handle, 'wb')
+
+        self.scheduleFile.write(COLUMNAR_TAG)
+        self.scheduleFile.write(struct.pack('<I', len(loans)))
+
+        for [index, loan] in enumerate(loans):
+            name = loan.name.encode('utf-8')
+
+            self.scheduleFile.write(struct.pack('<H', len(name)))
+            self.scheduleFile.write(name)
+
+            self.loanIndices[loan.name] = index
+
+        self.columns = [array.array(typecode) for [_, typecode] in COLUMNS]
+
+    def is_open(self):
+        '''
+        Return true if payment records may be written to the sink.
+        '''
+        return (self.scheduleFile is not None)
+
+    def get_loan_index(self, loan):
+        '''
+        Return the index of the given loan in the table of loans.
+        '''
+        return self.loanIndices[loan.name]
+
+    def write(self, date, loan, interest, principal, balance):
+        '''
+        Write a single payment record.
+        '''
+        values = [date.toordinal(), self.loanIndices[loan.name], interest, principal, balance]
+
+        for [column, value] in zip(self.columns, values):
+            column.append(value)
+
+        if len(self.columns[0]) >= BLOCK_ROWS:
+            self._write_block()
+
+    def write_many(self, dates, loanIndices, interest, principal, balance):
+        '''
+        Write many payment records, given as a sequence of each column. Dates
+        are given as ordinals, and loans by their index in the table of loans.
+        '''
+        for [column, values] in zip(self.columns, [dates, loanIndices, interest, principal, balance]):
+            column.extend(values)
+
+        if len(self.columns[0]) >= BLOCK_ROWS:
+            self._write_block()
+
+    def close(self):
+        '''
+        Write any remaining payment records and end the schedule file.
+        '''
+        if not self.scheduleFile:
+            return
+
+        self._write_block()
+        self.scheduleFile.write(struct.pack('<I', 0))
+
+        self.scheduleFile.close()
+        self.scheduleFile = None
+        self.columns = None
+
+    def discard(self):
+        '''
+        Close and remove the temporary schedule file.
+        '''
+        self.close()
+
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+        self.path = None
+
+    def export(self, outputFile, fileFormat):
+        '''
+        Write the schedule to the given file in the given format.
+        '''
+        self.close()
+
+        with open(self.path, 'rb') as scheduleFile:
+            if fileFormat == COLUMNAR:
+                import shutil
+
+                shutil.copyfileobj(scheduleFile, outputFile)
+            else:
+                write_csv(read_columnar(scheduleFile), outputFile)
+
+    def _write_block(self):
+        '''
+        Write the payment records held in memory as a single block.
+        '''
+        rows = len(self.columns[0])
+
+        if rows == 0:
+            return
+
+        self.scheduleFile.write(struct.pack('<I', rows))
+
+        for column in self.columns:
+            _write_array(column, self.scheduleFile)
+
+        self.columns = [array.array(typecode) for [_, typecode] in COLUMNS]
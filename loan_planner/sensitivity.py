@@ -0,0 +1,146 @@
+'''
+sensitivity
+'''
+import allocation
+import checkpoint
+import heuristics
+import optimizer
+
+# Default number of extra dollars whose value is found
+DEFAULT_DOLLARS = 100
+
+# Kinds of extra payment
+UPFRONT = 'upfront'
+MONTHLY = 'monthly'
+
+class Sensitivity(object):
+    '''
+    Class to store the value of giving extra dollars to a single loan, as an
+    upfront or monthly payment, compared to the best plan. Statistics are None
+    if the changed plan could not be completed.
+    '''
+    def __init__(self, kind, loanName, dollars, baseStats, paymentStats):
+        self.kind = kind
+        self.loanName = loanName
+        self.dollars = dollars
+
+        self.amountSaved = None
+        self.daysSaved = None
+
+        if paymentStats:
+            # Upfront dollars are paid on top of the plan's payments
+            cost = dollars if (kind == UPFRONT) else 0
+
+            self.amountSaved = baseStats.amountPaid - paymentStats.amountPaid - cost
+            self.daysSaved = (baseStats.finishDate.date() - paymentStats.finishDate.date()).days
+
+    def __str__(self):
+        if self.amountSaved is None:
+            return '\t%s: could not determine a payment plan\n' % (self.loanName)
+
+        return '\t%s: saves $%.2f ($%.2f per dollar) and finishes %d days earlier\n' % (
+            self.loanName, self.amountSaved, self.amountSaved / self.dollars, self.daysSaved)
+
+def get_changed_loans(loans, kind, loanName, dollars):
+    '''
+    Return a copy of the given loans with the given number of dollars given to
+    the named loan, as an upfront or monthly payment. Dollars are allocated as
+    the loan planner allocates any change, and go to the loan with the highest
+    interest rate once the named loan is paid off. The given loans already
+    include the plan's changes, so only the monthly payments of loans newly
+    paid off by the dollars are given to other loans.
+    '''
+    loans = [x.clone() for x in loans]
+    heuristic = optimizer.get_target_heuristic(loanName)
+
+    if kind == UPFRONT:
+        freedLoans = [x for x in loans if x.balance <= 0]
+        allocation.allocate_upfront_payment(heuristic, loans, dollars, freedLoans)
+    else:
+        allocation.allocate_monthly_increase(heuristic, loans, dollars)
+
+    return loans
+
+def simulate(loanPlanner, heuristic, loanSets):
+    '''
+    Simulate the payment of each of the given sets of loans using the given
+    heuristic, and return the payment statistics of each set, which are None
+    for sets which could not be paid off. Sets are simulated side by side if
+    NumPy is available, and otherwise one at a time with the loan planner's
+    engine, resuming from any states shared between them.
+    '''
+    dateOfBirth = loanPlanner.loanConfig.dateOfBirth
+
+    try:
+        # Only imported when used, as NumPy is optional and slow to import
+        import scenario_device
+    except ImportError:
+        scenario_device = None
+
+    if scenario_device:
+        paymentDevice = scenario_device.ScenarioPaymentDevice(dateOfBirth, loanSets, heuristic)
+        return paymentDevice.pay_loans()
+
+    checkpoints = checkpoint.CheckpointStore()
+    paymentStats = list()
+
+    for loans in loanSets:
+        paymentDevice = loanPlanner.paymentDeviceClass(dateOfBirth, loans, heuristic, checkpoints=checkpoints)
+        paymentStats.append(paymentDevice.paymentStats if paymentDevice.pay_loans() else None)
+
+    return paymentStats
+
+def analyze(loanPlanner, dollars=DEFAULT_DOLLARS):
+    '''
+    Find the value of giving the given number of extra dollars to each unpaid
+    loan of the best plan found by the given loan planner, as an upfront and
+    as a monthly payment. Each changed plan follows the best plan's heuristic,
+    and all plans are simulated as a single batch, along with the best plan
+    itself so that every plan is compared on the same engine. A heuristic
+    which makes random choices would make different choices in each plan, so
+    plans then give freed dollars to the loan with the highest interest rate
+    instead. Return the sensitivities of each kind, ranked by the amount saved,
+    or None if there is no best plan.
+    '''
+    bestPlan = loanPlanner.bestChangedPlan or loanPlanner.bestInitialPlan
+
+    if not bestPlan:
+        return None
+
+    heuristic = bestPlan.allocationDecider
+    loans = bestPlan.originalLoans
+
+    if not heuristics.is_deterministic(heuristic):
+        heuristic = optimizer.get_target_heuristic(None)
+
+    changes = [[kind, x.name] for x in loans if x.balance > 0 for kind in [UPFRONT, MONTHLY]]
+    loanSets = [loans] + [get_changed_loans(loans, kind, name, dollars) for [kind, name] in changes]
+
+    paymentStats = simulate(loanPlanner, heuristic, loanSets)
+    baseStats = paymentStats[0]
+
+    if not baseStats:
+        return None
+
+    sensitivities = dict((x, list()) for x in [UPFRONT, MONTHLY])
+
+    for [[kind, name], stats] in zip(changes, paymentStats[1:]):
+        sensitivities[kind].append(Sensitivity(kind, name, dollars, baseStats, stats))
+
+    for ranking in sensitivities.itervalues():
+        ranking.sort(key=lambda x: (x.amountSaved is None, -(x.amountSaved or 0), -(x.daysSaved or 0), x.loanName))
+
+    return sensitivities
+
+def format_sensitivities(sensitivities, dollars=DEFAULT_DOLLARS):
+    '''
+    Format the ranked sensitivities of each kind.
+    '''
+    ret = 'Value of $%.2f more, best first:\n\n' % (dollars)
+
+    for [kind, label] in [[UPFRONT, 'As an upfront payment'], [MONTHLY, 'As a monthly payment']]:
+        ret += '%s:\n\n' % (label)
+        ret += ''.join(str(x) for x in sensitivities[kind])
+        ret += '\n'
+
+    return ret
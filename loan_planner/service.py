@@ -0,0 +1,372 @@
+'''
+Serve loan payment plans over a local HTTP/JSON interface, keeping worker
+processes and their caches warm between requests.
+
+Portfolios are posted to /plan as JSON, in the same schema accepted by the
+batch planner, and the best plan is returned as JSON. Plans are found by a
+pool of worker processes, each of which keeps its result cache and heuristic
+statistics between requests. Only a bounded number of requests may wait for a
+worker; any more are rejected with status 503 until the queue drains.
+Latency and throughput metrics are served from /metrics.
+
+Example
+-------
+python service.py -p 8080 -j 4
+curl -d '{"Loans": [{"Name": "Loan 1", "Balance": 10000, "InterestRate": 4.0,
+    "MonthlyPayment": 50, "PaymentDay": 18}]}' http://localhost:8080/plan
+'''
+import argparse
+import BaseHTTPServer
+import collections
+import json
+import multiprocessing
+import SocketServer
+import sys
+import threading
+import time
+
+import batch
+import loan_planner
+import payment_device
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+# Default seconds a request may wait for its plan before timing out
+DEFAULT_TIMEOUT = 600.0
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 1024 * 1024
+
+# Number of recent requests over which latency percentiles are reported
+LATENCY_WINDOW = 1000
+
+# Seconds over which recent throughput is reported
+THROUGHPUT_WINDOW = 60.0
+
+# Latency percentiles reported
+PERCENTILES = [50, 90, 99]
+
+class ServiceMetrics(object):
+    '''
+    Class to count the requests handled by the service, and to measure the
+    latency and throughput of planning them. Metrics are updated by every
+    request handler thread.
+    '''
+    def __init__(self, maxPending):
+        self.lock = threading.Lock()
+        self.startTime = time.time()
+
+        self.maxPending = maxPending
+        self.pending = 0
+
+        self.planned = 0
+        self.failed = 0
+        self.rejected = 0
+        self.invalid = 0
+        self.timedOut = 0
+
+        # Finish time and latency of the most recent plans
+        self.recent = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def try_acquire(self):
+        '''
+        Reserve a place in the request queue. Return false if the queue is full,
+        in which case the request is counted as rejected.
+        '''
+        with self.lock:
+            if self.pending >= self.maxPending:
+                self.rejected += 1
+                return False
+
+            self.pending += 1
+            return True
+
+    def release(self, latency, success):
+        '''
+        Release a place in the request queue, recording the latency of the plan
+        found for it and whether it was successful.
+        '''
+        with self.lock:
+            self.pending -= 1
+
+            if success:
+                self.planned += 1
+            else:
+                self.failed += 1
+
+            self.recent.append((time.time(), latency))
+
+    def count_invalid(self):
+        '''
+        Count a request which was rejected as invalid.
+        '''
+        with self.lock:
+            self.invalid += 1
+
+    def count_timeout(self):
+        '''
+        Count a request which timed out. Its place in the request queue is held
+        until its plan is found.
+        '''
+        with self.lock:
+            self.timedOut += 1
+
+    def to_dict(self):
+        '''
+        Return a snapshot of the metrics as a dict, to be serialized to JSON.
+        Latency percentiles are nearest ranks of the most recent plans, in
+        seconds.
+        '''
+        with self.lock:
+            now = time.time()
+            uptime = now - self.startTime
+
+            latencies = sorted(x[1] for x in self.recent)
+            recentPlans = sum(1 for x in self.recent if (now - x[0]) <= THROUGHPUT_WINDOW)
+
+            ret = {
+                'uptime' : uptime,
+                'pending' : self.pending,
+                'maxPending' : self.maxPending,
+                'planned' : self.planned,
+                'failed' : self.failed,
+                'rejected' : self.rejected,
+                'invalid' : self.invalid,
+                'timedOut' : self.timedOut,
+                'throughput' : (self.planned + self.failed) / uptime if uptime else 0.0,
+                'recentThroughput' : recentPlans / min(uptime, THROUGHPUT_WINDOW) if uptime else 0.0,
+                'latency' : dict()
+            }
+
+            for percentile in PERCENTILES:
+                if latencies:
+                    index = min(len(latencies) - 1, (len(latencies) * percentile) // 100)
+                    ret['latency']['p%d' % (percentile)] = latencies[index]
+
+            if latencies:
+                ret['latency']['mean'] = sum(latencies) / len(latencies)
+
+            return ret
+
+class PlannerService(object):
+    '''
+    Class to plan portfolios in a pool of worker processes which live as long
+    as the service. Each worker keeps its simulation results in memory, and in
+    the cache directory if one is given. Each request holds a place in a
+    bounded queue until its plan is found, so that no more requests are
+    accepted than the pool can work through.
+    '''
+    def __init__(self, engine=payment_device.DEFAULT_ENGINE, jobs=None, maxPending=None, cacheDir=None,
+            timeout=DEFAULT_TIMEOUT):
+        self.engine = engine
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.cacheDir = cacheDir
+        self.timeout = timeout
+
+        self.metrics = ServiceMetrics(maxPending or (self.jobs * batch.PENDING_PER_JOB))
+        self.pool = multiprocessing.Pool(self.jobs)
+
+    def plan(self, portfolio):
+        '''
+        Find the best payment plan for the given portfolio, given as a JSON
+        string. Return the status and result of the request, which is None if
+        the request was rejected.
+        '''
+        if not self.metrics.try_acquire():
+            return [503, None]
+
+        startTime = time.time()
+        options = dict(engine=self.engine, cacheDir=self.cacheDir, memoize=True)
+
+        # The request's place is released once its plan is found, even if the
+        # request has timed out, so that abandoned plans still count against
+        # the queue. The callback runs before the result is returned.
+        release = lambda result: self.metrics.release(time.time() - startTime, result['success'])
+
+        try:
+            # Waiting without a timeout can not be interrupted
+            result = self.pool.apply_async(batch.plan_portfolio, ('request', portfolio), options,
+                callback=release).get(self.timeout)
+        except multiprocessing.TimeoutError:
+            self.metrics.count_timeout()
+            return [504, {'success' : False, 'error' : 'Timed out after %.0f seconds' % (self.timeout)}]
+        except:
+            self.metrics.release(time.time() - startTime, False)
+            raise
+
+        return [200, result]
+
+    def close(self):
+        '''
+        Stop the worker processes, abandoning any plans still being found.
+        '''
+        self.pool.terminate()
+        self.pool.join()
+
+class ServiceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Class to handle a single request to the service.
+    '''
+    def do_GET(self):
+        '''
+        Serve the service's metrics from /metrics, and its health from /health.
+        Any other path is not found (404).
+        '''
+        if self.path == '/metrics':
+            self._send_json(200, self.server.service.metrics.to_dict())
+        elif self.path == '/health':
+            self._send_json(200, {'status' : 'ok'})
+        else:
+            self._send_json(404, {'error' : 'Unknown path: %s' % (self.path)})
+
+    def do_POST(self):
+        '''
+        Plan the portfolio posted to /plan, sending its result. Any other path
+        is not found (404). A request whose length is missing or invalid (411)
+        or too large (413), or whose portfolio is not a JSON object (400), is
+        rejected. A request is also rejected if too many requests are pending
+        (503), and times out if its plan is not found in time (504).
+        '''
+        if self.path != '/plan':
+            self._send_json(404, {'error' : 'Unknown path: %s' % (self.path)})
+            return
+
+        portfolio = self._read_portfolio()
+
+        if portfolio is None:
+            self.server.service.metrics.count_invalid()
+            return
+
+        [status, result] = self.server.service.plan(portfolio)
+
+        if result is None:
+            self._send_json(status, {'error' : 'Too many pending requests'}, {'Retry-After' : '1'})
+        else:
+            self._send_json(status, result)
+
+    def log_message(self, format, *args):
+        '''
+        Only log requests if the server is verbose.
+        '''
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _read_portfolio(self):
+        '''
+        Read the portfolio posted with the request, which must be a JSON object.
+        Return the portfolio as a string, or None if it is invalid, in which
+        case an error has been sent.
+        '''
+        try:
+            length = int(self.headers.getheader('Content-Length'))
+        except (TypeError, ValueError):
+            length = -1
+
+        if (length < 0) or (length > MAX_BODY_BYTES):
+            self._send_json(413 if (length > 0) else 411, {'error' : 'Invalid request length'})
+            return None
+
+        portfolio = self.rfile.read(length)
+
+        try:
+            isValid = isinstance(json.loads(portfolio), dict)
+        except ValueError:
+            isValid = False
+
+        if not isValid:
+            self._send_json(400, {'error' : 'Portfolio must be a JSON object'})
+            return None
+
+        return portfolio
+
+    def _send_json(self, status, body, headers=None):
+        '''
+        Send the given response status and JSON body.
+        '''
+        content = json.dumps(body, sort_keys=True)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+
+        for [header, value] in (headers or dict()).iteritems():
+            self.send_header(header, value)
+
+        self.end_headers()
+        self.wfile.write(content)
+
+class ServiceServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    Class to serve requests to a planner service, each on its own thread.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ServiceHandler)
+
+        self.service = service
+        self.verbose = verbose
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+
+    parser.add_argument(
+        '--host', dest='host', default=DEFAULT_HOST,
+        help='Address to listen on')
+
+    parser.add_argument(
+        '-p', '--port', dest='port', type=int, default=DEFAULT_PORT,
+        help='Port to listen on')
+
+    parser.add_argument(
+        '-e', '--engine', dest='engine', choices=loan_planner.ENGINE_NAMES,
+        default=payment_device.DEFAULT_ENGINE, help='Payment simulation engine')
+
+    parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=multiprocessing.cpu_count(),
+        help='Number of processes to plan portfolios with')
+
+    parser.add_argument(
+        '-q', '--queue-size', dest='queue_size', type=int, default=None,
+        help='Number of requests which may wait for a plan before others are rejected (4 per job by default)')
+
+    parser.add_argument(
+        '--timeout', dest='timeout', type=float, default=DEFAULT_TIMEOUT,
+        help='Seconds a request may wait for its plan')
+
+    parser.add_argument(
+        '--cache-dir', dest='cache_dir', default=None,
+        help='Directory in which to cache simulation results between runs')
+
+    parser.add_argument(
+        '-v', '--verbose', dest='verbose', action='store_true',
+        help='Log each request')
+
+    args = parser.parse_args()
+
+    # Worker processes are started before any request handler thread
+    service = PlannerService(args.engine, args.jobs, args.queue_size, args.cache_dir, args.timeout)
+
+    try:
+        server = ServiceServer((args.host, args.port), service, args.verbose)
+    except:
+        service.close()
+        raise
+
+    print 'Serving plans on http://%s:%d' % server.server_address
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
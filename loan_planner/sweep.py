@@ -0,0 +1,183 @@
+'''
+Sweep a grid of upfront payments and monthly payment increases, and report the
+payment statistics of the best plan at each point of the grid as CSV.
+
+The grid is evaluated in batches. Within a batch, every point is simulated
+side by side for each heuristic, rather than planning each point on its own.
+Each range is given as START:STOP:STEP, including STOP, or as a single amount.
+If a range is not given, the configured amount is used.
+
+Example
+-------
+python sweep.py -c loans.ini -u 0:5000:500 -i 0:200:50
+python sweep.py -c loans.ini -i 0:500:10 -o savings.csv
+'''
+import argparse
+import csv
+import sys
+
+import numpy
+
+import loan_planner
+import payment_device
+import scenario_device
+
+# Default number of grid points simulated side by side
+DEFAULT_BATCH_SIZE = 256
+
+# Columns of the table, in order
+COLUMNS = [
+    'upfrontPayment',
+    'monthlyIncrease',
+    'heuristic',
+    'amountPaid',
+    'monthsPaid',
+    'yearsPaid',
+    'finishDate',
+    'finishAge',
+    'paymentDifference',
+    'monthsDifference',
+]
+
+def parse_range(value):
+    '''
+    Return the amounts in a range given as START:STOP:STEP, including STOP, or
+    as a single amount.
+    '''
+    parts = [float(x) for x in value.split(':')]
+
+    if len(parts) == 1:
+        return parts
+
+    if (len(parts) != 3) or (parts[2] <= 0):
+        raise argparse.ArgumentTypeError('Invalid range: %s' % (value))
+
+    [start, stop, step] = parts
+    count = int(round((stop - start) / step)) + 1
+
+    return [start + (x * step) for x in xrange(max(count, 0))]
+
+def sweep(loanPlanner, points, batchSize=DEFAULT_BATCH_SIZE):
+    '''
+    Generate the upfront payment, monthly increase, heuristic and payment
+    statistics of the best plan at each of the given points, in order. The
+    plans without changes are found once by the given loan planner, whose
+    config must have been parsed, and the same heuristics are then used to plan
+    each point. A point without changes uses the best of those plans.
+    Statistics are None for points without a plan.
+    '''
+    loanPlanner.find_initial_plan()
+
+    initialPlan = loanPlanner.bestInitialPlan
+    heuristics = list(loanPlanner.initialPaymentDevices)
+
+    if not initialPlan:
+        for [upfrontPayment, monthlyIncrease] in points:
+            yield [upfrontPayment, monthlyIncrease, None, None]
+
+        return
+
+    initialHeuristic = [h for [h, x] in loanPlanner.initialPaymentDevices.iteritems() if x is initialPlan][0]
+
+    for start in xrange(0, len(points), batchSize):
+        batch = points[start:start + batchSize]
+        changes = [x for x in batch if any(x)]
+
+        best = dict()
+
+        if changes:
+            bestAmountsPaid = numpy.full(len(changes), float('inf'))
+            bestPlans = [[None, None]] * len(changes)
+
+            for heuristic in heuristics:
+                loanSets = [loanPlanner.get_changed_loans(heuristic, *x) for x in changes]
+
+                paymentDevice = scenario_device.ScenarioPaymentDevice(
+                    loanPlanner.loanConfig.dateOfBirth, loanSets, heuristic, bestAmountsPaid)
+
+                for [index, paymentStats] in enumerate(paymentDevice.pay_loans()):
+                    if paymentStats and (paymentStats.amountPaid < bestAmountsPaid[index]):
+                        bestAmountsPaid[index] = paymentStats.amountPaid
+                        bestPlans[index] = [heuristic, paymentStats]
+
+            best = dict(zip(changes, bestPlans))
+
+        for point in batch:
+            [heuristic, paymentStats] = best.get(point, [initialHeuristic, initialPlan.paymentStats])
+            yield list(point) + [heuristic, paymentStats]
+
+def get_row(upfrontPayment, monthlyIncrease, heuristic, paymentStats, initialStats):
+    '''
+    Return a row of the table for a single point of the grid.
+    '''
+    row = {'upfrontPayment' : upfrontPayment, 'monthlyIncrease' : monthlyIncrease}
+
+    if paymentStats:
+        row['heuristic'] = heuristic.__name__
+        row.update(paymentStats.to_dict())
+        row.update(initialStats.compare(paymentStats).to_dict())
+
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+
+    parser.add_argument(
+        '-c', '--config-file-path', dest='config_file_path',
+        default=loan_planner.DEFAULT_CONFIG_FILE_PATH, help='Path to loan configuration file')
+
+    parser.add_argument(
+        '-u', '--upfront', dest='upfront', type=parse_range, default=None,
+        help='Range of upfront payments')
+
+    parser.add_argument(
+        '-i', '--increase', dest='increase', type=parse_range, default=None,
+        help='Range of monthly payment increases')
+
+    parser.add_argument(
+        '-e', '--engine', dest='engine', choices=loan_planner.ENGINE_NAMES,
+        default=payment_device.DEFAULT_ENGINE, help='Payment simulation engine for the plans without changes')
+
+    parser.add_argument(
+        '-b', '--batch-size', dest='batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+        help='Number of grid points to simulate side by side')
+
+    parser.add_argument(
+        '-o', '--output', dest='output', default='-',
+        help='Path to CSV table ("-" for stdout)')
+
+    args = parser.parse_args()
+
+    loanPlanner = loan_planner.LoanPlanner(args.config_file_path, args.engine)
+
+    if not loanPlanner.loanConfig.parsed():
+        print 'Could not parse given config file: %s' % (args.config_file_path)
+        return False
+
+    upfrontPayments = args.upfront or [loanPlanner.loanConfig.upfrontPayment]
+    monthlyIncreases = args.increase or [loanPlanner.loanConfig.monthlyIncrease]
+
+    points = [(x, y) for x in upfrontPayments for y in monthlyIncreases]
+
+    output = sys.stdout if (args.output == '-') else open(args.output, 'wb')
+    success = True
+
+    try:
+        writer = csv.DictWriter(output, COLUMNS)
+        writer.writeheader()
+
+        for [upfrontPayment, monthlyIncrease, heuristic, paymentStats] in sweep(loanPlanner, points, args.batch_size):
+            initialStats = loanPlanner.bestInitialPlan.paymentStats if paymentStats else None
+            writer.writerow(get_row(upfrontPayment, monthlyIncrease, heuristic, paymentStats, initialStats))
+
+            success = success and bool(paymentStats)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    return success
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,294 @@
+'''
+vector_device
+'''
+import datetime
+import heapq
+
+import numpy
+
+import allocation
+import loan_config
+import payment_device
+
+class LoanArrays(object):
+    '''
+    Class to store the data of a set of loans as parallel arrays. It has the
+    same attributes and interest calculations as a single loan, so priority
+    keys of heuristics can be evaluated for all loans at once.
+    '''
+    get_interest_accrued = loan_config.Loan.__dict__['get_interest_accrued']
+    get_interest_to_payment_ratio = loan_config.Loan.__dict__['get_interest_to_payment_ratio']
+
+    def __init__(self, loans):
+        self.name = numpy.array([loan.name for loan in loans], dtype=object)
+        self.balance = numpy.array([loan.balance for loan in loans], dtype=float)
+        self.interestRate = numpy.array([loan.interestRate for loan in loans], dtype=float)
+        self.monthlyPayment = numpy.array([loan.monthlyPayment for loan in loans], dtype=float)
+        self.paymentDay = numpy.array([loan.paymentDay for loan in loans], dtype=int)
+        self.unpaid = numpy.ones(len(loans), dtype=bool)
+
+class VectorPaymentDevice(payment_device.PaymentDevice):
+    '''
+    Payment device which stores all loans as NumPy arrays, and makes each
+    month's payments as a single vectorized step. The month is only split when
+    a loan is paid off, so that its monthly payment can be reallocated before
+    the payments due later in the month. Payment plans are the same as stepping
+    day by day, and totals agree to within rounding error.
+    '''
+    def __init__(self, dateOfBirth, loans, allocationDecider, bestDevice=None, pruneBound=None, profile=None,
+            scheduleSink=None, checkpoints=None, boundPruning=False):
+        super(VectorPaymentDevice, self).__init__(dateOfBirth, loans, allocationDecider, bestDevice, pruneBound, profile,
+            scheduleSink, checkpoints, boundPruning)
+
+        self.vectorLoans = list()
+        self.loanIndices = dict()
+        self.arrays = None
+        self.sinkIndices = None
+
+        self.month = 0
+        self.lastPaymentDay = 0
+
+    def _schedule_payments(self, startDate):
+        '''
+        Store the loans as arrays, and start making payments in the month of the
+        start date from its day of the month.
+        '''
+        self.vectorLoans = list(self.loans)
+        self.loanIndices = dict((loan, index) for [index, loan] in enumerate(self.vectorLoans))
+        self.arrays = LoanArrays(self.vectorLoans)
+
+        if self.scheduleSink:
+            self.sinkIndices = numpy.array([self.scheduleSink.get_loan_index(x) for x in self.vectorLoans], dtype=int)
+
+        self.month = (startDate.year * 12) + startDate.month - 1
+        self.lastPaymentDay = startDate.day - 1
+
+    def release(self):
+        '''
+        Free the payment plan, arrays and simulation state of this device,
+        keeping only its payment statistics.
+        '''
+        super(VectorPaymentDevice, self).release()
+
+        self.vectorLoans = list()
+        self.loanIndices = dict()
+        self.arrays = None
+        self.sinkIndices = None
+
+    def _sync_loans(self):
+        '''
+        Update the balance and monthly payment of each unpaid loan from the
+        arrays.
+        '''
+        for index in numpy.flatnonzero(self.arrays.unpaid):
+            self._get_loan(index)
+
+    def _make_payments_until_loan_paid(self, currentDate):
+        '''
+        Make loan payments a month at a time, starting at the current date.
+        Stop when one or more loans have been paid off, or if this device has
+        already paid more than the given best device. Return a list of those
+        paid loans and the day after they were paid off.
+        '''
+        arrays = self.arrays
+        maxMonth = payment_device.PaymentDevice.MAX_YEAR * 12
+
+        paidLoans = list()
+
+        while not paidLoans and (self.month < maxMonth):
+            if self._should_prune_plan():
+                self.paymentPlan.append((payment_device.PLAN_PRUNED, self.paymentStats.amountPaid))
+                break
+
+            paymentMonth = self.month
+            daysInMonth = payment_device.get_days_in_month(self.month)
+            daysInLastMonth = payment_device.get_days_in_month(self.month - 1)
+
+            paymentDay = arrays.paymentDay
+            indices = numpy.flatnonzero(arrays.unpaid & \
+                (paymentDay > self.lastPaymentDay) & (paymentDay <= daysInMonth))
+
+            paymentDay = paymentDay[indices]
+            days = numpy.maximum(daysInLastMonth, paymentDay)
+
+            balance = arrays.balance[indices]
+            interest = (balance * arrays.interestRate[indices]) * (days / 365.0)
+            balance += interest
+            payment = arrays.monthlyPayment[indices]
+            paid = (balance <= payment)
+
+            if paid.any():
+                # Only make the payments up to and including the first payoff
+                payoffDay = paymentDay[paid].min()
+                due = (paymentDay <= payoffDay)
+
+                [indices, interest, balance, payment, paid] = \
+                    [indices[due], interest[due], balance[due], payment[due], paid[due]]
+                payment = numpy.where(paid, balance, payment)
+
+                [year, month] = divmod(self.month, 12)
+                currentDate = currentDate.replace(year=year, month=month + 1, day=int(payoffDay))
+                currentDate += payment_device.PaymentDevice.ONE_DAY_DELTA
+
+                self.lastPaymentDay = payoffDay
+            else:
+                self.month += 1
+                self.lastPaymentDay = 0
+
+            arrays.balance[indices] = balance - payment
+            self.paymentStats.amountPaid += float(payment.sum())
+
+            if self.scheduleSink:
+                self._write_payments(paymentMonth, indices, interest, payment)
+
+            if self.profile:
+                self.profile.daysStepped += len(numpy.unique(arrays.paymentDay[indices]))
+                self.profile.paymentsMade += len(indices)
+
+            for index in indices[paid]:
+                loan = self._get_loan(index)
+
+                arrays.unpaid[index] = False
+                self.loans.remove(loan)
+                paidLoans.append(loan)
+
+        if not paidLoans and (self.month >= maxMonth):
+            currentDate = currentDate.replace(year=payment_device.PaymentDevice.MAX_YEAR, month=1, day=1)
+
+        return [paidLoans, currentDate]
+
+    def _write_payments(self, month, indices, interest, payment):
+        '''
+        Write a record of each payment just made to the loans at the given
+        indices in the given month, in order of payment day.
+        '''
+        order = numpy.argsort(self.arrays.paymentDay[indices], kind='mergesort')
+        [indices, interest, payment] = [indices[order], interest[order], payment[order]]
+
+        [year, month] = divmod(month, 12)
+        firstOfMonth = datetime.date(year, month + 1, 1).toordinal()
+
+        dates = firstOfMonth + self.arrays.paymentDay[indices] - 1
+
+        self.scheduleSink.write_many(dates.tolist(), self.sinkIndices[indices].tolist(), interest.tolist(),
+            (payment - interest).tolist(), self.arrays.balance[indices].tolist())
+
+    def _handle_paid_loan(self, paidLoan, timeSoFar):
+        '''
+        Handle a single paid loan. Decide which loan should receive the paid
+        loan's monthly payment.
+        '''
+        self.paymentPlan.append((payment_device.LOAN_PAID, paidLoan.name, payment_device.to_months(timeSoFar)))
+
+        increasedLoans = self._allocate_dollars(int(paidLoan.monthlyPayment))
+
+        for loan, increase in increasedLoans.iteritems():
+            self.paymentPlan.append((payment_device.PAYMENT_INCREASED, loan.name, increase, loan.monthlyPayment))
+
+        self.paymentPlan.append((payment_device.PAYMENTS_REALLOCATED, ))
+
+    def _allocate_dollars(self, dollars):
+        '''
+        Give the given number of dollars to loans which have a balance greater
+        than their payment, with the same result as calling the heuristic once
+        per dollar. For heuristics with a priority key, the keys of all loans
+        are found at once, and the loan with the lowest key is given dollars
+        until its key rises above the next lowest key.
+        '''
+        arrays = self.arrays
+        priorityKey = getattr(self.allocationDecider, 'priorityKey', None)
+
+        isEligible = lambda x: (x.balance > x.monthlyPayment)
+        getEligibleIndices = lambda : numpy.flatnonzero(arrays.unpaid & (arrays.balance > arrays.monthlyPayment))
+
+        if not priorityKey:
+            loans = [self._get_loan(index) for index in getEligibleIndices()]
+            allocatedDollars = allocation.allocate_dollars(self.allocationDecider, loans, dollars,
+                loan_config.LoanConfig.DAYS_PER_MONTH, isEligible, payment_device.increase_payment)
+
+            for loan in allocatedDollars:
+                arrays.monthlyPayment[self.loanIndices[loan]] = loan.monthlyPayment
+
+            return allocatedDollars
+
+        # Only loans which are given dollars change priority, so the others are
+        # sorted once and the changed loans are kept in a heap
+        indices = getEligibleIndices()
+        priorities = self._get_priorities(priorityKey, indices)
+
+        [position, changed] = [0, list()]
+        allocatedDollars = dict()
+
+        def get_next_best():
+            '''
+            Return the lowest priority among the changed loans and the loans
+            which have not been given any dollars yet.
+            '''
+            if changed and ((position == len(priorities)) or (changed[0] < priorities[position])):
+                return changed[0]
+
+            return priorities[position] if (position < len(priorities)) else None
+
+        while (dollars > 0) and (changed or (position < len(priorities))):
+            if changed and ((position == len(priorities)) or (changed[0] < priorities[position])):
+                index = heapq.heappop(changed)[1]
+            else:
+                index = priorities[position][1]
+                position += 1
+
+            loan = self._get_loan(index)
+            nextBest = get_next_best()
+
+            def is_chosen(given):
+                '''
+                Decide if the loan would still be chosen after being given the
+                given number of dollars.
+                '''
+                probe = loan.clone()
+                payment_device.increase_payment(probe, given)
+
+                if not isEligible(probe):
+                    return False
+
+                priority = (priorityKey(probe, loan_config.LoanConfig.DAYS_PER_MONTH), index)
+                return (nextBest is None) or (priority < nextBest)
+
+            given = allocation.count_while(is_chosen, 1, dollars)
+
+            payment_device.increase_payment(loan, given)
+            arrays.monthlyPayment[index] = loan.monthlyPayment
+
+            allocatedDollars[loan] = allocatedDollars.get(loan, 0) + given
+            dollars -= given
+
+            if isEligible(loan):
+                heapq.heappush(changed, (priorityKey(loan, loan_config.LoanConfig.DAYS_PER_MONTH), index))
+
+        return allocatedDollars
+
+    def _get_priorities(self, priorityKey, indices):
+        '''
+        Return the priority key and index of each of the given loans, sorted by
+        key. Ties are broken by position in the loan list.
+        '''
+        key = priorityKey(self.arrays, loan_config.LoanConfig.DAYS_PER_MONTH)
+        isTuple = isinstance(key, tuple)
+
+        columns = [numpy.broadcast_to(x, self.arrays.balance.shape)[indices] for x in (key if isTuple else (key, ))]
+        order = numpy.lexsort(columns[::-1])
+
+        columns = [x[order].tolist() for x in columns]
+        keys = zip(*columns) if isTuple else columns[0]
+
+        return zip(keys, indices[order].tolist())
+
+    def _get_loan(self, index):
+        '''
+        Return the loan at the given index, with its balance and monthly payment
+        updated from the arrays.
+        '''
+        loan = self.vectorLoans[index]
+        loan.balance = float(self.arrays.balance[index])
+        loan.monthlyPayment = float(self.arrays.monthlyPayment[index])
+
+        return loan